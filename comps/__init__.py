@@ -11,10 +11,12 @@ from comps.cores.proto.docarray import (
     Base64ByteStrDoc,
     DocPath,
     EmbedDoc,
+    EmbedDocBatch,
     GeneratedDoc,
     LLMParamsDoc,
     SearchedDoc,
     SearchedMultimodalDoc,
+    SearchedMultimodalDocBatch,
     LVMSearchedMultimodalDoc,
     RerankedDoc,
     TextDoc,
@@ -48,8 +50,10 @@ from comps.cores.proto.docarray import (
 from comps.cores.mega.constants import MegaServiceEndpoint, ServiceRoleType, ServiceType
 
 # Microservice
-from comps.cores.mega.orchestrator import ServiceOrchestrator
+from comps.cores.mega.orchestrator import CancellableStreamingResponse, ServiceOrchestrator
 from comps.cores.mega.orchestrator_with_yaml import ServiceOrchestratorWithYaml
+from comps.cores.mega.resilience import CircuitOpenError
+from comps.cores.mega.shared_versions import SharedVersions
 from comps.cores.mega.micro_service import MicroService, register_microservice, opea_microservices
 
 # Telemetry
@@ -59,7 +63,7 @@ from comps.cores.telemetry.opea_telemetry import opea_telemetry
 from comps.cores.common.component import OpeaComponent, OpeaComponentRegistry, OpeaComponentLoader
 
 # Statistics
-from comps.cores.mega.base_statistics import statistics_dict, register_statistics
+from comps.cores.mega.base_statistics import statistics_dict, register_statistics, RequestMetricsStore
 
 # Logger
 from comps.cores.mega.logger import CustomLogger
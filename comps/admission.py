@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# off by default: when on, requests beyond the limit are queued by department priority or rejected with 429
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() in ("true", "1", "yes")
+# concurrent requests let through to the pipeline; the limit moves between the min and max
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "32"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "4"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "256"))
+# requests waiting for a slot; beyond it they are rejected with 429
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "128"))
+# seconds a request may wait for a slot before it is rejected with 429
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# LLM time to first token above which the limit shrinks
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "5.0"))
+# lower is served first, e.g. "leadership=0,hr=1,finance=1,operations=2"
+ADMISSION_DEPARTMENT_PRIORITIES = {
+    name.strip().lower(): int(priority)
+    for name, _, priority in (item.partition("=") for item in os.getenv("ADMISSION_DEPARTMENT_PRIORITIES", "").split(","))
+    if name.strip() and priority
+}
+ADMISSION_DEFAULT_PRIORITY = int(os.getenv("ADMISSION_DEFAULT_PRIORITY", "5"))
+
+admission_in_flight = Gauge(
+    "chatqna_admission_in_flight", "Requests admitted to the pipeline", multiprocess_mode="livesum"
+)
+admission_queued = Gauge("chatqna_admission_queued", "Requests waiting for admission", multiprocess_mode="livesum")
+admission_limit = Gauge(
+    "chatqna_admission_limit", "Current adaptive concurrency limit, summed over workers", multiprocess_mode="livesum"
+)
+admission_rejected = Counter("chatqna_admission_rejected", "Requests rejected by admission control", ["reason"])
+admission_wait = Histogram("chatqna_admission_wait", "Seconds requests waited for admission")
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server busy ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def department_priority(departments: Optional[Iterable[str]]) -> int:
+    """Priority of a user: the best of its departments' priorities."""
+    priorities = [ADMISSION_DEPARTMENT_PRIORITIES.get(str(d).lower(), ADMISSION_DEFAULT_PRIORITY) for d in departments or []]
+    return min(priorities, default=ADMISSION_DEFAULT_PRIORITY)
+
+
+class AdmissionController:
+    """Adaptive concurrency limiter with a bounded priority wait queue.
+
+    At most `limit` requests run at once; the others wait in a queue ordered by priority, then
+    arrival. A full queue or a wait longer than `queue_timeout` rejects the request right away.
+    The limit follows the observed LLM latency (AIMD): it shrinks by 10% whenever a request's
+    time to first token exceeds `latency_target`, and grows slowly while the limit is saturated.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = ADMISSION_INITIAL_LIMIT,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        latency_target: float = ADMISSION_LATENCY_TARGET,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.queued = 0
+        # smoothed seconds a request holds its slot, to estimate Retry-After
+        self.service_time = latency_target
+        self._waiters = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+        admission_limit.set(self.limit)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.service_time * (self.queued + 1) / max(self.limit, 1)))
+
+    async def acquire(self, priority: int = ADMISSION_DEFAULT_PRIORITY):
+        """Wait for a slot; raises AdmissionRejected when the queue is full or the wait times out."""
+        if self.in_flight < int(self.limit) and not self.queued:
+            self._admit()
+            return
+        if self.queued >= self.queue_size:
+            admission_rejected.labels(reason="queue_full").inc()
+            raise AdmissionRejected("queue full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        self.queued += 1
+        admission_queued.set(self.queued)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            admission_rejected.labels(reason="timeout").inc()
+            raise AdmissionRejected("queue timeout", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        finally:
+            admission_wait.observe(time.monotonic() - start)
+
+    def release(self, started_at: float, ttft: Optional[float] = None):
+        """Free the slot of a finished request; `ttft` is its LLM time to first token if it streamed."""
+        self.in_flight -= 1
+        admission_in_flight.set(self.in_flight)
+        self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started_at)
+
+        if ttft is not None and ttft > self.latency_target:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        elif self.queued or self.in_flight + 1 >= int(self.limit):
+            # demand exceeds the limit and latency is fine: about one more slot per `limit` requests
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        admission_limit.set(self.limit)
+        self._wake()
+
+    def stats(self) -> Dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued}
+
+    def _admit(self):
+        self.in_flight += 1
+        admission_in_flight.set(self.in_flight)
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # the slot was handed over as the wait ended, give it back
+            self.in_flight -= 1
+            admission_in_flight.set(self.in_flight)
+            self._wake()
+            return
+        future.cancel()
+        self.queued -= 1
+        admission_queued.set(self.queued)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # cancelled while waiting, already uncounted
+                continue
+            self.queued -= 1
+            admission_queued.set(self.queued)
+            self._admit()
+            future.set_result(True)
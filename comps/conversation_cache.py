@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from comps.cores.mega.shared_versions import SharedVersions
+
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", "1000"))
+CONVERSATION_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CONVERSATION_CACHE_IDLE_TTL = float(os.getenv("CONVERSATION_CACHE_IDLE_TTL", "1800"))
+
+conversation_cache_hits = Counter("conversation_cache_hits", "Conversation history cache hits")
+conversation_cache_misses = Counter("conversation_cache_misses", "Conversation history cache misses")
+conversation_cache_evictions = Counter(
+    "conversation_cache_evictions", "Conversation history cache evictions", ["reason"]
+)
+conversation_cache_entries = Gauge(
+    "conversation_cache_entries", "Number of cached conversations", multiprocess_mode="livesum"
+)
+conversation_cache_bytes = Gauge(
+    "conversation_cache_bytes", "Approximate size of the cached conversations", multiprocess_mode="livesum"
+)
+
+
+def estimate_turn_size(turn: Dict) -> int:
+    """Approximate in-memory footprint of a turn by its JSON size"""
+    return len(json.dumps(turn, default=str))
+
+
+class ConversationCache:
+    """Bounded LRU cache of conversation histories with idle-TTL eviction and a byte budget.
+
+    The cache only holds complete histories: a miss means the caller must load the conversation
+    from Mongo and `put` it, and `append` is a no-op for conversations that are not cached.
+    `append` and `pop` bump the conversation's version in shared memory, so the copies other
+    HTTPService workers cached before become misses; call `append` once the turn is stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CONVERSATION_CACHE_MAX_ENTRIES,
+        max_bytes: int = CONVERSATION_CACHE_MAX_BYTES,
+        idle_ttl: float = CONVERSATION_CACHE_IDLE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # conversation_id -> [history, size_in_bytes, last_access, version]
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._versions = SharedVersions()
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def version(self, conversation_id: str) -> int:
+        """Version to `put` a history with; read it before loading the history from Mongo."""
+        return self._versions.get(conversation_id)
+
+    def get(self, conversation_id: str) -> Optional[List[Dict]]:
+        entry = self._entries.get(conversation_id)
+        if entry is not None and self._is_idle(entry):
+            self._evict(conversation_id, "idle")
+            entry = None
+        elif entry is not None and entry[3] != self.version(conversation_id):
+            # changed by another worker
+            self._evict(conversation_id, "stale")
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            conversation_cache_misses.inc()
+            self._shrink()
+            return None
+
+        self.hits += 1
+        conversation_cache_hits.inc()
+        entry[2] = time.monotonic()
+        self._entries.move_to_end(conversation_id)
+        return entry[0]
+
+    def put(self, conversation_id: str, history: List[Dict], version: Optional[int] = None):
+        self._remove(conversation_id)
+        size = sum(estimate_turn_size(turn) for turn in history)
+        if version is None:
+            version = self.version(conversation_id)
+        self._entries[conversation_id] = [list(history), size, time.monotonic(), version]
+        self._bytes += size
+        self._shrink()
+
+    def append(self, conversation_id: str, turn: Dict):
+        version = self._versions.bump(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if entry[3] != version - 1:
+            # another worker changed the conversation too, this copy misses its turns
+            self._evict(conversation_id, "stale")
+            return
+        entry[3] = version
+        size = estimate_turn_size(turn)
+        entry[0].append(turn)
+        entry[1] += size
+        entry[2] = time.monotonic()
+        self._bytes += size
+        self._entries.move_to_end(conversation_id)
+        self._shrink()
+
+    def pop(self, conversation_id: str, default=None):
+        """Remove a conversation, e.g. deleted, from the cache of every worker."""
+        self._versions.bump(conversation_id)
+        return self._remove(conversation_id, default)
+
+    def _remove(self, conversation_id: str, default=None):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is None:
+            return default
+        self._bytes -= entry[1]
+        self._update_gauges()
+        return entry[0]
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+    def _is_idle(self, entry) -> bool:
+        return self.idle_ttl > 0 and time.monotonic() - entry[2] > self.idle_ttl
+
+    def _evict(self, conversation_id: str, reason: str):
+        if self._remove(conversation_id) is not None:
+            conversation_cache_evictions.labels(reason=reason).inc()
+
+    def _shrink(self):
+        # entries are in access order, so idle ones sit at the front
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if self._is_idle(oldest):
+                self._evict(oldest_id, "idle")
+            elif len(self._entries) > self.max_entries:
+                self._evict(oldest_id, "capacity")
+            elif self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict(oldest_id, "memory")
+            else:
+                break
+        self._update_gauges()
+
+    def _update_gauges(self):
+        conversation_cache_entries.set(len(self._entries))
+        conversation_cache_bytes.set(self._bytes)
@@ -1,25 +1,126 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
 import numpy as np
 
 # name => statistic dict
 statistics_dict = {}
 
+# with several worker processes, latencies are also shared through files next to the Prometheus ones
+STATISTICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# latencies kept per statistic and process; the statistics cover the most recent ones
+STATISTICS_MAX_SAMPLES = int(os.getenv("STATISTICS_MAX_SAMPLES", "10000"))
+# seconds between two writes of the latencies of a process to its file in STATISTICS_DIR
+STATISTICS_FLUSH_INTERVAL = float(os.getenv("STATISTICS_FLUSH_INTERVAL", "5"))
+
+# statistics with latencies not yet written to their file, and the pid running the writer thread
+_unflushed = set()
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _schedule_flush(statistic):
+    """Have the writer thread of this process write the file of `statistic` on its next round."""
+    global _flusher_pid
+    with _flusher_lock:
+        _unflushed.add(statistic)
+        # threads do not survive a fork, every worker starts its own writer
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name="statistics-writer", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(STATISTICS_FLUSH_INTERVAL)
+        with _flusher_lock:
+            pending = list(_unflushed)
+            _unflushed.clear()
+        for statistic in pending:
+            try:
+                statistic.flush()
+            except OSError as e:
+                print(f"Failed to write the statistics of {statistic.name}: {e}")
+
+
+def remove_process_statistics(pid: int):
+    """Remove the statistic files of a process that exited."""
+    if not STATISTICS_DIR:
+        return
+    for path in glob.glob(os.path.join(glob.escape(STATISTICS_DIR), f"statistics_*_{pid}.stats")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 
 class BaseStatistics:
-    """Base class to store in-memory statistics of an entity for measurement in one service."""
+    """Base class to store in-memory statistics of an entity for measurement in one service.
+
+    The last STATISTICS_MAX_SAMPLES latencies are kept. When PROMETHEUS_MULTIPROC_DIR is set, a
+    background thread of each process also writes them to its own file there every
+    STATISTICS_FLUSH_INTERVAL seconds, and the statistics cover all the worker processes.
+    """
 
     def __init__(
         self,
+        name=None,
     ):
-        self.response_times = []  # store responses time for all requests
-        self.first_token_latencies = []  # store first token latencies for all requests
+        self.name = name
+        self.response_times = deque(maxlen=STATISTICS_MAX_SAMPLES)  # responses time of recent requests
+        self.first_token_latencies = deque(maxlen=STATISTICS_MAX_SAMPLES)  # first token latencies of recent requests
+        self._lock = threading.Lock()
+
+    def _file_prefix(self):
+        return os.path.join(STATISTICS_DIR, "statistics_" + re.sub(r"[^\w.-]", "_", self.name))
 
     def append_latency(self, latency, first_token_latency=None):
-        self.response_times.append(latency)
-        if first_token_latency:
-            self.first_token_latencies.append(first_token_latency)
+        with self._lock:
+            self.response_times.append(latency)
+            if first_token_latency:
+                self.first_token_latencies.append(first_token_latency)
+        if STATISTICS_DIR and self.name:
+            _schedule_flush(self)
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self.response_times), list(self.first_token_latencies)
+
+    def flush(self):
+        """Replace the file of this process with its current latencies."""
+        response_times, first_token_latencies = self._snapshot()
+        path = f"{self._file_prefix()}_{os.getpid()}.stats"
+        # write then rename, so readers never see a partial file
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"latency": response_times, "latency_first_token": first_token_latencies}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _all_latencies(self):
+        """Latencies of this process and, from their files, of the other worker processes."""
+        response_times, first_token_latencies = self._snapshot()
+        prefix = self._file_prefix()
+        own_path = f"{prefix}_{os.getpid()}.stats"
+        for path in glob.glob(f"{glob.escape(prefix)}_*.stats"):
+            if path == own_path or not path[len(prefix) + 1 : -len(".stats")].isdigit():
+                # this process, or statistics of another name sharing this prefix
+                continue
+            try:
+                with open(path) as f:
+                    latencies = json.load(f)
+            except (OSError, ValueError):
+                # removed since, the worker exited
+                continue
+            response_times.extend(latencies.get("latency", []))
+            first_token_latencies.extend(latencies.get("latency_first_token", []))
+        return response_times, first_token_latencies
 
     def _add_statistics(self, result, stats, suffix):
         "add P50 (median), P99 and average values for 'stats' array to 'result' dict"
@@ -35,8 +136,107 @@ class BaseStatistics:
     def get_statistics(self):
         "return stats dict with P50, P99 and average values for first token and response timings"
         result = {}
-        self._add_statistics(result, self.response_times, "latency")
-        self._add_statistics(result, self.first_token_latencies, "latency_first_token")
+        if STATISTICS_DIR and self.name:
+            response_times, first_token_latencies = self._all_latencies()
+        else:
+            response_times, first_token_latencies = self._snapshot()
+        self._add_statistics(result, response_times, "latency")
+        self._add_statistics(result, first_token_latencies, "latency_first_token")
+        return result
+
+
+class RequestMetricsStore:
+    """Bounded store of per-request metrics with rolling per-minute aggregates.
+
+    In-flight entries expire after `ttl` seconds and the oldest are dropped beyond `max_entries`,
+    so requests that never complete (aborted streams, disconnects, errors) cannot leak. Completed
+    requests are folded into one bucket per minute, and the last `window_minutes` buckets are kept.
+    """
+
+    fields = ("ttft", "e2e_latency", "throughput", "prompt_tokens")
+
+    def __init__(
+        self,
+        ttl: float = float(os.getenv("REQUEST_METRICS_TTL", "600")),
+        max_entries: int = int(os.getenv("REQUEST_METRICS_MAX_ENTRIES", "10000")),
+        window_minutes: int = int(os.getenv("REQUEST_METRICS_WINDOW_MINUTES", "15")),
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.window_minutes = window_minutes
+        self._entries = OrderedDict()  # request_id => (created_at, metrics dict)
+        self._buckets = deque()  # (minute, {field: [values]}), oldest first
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def start(self, request_id: str) -> dict:
+        """Track a new in-flight request and return its mutable metrics dict."""
+        metrics = {"ttft": 0.0, "e2e_latency": 0.0, "completed": False, "output_tokens": 0, "throughput": 0.0}
+        with self._lock:
+            self._entries[request_id] = (time.monotonic(), metrics)
+            self._entries.move_to_end(request_id)
+            self._evict()
+        return metrics
+
+    def get(self, request_id: str):
+        with self._lock:
+            entry = self._entries.get(request_id)
+        return entry[1] if entry else None
+
+    def complete(self, request_id: str, **values):
+        """Record the final metrics of a request and stop tracking it."""
+        with self._lock:
+            entry = self._entries.pop(request_id, None)
+            metrics = entry[1] if entry else {}
+            metrics.update(values)
+            metrics["completed"] = True
+            bucket = self._current_bucket()
+            for field in self.fields:
+                if metrics.get(field) is not None:
+                    bucket[field].append(float(metrics[field]))
+        return metrics
+
+    def discard(self, request_id: str):
+        with self._lock:
+            self._entries.pop(request_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            request_id, (created_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_entries or now - created_at > self.ttl:
+                self._entries.popitem(last=False)
+                self.expired += 1
+            else:
+                break
+
+    def _current_bucket(self) -> dict:
+        minute = int(time.time() // 60)
+        if not self._buckets or self._buckets[-1][0] != minute:
+            self._buckets.append((minute, {field: [] for field in self.fields}))
+        while self._buckets and self._buckets[0][0] <= minute - self.window_minutes:
+            self._buckets.popleft()
+        return self._buckets[-1][1]
+
+    def get_statistics(self):
+        "return in-flight counts and P50, P95, P99 of TTFT, e2e latency, throughput and prompt tokens for each recent minute"
+        with self._lock:
+            self._evict()
+            self._current_bucket()
+            buckets = [(minute, {k: list(v) for k, v in values.items()}) for minute, values in self._buckets]
+            result = {"in_flight": len(self._entries), "expired": self.expired, "per_minute": []}
+
+        for minute, values in buckets:
+            if not values["e2e_latency"]:
+                continue
+            aggregate = {
+                "minute": time.strftime("%Y-%m-%dT%H:%M:00Z", time.gmtime(minute * 60)),
+                "requests": len(values["e2e_latency"]),
+            }
+            for field, stats in values.items():
+                for p in (50, 95, 99):
+                    aggregate[f"p{p}_{field}"] = float(np.percentile(stats, p)) if stats else None
+            result["per_minute"].append(aggregate)
         return result
 
 
@@ -45,7 +245,7 @@ def register_statistics(
 ):
     def decorator(func):
         for name in names:
-            statistics_dict[name] = BaseStatistics()
+            statistics_dict[name] = BaseStatistics(name)
         return func
 
     return decorator
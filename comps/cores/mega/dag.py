@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from collections import OrderedDict, defaultdict
-from copy import deepcopy
+from types import MappingProxyType
 
 
 class DAG(object):
@@ -14,6 +14,7 @@ class DAG(object):
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self._plan = None
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -30,6 +31,7 @@ class DAG(object):
         for node, edges in graph.items():
             if node_name in edges:
                 edges.remove(node_name)
+        self._plan = None
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,19 +43,29 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the edge closes a cycle iff ind_node is reachable from dep_node
+        if ind_node == dep_node or ind_node in self._reachable(dep_node):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self._plan = None
+
+    def _reachable(self, node) -> set:
+        graph = self.graph
+        seen = set()
+        stack = [node]
+        while stack:
+            for downstream_node in graph[stack.pop()]:
+                if downstream_node not in seen:
+                    seen.add(downstream_node)
+                    stack.append(downstream_node)
+        return seen
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self._plan = None
 
     def predecessors(self, node):
         graph = self.graph
@@ -95,6 +107,13 @@ class DAG(object):
 
     def reset_graph(self):
         self.graph = OrderedDict()
+        self._plan = None
+
+    def plan(self) -> "ExecutionPlan":
+        """Return the compiled, immutable plan of the graph; it is rebuilt after the graph changes."""
+        if self._plan is None:
+            self._plan = ExecutionPlan(self.graph)
+        return self._plan
 
     def ind_nodes(self, graph=None):
         graph = graph if graph is not None else self.graph
@@ -140,3 +159,154 @@ class DAG(object):
 
     def size(self):
         return len(self.graph)
+
+
+class ExecutionPlan(object):
+    """Immutable snapshot of a DAG with forward and reverse adjacency and a topological order.
+
+    It is compiled once and shared by all requests; per-request changes go to a RuntimeGraph.
+    """
+
+    __slots__ = ("nodes", "order", "downstreams", "upstreams", "ind_nodes", "leaves", "_index")
+
+    def __init__(self, graph):
+        upstreams = {node: [] for node in graph}
+        for node, dependents in graph.items():
+            for dependent in dependents:
+                upstreams[dependent].append(node)
+
+        # nodes keep the insertion order of the graph, as DAG.all_leaves and DAG.ind_nodes do
+        self.nodes = tuple(graph)
+        self.order = tuple(DAG().topological_sort(graph))
+        self.downstreams = MappingProxyType({node: tuple(graph[node]) for node in graph})
+        self.upstreams = MappingProxyType({node: tuple(upstreams[node]) for node in graph})
+        self.ind_nodes = tuple(node for node in self.nodes if not self.upstreams[node])
+        self.leaves = tuple(node for node in self.nodes if not self.downstreams[node])
+        self._index = {node: i for i, node in enumerate(self.order)}
+
+    def __contains__(self, node) -> bool:
+        return node in self.downstreams
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_index"):
+            raise AttributeError("ExecutionPlan is immutable")
+        object.__setattr__(self, name, value)
+
+
+class RuntimeGraph(object):
+    """Per-request view of an ExecutionPlan.
+
+    Deleted nodes, deleted edges and added edges are recorded in an overlay on top of the shared
+    plan, so a request can skip or bypass nodes without copying the graph. It offers the read and
+    edit methods of DAG that the orchestrator and the megaservice hooks use.
+    """
+
+    def __init__(self, plan: ExecutionPlan):
+        self.plan = plan
+        self._deleted_nodes = set()
+        self._deleted_edges = set()
+        self._added = defaultdict(list)
+        self._added_reverse = defaultdict(list)
+
+    def __contains__(self, node) -> bool:
+        return node in self.plan and node not in self._deleted_nodes
+
+    def _check(self, node):
+        if node not in self:
+            raise KeyError("node %s is not in graph" % node)
+
+    def _live(self, node, others, reverse=False) -> list:
+        result = []
+        for other in others:
+            edge = (other, node) if reverse else (node, other)
+            if other not in self._deleted_nodes and edge not in self._deleted_edges and other not in result:
+                result.append(other)
+        return result
+
+    def downstream(self, node) -> list:
+        self._check(node)
+        return self._live(node, self.plan.downstreams[node] + tuple(self._added.get(node, ())))
+
+    def predecessors(self, node) -> list:
+        self._check(node)
+        return self._live(node, self.plan.upstreams[node] + tuple(self._added_reverse.get(node, ())), reverse=True)
+
+    def add_edge(self, ind_node, dep_node):
+        self._check(ind_node)
+        self._check(dep_node)
+        if dep_node in self.downstream(ind_node):
+            return
+        if ind_node == dep_node or ind_node in self._reachable(dep_node):
+            raise Exception("validation error!")
+        self._deleted_edges.discard((ind_node, dep_node))
+        if dep_node not in self.plan.downstreams[ind_node]:
+            self._added[ind_node].append(dep_node)
+            self._added_reverse[dep_node].append(ind_node)
+
+    def delete_edge(self, ind_node, dep_node):
+        if ind_node not in self or dep_node not in self.downstream(ind_node):
+            raise KeyError("this edge does not exist in graph")
+        self._deleted_edges.add((ind_node, dep_node))
+
+    def delete_node(self, node_name):
+        self._check(node_name)
+        self._deleted_nodes.add(node_name)
+
+    def delete_node_if_exists(self, node_name):
+        self._deleted_nodes.add(node_name)
+
+    def skip(self, node):
+        """Remove `node` and connect its predecessors straight to its downstream nodes."""
+        downstreams = self.downstream(node)
+        for predecessor in self.predecessors(node):
+            for downstream_node in downstreams:
+                self.add_edge(predecessor, downstream_node)
+        self.delete_node(node)
+
+    def prune(self, roots):
+        """Delete the nodes no longer reachable from `roots`."""
+        reachable = set(node for node in roots if node in self)
+        for node in list(reachable):
+            reachable |= self._reachable(node)
+        for node in self.plan.nodes:
+            if node not in reachable:
+                self._deleted_nodes.add(node)
+
+    def _reachable(self, node) -> set:
+        seen = set()
+        stack = [node]
+        while stack:
+            for downstream_node in self.downstream(stack.pop()):
+                if downstream_node not in seen:
+                    seen.add(downstream_node)
+                    stack.append(downstream_node)
+        return seen
+
+    def nodes(self) -> list:
+        return [node for node in self.plan.nodes if node not in self._deleted_nodes]
+
+    @property
+    def graph(self):
+        """The effective graph as a DAG-style mapping, built on demand."""
+        return OrderedDict((node, set(self.downstream(node))) for node in self.nodes())
+
+    def ind_nodes(self):
+        return [node for node in self.nodes() if not self.predecessors(node)]
+
+    def all_leaves(self):
+        return [node for node in self.nodes() if not self.downstream(node)]
+
+    def all_downstreams(self, node):
+        return self.topological_sort(self._reachable(node))
+
+    def topological_sort(self, subset=None):
+        nodes = self.nodes() if subset is None else [node for node in self.nodes() if node in subset]
+        if not self._added:
+            # removals keep the compiled order valid
+            return sorted(nodes, key=self.plan._index.__getitem__)
+        nodes_set = set(nodes)
+        graph = OrderedDict((node, [d for d in self.downstream(node) if d in nodes_set]) for node in nodes)
+        return DAG().topological_sort(graph)
+
+    def size(self):
+        return len(self.nodes())
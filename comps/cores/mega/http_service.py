@@ -4,7 +4,11 @@
 import asyncio
 import logging
 import multiprocessing
+import os
 import re
+import signal
+import socket
+import time
 from typing import Optional
 
 from fastapi import FastAPI
@@ -13,7 +17,16 @@ from prometheus_fastapi_instrumentator import Instrumentator
 from uvicorn import Config, Server
 
 from .base_service import BaseService
-from .base_statistics import collect_all_statistics
+from .base_statistics import collect_all_statistics, remove_process_statistics
+
+# pre-forked worker processes serving the port; with 1 the service is served from this process
+HTTP_SERVICE_WORKERS = int(os.getenv("HTTP_SERVICE_WORKERS", "1"))
+# give every worker its own SO_REUSEPORT socket, instead of all of them accepting on one shared socket
+HTTP_SERVICE_REUSE_PORT = os.getenv("HTTP_SERVICE_REUSE_PORT", "false").lower() in ("true", "1", "yes")
+# seconds a stopping worker may take to finish its in-flight requests before they are cancelled
+HTTP_SERVICE_GRACEFUL_TIMEOUT = int(os.getenv("HTTP_SERVICE_GRACEFUL_TIMEOUT", "30"))
+# Prometheus multiprocess mode; it must be set before prometheus_client is imported
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
 
 
 class HTTPService(BaseService):
@@ -26,17 +39,24 @@ class HTTPService(BaseService):
         self,
         uvicorn_kwargs: Optional[dict] = None,
         cors: Optional[bool] = True,
+        workers: Optional[int] = None,
         **kwargs,
     ):
         """Initialize the HTTPService
         :param uvicorn_kwargs: Dictionary of kwargs arguments that will be passed to Uvicorn server when starting the server
         :param cors: If set, a CORS middleware is added to FastAPI frontend to allow cross-origin access.
+        :param workers: Number of pre-forked worker processes, HTTP_SERVICE_WORKERS by default.
 
         :param kwargs: keyword args
         """
         super().__init__(**kwargs)
         self.uvicorn_kwargs = uvicorn_kwargs or {}
         self.cors = cors
+        self.workers = max(1, workers or HTTP_SERVICE_WORKERS)
+        self._shutdown_callbacks = []
+        self._worker_init_callbacks = []
+        self._sockets = []
+        self._worker_pids = {}  # pid => start time
         self._app = self._create_app()
         Instrumentator().instrument(self._app).expose(self._app)
 
@@ -98,9 +118,43 @@ class HTTPService(BaseService):
         async def startup_event():
             asyncio.create_task(func)
 
+    def add_shutdown_event(self, func):
+        """Register an async callable awaited when the server is terminated, e.g. to close client pools."""
+        self._shutdown_callbacks.append(func)
+
+    def add_worker_init(self, func):
+        """Register an async callable awaited in every serving process before it serves requests.
+
+        With several workers it runs in each worker after the fork, e.g. to open database clients
+        that must not be shared across processes; otherwise it runs once when the service starts.
+        """
+        self._worker_init_callbacks.append(func)
+
+    async def _run_worker_init(self):
+        for callback in self._worker_init_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                self.logger.error(f"Worker init callback {callback} failed: {e}")
+
     async def initialize_server(self):
         """Initialize and return HTTP server."""
         self.logger.info("Setting up HTTP server")
+        logging.getLogger("uvicorn.access").addFilter(lambda record: "/v1/health_check" not in record.getMessage())
+        if self.workers > 1:
+            # the server is set up in every worker once they are forked, see start()
+            if not HTTP_SERVICE_REUSE_PORT:
+                self._sockets = [self._create_server().config.bind_socket()]
+            self.logger.info(f"HTTP server will run {self.workers} workers on port {self.primary_port}")
+            return
+
+        self.server = self._create_server()
+        self.logger.info(f"Uvicorn server setup on port {self.primary_port}")
+        await self.server.setup_server()
+        self.logger.info("HTTP server setup successful")
+
+    def _create_server(self):
+        """Create the uvicorn server of this process."""
 
         class UviServer(Server):
             """The uvicorn server."""
@@ -125,19 +179,18 @@ class HTTPService(BaseService):
                 """
                 await self.main_loop()
 
-        self.server = UviServer(
+        uvicorn_kwargs = dict(self.uvicorn_kwargs)
+        if self.workers > 1:
+            uvicorn_kwargs.setdefault("timeout_graceful_shutdown", HTTP_SERVICE_GRACEFUL_TIMEOUT)
+        return UviServer(
             config=Config(
                 app=self.app,
                 host=self.host_address,
                 port=self.primary_port,
                 log_level="info",
-                **self.uvicorn_kwargs,
+                **uvicorn_kwargs,
             )
         )
-        logging.getLogger("uvicorn.access").addFilter(lambda record: "/v1/health_check" not in record.getMessage())
-        self.logger.info(f"Uvicorn server setup on port {self.primary_port}")
-        await self.server.setup_server()
-        self.logger.info("HTTP server setup successful")
 
     async def execute_server(self):
         """Run the HTTP server indefinitely."""
@@ -148,6 +201,11 @@ class HTTPService(BaseService):
         self.logger.info("Initiating server termination")
         self.server.should_exit = True
         await self.server.shutdown()
+        for callback in self._shutdown_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                self.logger.error(f"Shutdown callback {callback} failed: {e}")
         self.logger.info("Server termination completed")
 
     def _async_setup(self):
@@ -159,11 +217,198 @@ class HTTPService(BaseService):
         """Running method to block the main thread.
 
         This method runs the event loop until a Future is done. It is designed to be called in the main thread to keep it busy.
+        With several workers it forks them and supervises them until the service is stopped instead.
         """
+        if self.workers > 1:
+            self._run_master()
+            return
+        self.event_loop.run_until_complete(self._run_worker_init())
         self.event_loop.run_until_complete(self.execute_server())
 
-    def stop(self):
+    def _run_master(self):
+        """Pre-fork the workers and keep them running.
+
+        Workers that die are replaced. SIGHUP reloads gracefully: every worker is replaced by a
+        fresh one and then drained, so the port keeps being served. SIGTERM and SIGINT drain all
+        workers, killing those still busy after HTTP_SERVICE_GRACEFUL_TIMEOUT, and return.
+        """
+        if PROMETHEUS_MULTIPROC_DIR:
+            self._clean_multiprocess_dir()
+        else:
+            self.logger.warning("PROMETHEUS_MULTIPROC_DIR is not set, metrics and statistics are per worker")
+
+        # client pools opened during setup are bound to this loop; workers reopen theirs lazily
+        for callback in self._shutdown_callbacks:
+            try:
+                self.event_loop.run_until_complete(callback())
+            except Exception as e:
+                self.logger.error(f"Shutdown callback {callback} failed: {e}")
+
+        received = []
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda signum, frame: received.append(signum))
+
+        for _ in range(self.workers):
+            self._spawn_worker()
+
+        stopping_at = None
+        retiring = set()
+        while self._worker_pids:
+            while received:
+                signum = received.pop(0)
+                if signum == signal.SIGHUP and stopping_at is None:
+                    self.logger.info("Reloading workers")
+                    old_pids = [pid for pid in self._worker_pids if pid not in retiring]
+                    for pid in old_pids:
+                        self._spawn_worker()
+                        retiring.add(pid)
+                        self._signal_worker(pid, signal.SIGTERM)
+                elif signum != signal.SIGHUP and stopping_at is None:
+                    self.logger.info(f"Stopping {len(self._worker_pids)} workers")
+                    stopping_at = time.monotonic()
+                    for pid in self._worker_pids:
+                        self._signal_worker(pid, signal.SIGTERM)
+
+            if stopping_at is not None and time.monotonic() - stopping_at > HTTP_SERVICE_GRACEFUL_TIMEOUT + 5:
+                for pid in self._worker_pids:
+                    self._signal_worker(pid, signal.SIGKILL)
+
+            for pid, status in self._reap_workers():
+                started_at = self._forget_worker(pid)
+                if pid in retiring or stopping_at is not None:
+                    retiring.discard(pid)
+                    continue
+                self.logger.error(f"Worker {pid} exited with status {status}, restarting it")
+                if time.monotonic() - started_at < 1:
+                    # do not spin when workers die right away, e.g. on a broken setup
+                    time.sleep(1)
+                self._spawn_worker()
+            time.sleep(0.1)
+
+        for sock in self._sockets:
+            sock.close()
+        self.logger.info("All workers stopped")
+
+    def _forget_worker(self, pid: int) -> float:
+        """Drop an exited worker and its metric files; return when it was started."""
+        started_at = self._worker_pids.pop(pid)
+        if PROMETHEUS_MULTIPROC_DIR:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(pid)
+            remove_process_statistics(pid)
+        return started_at
+
+    def _stop_workers(self):
+        """Drain the workers and wait for them, killing those still busy after the graceful timeout."""
+        self.logger.info(f"Stopping {len(self._worker_pids)} workers")
+        for pid in self._worker_pids:
+            self._signal_worker(pid, signal.SIGTERM)
+        deadline = time.monotonic() + HTTP_SERVICE_GRACEFUL_TIMEOUT + 5
+        while self._worker_pids:
+            if time.monotonic() > deadline:
+                for pid in self._worker_pids:
+                    self._signal_worker(pid, signal.SIGKILL)
+            for pid in list(self._worker_pids):
+                try:
+                    exited, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    # already reaped
+                    exited = pid
+                if exited:
+                    self._forget_worker(pid)
+            if self._worker_pids:
+                time.sleep(0.1)
+        for sock in self._sockets:
+            sock.close()
+        self.logger.info("All workers stopped")
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._run_worker()
+                status = 0
+            except BaseException as e:
+                self.logger.error(f"Worker {os.getpid()} failed: {e}")
+            finally:
+                os._exit(status)
+        self._worker_pids[pid] = time.monotonic()
+        self.logger.info(f"Started worker {pid}")
+
+    def _run_worker(self):
+        """Serve requests in a forked worker until it receives SIGTERM or SIGINT."""
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_DFL)
+        # the loop inherited from the master shares its selector, use a fresh one
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+
+        sockets = self._sockets
+        if HTTP_SERVICE_REUSE_PORT:
+            sockets = [self._bind_reuse_port_socket()]
+        self.server = self._create_server()
+        self.event_loop.run_until_complete(self._run_worker_init())
+
+        def request_exit():
+            self.server.should_exit = True
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.event_loop.add_signal_handler(sig, request_exit)
+        # SIGHUP is meant for the master, e.g. when sent to the whole process group
+        self.event_loop.add_signal_handler(signal.SIGHUP, lambda: None)
+
+        self.event_loop.run_until_complete(self.server.setup_server(sockets=sockets))
+        self.event_loop.run_until_complete(self.execute_server())
         self.event_loop.run_until_complete(self.terminate_server())
+        self.event_loop.close()
+
+    def _bind_reuse_port_socket(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host_address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host_address, self.primary_port))
+        sock.listen(2048)
+        return sock
+
+    def _signal_worker(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap_workers(self):
+        """Exit statuses of the workers that exited since the last call."""
+        exited = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self._worker_pids:
+                exited.append((pid, os.waitstatus_to_exitcode(status)))
+        return exited
+
+    def _clean_multiprocess_dir(self):
+        """Remove the metric and statistic files left by the processes of a previous run."""
+        suffix = f"_{os.getpid()}."
+        for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+            if name.endswith((".db", ".stats", ".stats.tmp")) and suffix not in name:
+                try:
+                    os.remove(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+                except OSError:
+                    pass
+
+    def stop(self):
+        if self.workers > 1 and self.server is None:
+            # the master of pre-forked workers serves nothing itself
+            self._stop_workers()
+        else:
+            self.event_loop.run_until_complete(self.terminate_server())
         self.event_loop.stop()
         self.event_loop.close()
         self.logger.close()
@@ -0,0 +1,126 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+import threading
+import time
+from typing import List, Tuple, Union
+
+from prometheus_client import Counter, Gauge
+
+# "least_outstanding" or "power_of_two"
+LOAD_BALANCING_POLICY = os.getenv("ORCHESTRATOR_LOAD_BALANCING", "least_outstanding")
+# consecutive failed calls after which a replica is ejected, and for how many seconds
+EJECTION_FAILURES = int(os.getenv("ORCHESTRATOR_EJECTION_FAILURES", 3))
+EJECTION_TIME = float(os.getenv("ORCHESTRATOR_EJECTION_TIME", 30))
+
+endpoint_in_flight = Gauge(
+    "megaservice_endpoint_in_flight",
+    "In-flight calls per replica",
+    ["service", "endpoint"],
+    multiprocess_mode="livesum",
+)
+endpoint_ejections = Counter("megaservice_endpoint_ejections", "Replica ejections after failures", ["service", "endpoint"])
+
+
+def parse_endpoints(spec: str, default_port: int) -> List[Tuple[str, int]]:
+    """Parse "host1:port1,host2,host3:port3" into (host, port) pairs."""
+    endpoints = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":") if ":" in item else (item, "", "")
+        endpoints.append((host, int(port) if port else default_port))
+    return endpoints
+
+
+class Replica:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.in_flight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def __repr__(self):
+        return f"Replica({self.address}, in_flight={self.in_flight})"
+
+
+class EndpointPool:
+    """Replicas of one remote service, picked per call by their outstanding requests.
+
+    `least_outstanding` picks the replica with the fewest in-flight calls, `power_of_two` the less
+    loaded of two random replicas. A replica failing `ejection_failures` calls in a row is left out
+    for `ejection_time` seconds; if every replica is ejected, all of them are used again.
+    """
+
+    POLICIES = ("least_outstanding", "power_of_two")
+
+    def __init__(
+        self,
+        service_name: str,
+        endpoints: List[Union[Tuple[str, int], str]],
+        policy: str = LOAD_BALANCING_POLICY,
+        ejection_failures: int = EJECTION_FAILURES,
+        ejection_time: float = EJECTION_TIME,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown load balancing policy {policy}, expected one of {self.POLICIES}")
+        if not endpoints:
+            raise ValueError(f"No endpoints given for {service_name}")
+        self.service_name = service_name
+        self.policy = policy
+        self.ejection_failures = ejection_failures
+        self.ejection_time = ejection_time
+        self.replicas = []
+        for endpoint in endpoints:
+            host, port = parse_endpoints(endpoint, 80)[0] if isinstance(endpoint, str) else endpoint
+            self.replicas.append(Replica(host, port))
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def healthy(self) -> List[Replica]:
+        now = time.monotonic()
+        replicas = [replica for replica in self.replicas if replica.ejected_until <= now]
+        return replicas or self.replicas
+
+    def acquire(self) -> Replica:
+        """Pick a replica for one call; every acquire must be paired with a release."""
+        with self._lock:
+            candidates = self.healthy()
+            if self.policy == "power_of_two" and len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            least = min(replica.in_flight for replica in candidates)
+            # random among the least loaded, so idle replicas share the load
+            replica = random.choice([replica for replica in candidates if replica.in_flight == least])
+            replica.in_flight += 1
+        endpoint_in_flight.labels(service=self.service_name, endpoint=replica.address).inc()
+        return replica
+
+    def release(self, replica: Replica, ok: bool = True):
+        with self._lock:
+            replica.in_flight -= 1
+            if ok:
+                replica.failures = 0
+            else:
+                replica.failures += 1
+                if replica.failures >= self.ejection_failures and replica.ejected_until <= time.monotonic():
+                    replica.ejected_until = time.monotonic() + self.ejection_time
+                    replica.failures = 0
+                    endpoint_ejections.labels(service=self.service_name, endpoint=replica.address).inc()
+        endpoint_in_flight.labels(service=self.service_name, endpoint=replica.address).dec()
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {"endpoint": replica.address, "in_flight": replica.in_flight, "ejected": replica.ejected_until > now}
+            for replica in self.replicas
+        ]
@@ -3,14 +3,21 @@
 
 import asyncio
 import os
+import threading
+import time
 from collections import defaultdict, deque
 from collections.abc import Callable
 from enum import Enum
 from typing import Any, List, Optional, Type, TypeAlias
 
-from ..proto.docarray import TextDoc
+import aiohttp
+from fastapi import HTTPException
+from prometheus_client import Histogram
+
+from ..proto.docarray import EmbedDoc, RerankedDoc, SearchedDoc, TextDoc
 from .constants import MCPFuncType, ServiceRoleType, ServiceType
 from .http_service import HTTPService
+from .load_balancer import EndpointPool, Replica
 from .logger import CustomLogger
 from .utils import check_ports_availability
 
@@ -20,6 +27,28 @@ logger = CustomLogger("micro_service")
 logflag = os.getenv("LOGFLAG", False)
 AnyFunction: TypeAlias = Callable[..., Any]
 
+# Dynamic batching metrics are created on demand, to avoid bogus ones for services that never batch
+_batching_metrics = {}
+_batching_metrics_lock = threading.Lock()
+
+
+def _get_batching_metrics() -> dict:
+    with _batching_metrics_lock:
+        if not _batching_metrics:
+            _batching_metrics["batch_size"] = Histogram(
+                "microservice_dynamic_batch_size",
+                "Number of requests per dynamic batch (histogram)",
+                ["service", "service_type"],
+                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+            )
+            _batching_metrics["queue_wait"] = Histogram(
+                "microservice_dynamic_batch_queue_wait",
+                "Time a request waits in the dynamic batching buffer (histogram)",
+                ["service", "service_type"],
+                buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+            )
+    return _batching_metrics
+
 
 class MicroService(HTTPService):
     """MicroService class to create a microservice."""
@@ -41,10 +70,13 @@ class MicroService(HTTPService):
         provider: Optional[str] = None,
         provider_endpoint: Optional[str] = None,
         use_remote_service: Optional[bool] = False,
+        replicas: Optional[List[str]] = None,
+        load_balancing: Optional[str] = None,
         description: Optional[str] = None,
         dynamic_batching: bool = False,
-        dynamic_batching_timeout: int = 1,
+        dynamic_batching_timeout: float = 1,
         dynamic_batching_max_batch_size: int = 32,
+        dynamic_batching_handler: AnyFunction = None,
         enable_mcp: bool = False,
         mcp_func_type: Enum = MCPFuncType.TOOL,
         func: AnyFunction = None,
@@ -65,7 +97,18 @@ class MicroService(HTTPService):
         self.dynamic_batching = dynamic_batching
         self.dynamic_batching_timeout = dynamic_batching_timeout
         self.dynamic_batching_max_batch_size = dynamic_batching_max_batch_size
+        self.dynamic_batching_handlers = {}
+        if dynamic_batching_handler is not None:
+            self.register_dynamic_batching_handler(service_type, dynamic_batching_handler)
+        if dynamic_batching:
+            self._check_batch_inference(service_type)
         self.uvicorn_kwargs = {}
+        # replicas of a remote service, e.g. ["tei-0:80", "tei-1:80"]; host and port are the first one
+        self.pool = None
+        if use_remote_service and replicas:
+            pool_kwargs = {"policy": load_balancing} if load_balancing else {}
+            self.pool = EndpointPool(name, replicas, **pool_kwargs)
+            self.host, self.port = self.pool.replicas[0].host, self.pool.replicas[0].port
 
         if ssl_keyfile:
             self.uvicorn_kwargs["ssl_keyfile"] = ssl_keyfile
@@ -96,8 +139,13 @@ class MicroService(HTTPService):
             # create a batch request processor loop if using dynamic batching
             if self.dynamic_batching:
                 self.buffer_lock = asyncio.Lock()
+                self.buffer_event = asyncio.Event()
                 self.request_buffer = defaultdict(deque)
+                self._batch_tasks = set()
+                self._batching_session = None
                 self.add_startup_event(self._dynamic_batch_processor())
+                # registered once; it closes whichever session is current at shutdown
+                self.add_shutdown_event(self._close_batching_session)
 
             if not enable_mcp:
                 self._async_setup()
@@ -119,35 +167,214 @@ class MicroService(HTTPService):
         self.name = f"{name}/{self.__class__.__name__}" if name else self.__class__.__name__
 
     async def _dynamic_batch_processor(self):
+        """Flush buffered requests when a batch is full or its oldest request waited `dynamic_batching_timeout`."""
         if logflag:
             logger.info("dynamic batch processor looping...")
         while True:
-            await asyncio.sleep(self.dynamic_batching_timeout)
-            runtime_batch: dict[Enum, list[dict]] = {}  # {ServiceType.Embedding: [{"request": xx, "response": yy}, {}]}
+            runtime_batch: list[tuple[Enum, list[dict]]] = []  # [(ServiceType.EMBEDDING, [{"request": xx, "response": yy}])]
+            wait_timeout = None
 
             async with self.buffer_lock:
-                # prepare the runtime batch, access to buffer is locked
-                if self.request_buffer:
-                    for service_type, request_lst in self.request_buffer.items():
-                        batch = []
+                # prepare the runtime batches, access to buffer is locked
+                self.buffer_event.clear()
+                now = time.monotonic()
+                for service_type, request_lst in self.request_buffer.items():
+                    while request_lst and (
+                        len(request_lst) >= self.dynamic_batching_max_batch_size
+                        or now - request_lst[0]["enqueued_at"] >= self.dynamic_batching_timeout
+                    ):
                         # grab min(MAX_BATCH_SIZE, REQUEST_SIZE) requests from buffer
-                        for _ in range(min(self.dynamic_batching_max_batch_size, len(request_lst))):
-                            batch.append(request_lst.popleft())
-
-                        runtime_batch[service_type] = batch
-
-            # Run batched inference on the batch and set results
-            for service_type, batch in runtime_batch.items():
-                if not batch:
-                    continue
-                results = await self.dynamic_batching_infer(service_type, batch)
+                        batch = [
+                            request_lst.popleft()
+                            for _ in range(min(self.dynamic_batching_max_batch_size, len(request_lst)))
+                        ]
+                        runtime_batch.append((service_type, batch))
+                    if request_lst:
+                        remaining = request_lst[0]["enqueued_at"] + self.dynamic_batching_timeout - now
+                        wait_timeout = remaining if wait_timeout is None else min(wait_timeout, remaining)
+
+            # Run batched inference in the background, so the next batch can be collected meanwhile
+            for service_type, batch in runtime_batch:
+                task = asyncio.create_task(self._run_dynamic_batch(service_type, batch))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+
+            # sleep until a new request arrives or the oldest buffered request is due
+            try:
+                await asyncio.wait_for(self.buffer_event.wait(), timeout=wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_dynamic_batch(self, service_type: Enum, batch: list[dict]):
+        # requests whose caller already went away are not worth computing
+        batch = [req for req in batch if not req["response"].done()]
+        if not batch:
+            return
+
+        now = time.monotonic()
+        batching_metrics = _get_batching_metrics()
+        batching_metrics["batch_size"].labels(self.name, service_type.name).observe(len(batch))
+        for req in batch:
+            batching_metrics["queue_wait"].labels(self.name, service_type.name).observe(now - req["enqueued_at"])
+
+        try:
+            results = await self.dynamic_batching_infer(service_type, batch)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Dynamic batching returned {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            logger.error(f"Dynamic batching inference failed for {service_type}: {e}")
+            for req in batch:
+                if not req["response"].done():
+                    req["response"].set_exception(e)
+            return
+
+        # an Exception in the results only fails its own request
+        for req, result in zip(batch, results):
+            if req["response"].done():
+                continue
+            if isinstance(result, Exception):
+                req["response"].set_exception(result)
+            else:
+                req["response"].set_result(result)
+
+    def register_dynamic_batching_handler(self, service_type: Enum, func: AnyFunction):
+        """Register the batched inference of a service type.
+
+        `func` is an async callable taking the list of buffered requests and returning their results in
+        order. A result may be an Exception instance, which is raised to that request only.
+        """
+        self.dynamic_batching_handlers[service_type] = func
+
+    def _check_batch_inference(self, service_type: Enum):
+        if service_type not in self.dynamic_batching_handlers and service_type not in (
+            ServiceType.EMBEDDING,
+            ServiceType.RERANK,
+        ):
+            raise ValueError(
+                f"Dynamic batching of {service_type} needs a dynamic_batching_handler, "
+                "only embedding and rerank have a built-in batched inference"
+            )
 
-                for req, result in zip(batch, results):
-                    req["response"].set_result(result)
+    async def submit_dynamic_batch(self, service_type: Enum, request: Any):
+        """Queue a single request for dynamic batching and wait for its result."""
+        self._check_batch_inference(service_type)
+        response = asyncio.get_running_loop().create_future()
+        async with self.buffer_lock:
+            self.request_buffer[service_type].append(
+                {"request": request, "response": response, "enqueued_at": time.monotonic()}
+            )
+            self.buffer_event.set()
+        return await response
 
     async def dynamic_batching_infer(self, service_type: Enum, batch: list[dict]):
-        """Need to implement."""
-        raise NotImplementedError("Unimplemented dynamic batching inference!")
+        """Run batched inference of `service_type` on the buffered requests.
+
+        A handler registered for the service type takes precedence over the built-in embedding and
+        rerank inference, which call the TEI server at `provider_endpoint`. Other service types are
+        rejected when the microservice is created, unless they come with a handler.
+        """
+        requests = [req["request"] for req in batch]
+        handler = self.dynamic_batching_handlers.get(service_type)
+        if handler is not None:
+            return await handler(requests)
+        if service_type == ServiceType.EMBEDDING:
+            return await self._embedding_batch_infer(requests)
+        return await self._rerank_batch_infer(requests)
+
+    def _get_batching_session(self) -> aiohttp.ClientSession:
+        if self._batching_session is None or self._batching_session.closed:
+            self._batching_session = aiohttp.ClientSession(trust_env=True)
+        return self._batching_session
+
+    async def _close_batching_session(self):
+        if self._batching_session is not None and not self._batching_session.closed:
+            await self._batching_session.close()
+
+    async def _post_provider(self, path: str, payload: dict):
+        if not self.provider_endpoint:
+            raise ValueError(f"provider_endpoint is required for dynamic batching of {self.service_type}")
+        url = self.provider_endpoint.rstrip("/") + path
+        async with self._get_batching_session().post(url, json=payload) as response:
+            if response.status >= 400:
+                detail = await response.text()
+                raise HTTPException(status_code=response.status, detail=detail)
+            return await response.json()
+
+    async def _isolate_failures(self, requests: list, infer_one: AnyFunction) -> list:
+        """Rerun requests one by one after a rejected batch, so only the offending ones fail."""
+        results = await asyncio.gather(*(infer_one(request) for request in requests), return_exceptions=True)
+        return list(results)
+
+    async def _embedding_batch_infer(self, requests: list) -> list:
+        """Embed the texts of all requests with a single TEI /embed call."""
+        results = [None] * len(requests)
+        texts, owners = [], []
+        for i, request in enumerate(requests):
+            text = request.text if isinstance(request, TextDoc) else request
+            request_texts = text if isinstance(text, list) else [text]
+            if not request_texts or not all(isinstance(t, str) and t for t in request_texts):
+                results[i] = ValueError("Embedding input must be a non-empty string or list of strings")
+                continue
+            texts.extend(request_texts)
+            owners.append((i, text, len(request_texts)))
+
+        if owners:
+            try:
+                embeddings = await self._post_provider("/embed", {"inputs": texts, "truncate": True})
+            except HTTPException as e:
+                if e.status_code >= 500 or len(owners) == 1:
+                    raise
+                single = await self._isolate_failures(
+                    [requests[i] for i, _, _ in owners], lambda r: self._embedding_batch_infer([r])
+                )
+                for (i, _, _), result in zip(owners, single):
+                    results[i] = result if isinstance(result, Exception) else result[0]
+                return results
+
+            offset = 0
+            for i, text, count in owners:
+                vectors = embeddings[offset : offset + count]
+                offset += count
+                results[i] = EmbedDoc(text=text, embedding=vectors if isinstance(text, list) else vectors[0])
+        return results
+
+    async def _rerank_batch_infer(self, requests: list) -> list:
+        """Score the (query, document) pairs of all requests with a single TEI /predict call."""
+        results = [None] * len(requests)
+        pairs, owners = [], []
+        for i, request in enumerate(requests):
+            if not isinstance(request, SearchedDoc):
+                results[i] = TypeError(f"Rerank input must be a SearchedDoc, got {type(request).__name__}")
+                continue
+            docs = [doc.text for doc in request.retrieved_docs]
+            pairs.extend([request.initial_query, doc] for doc in docs)
+            owners.append((i, docs))
+
+        if pairs:
+            try:
+                predictions = await self._post_provider("/predict", {"inputs": pairs, "truncate": True})
+            except HTTPException as e:
+                if e.status_code >= 500 or len(owners) == 1:
+                    raise
+                single = await self._isolate_failures(
+                    [requests[i] for i, _ in owners], lambda r: self._rerank_batch_infer([r])
+                )
+                for (i, _), result in zip(owners, single):
+                    results[i] = result if isinstance(result, Exception) else result[0]
+                return results
+
+            offset = 0
+            for i, docs in owners:
+                scores = [max(p["score"] for p in prediction) for prediction in predictions[offset : offset + len(docs)]]
+                offset += len(docs)
+                ranked = sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)[: requests[i].top_n]
+                results[i] = RerankedDoc(
+                    reranked_docs=[TextDoc(text=doc) for _, doc in ranked], initial_query=requests[i].initial_query
+                )
+        for i, request in enumerate(requests):
+            if results[i] is None:
+                results[i] = RerankedDoc(reranked_docs=[], initial_query=request.initial_query)
+        return results
 
     def _validate_env(self):
         """Check whether to use the microservice locally."""
@@ -157,9 +384,11 @@ class MicroService(HTTPService):
                 "set use_remote_service to False if you want to use a local micro service!"
             )
 
-    def endpoint_path(self, model=None):
+    def endpoint_path(self, model=None, replica: Optional[Replica] = None):
         if self.api_key:
             return f"{self.host}{self.endpoint}"
+        elif replica is not None:
+            return f"{self.protocol}://{replica.host}:{replica.port}{self.endpoint}"
         else:
             return f"{self.protocol}://{self.host}:{self.port}{self.endpoint}"
 
@@ -193,8 +422,9 @@ def register_microservice(
     provider_endpoint: Optional[str] = None,
     methods: List[str] = ["POST"],
     dynamic_batching: bool = False,
-    dynamic_batching_timeout: int = 1,
+    dynamic_batching_timeout: float = 1,
     dynamic_batching_max_batch_size: int = 32,
+    dynamic_batching_handler: AnyFunction = None,
     enable_mcp: bool = False,
     description: str = None,
     mcp_func_type: Enum = MCPFuncType.TOOL,
@@ -218,6 +448,7 @@ def register_microservice(
                 dynamic_batching=dynamic_batching,
                 dynamic_batching_timeout=dynamic_batching_timeout,
                 dynamic_batching_max_batch_size=dynamic_batching_max_batch_size,
+                dynamic_batching_handler=dynamic_batching_handler,
                 enable_mcp=enable_mcp,
                 func=func,
                 description=description,
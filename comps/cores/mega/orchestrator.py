@@ -3,30 +3,60 @@
 
 import asyncio
 import contextlib
-import copy
 import json
 import os
 import re
 import threading
 import time
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
-from prometheus_client import Gauge, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
 from ..telemetry.opea_telemetry import opea_telemetry, tracer
 from .constants import ServiceType
-from .dag import DAG
+from .dag import DAG, RuntimeGraph
 from .logger import CustomLogger
+from .resilience import (
+    HEDGING_ENABLED,
+    HEDGING_QUANTILE,
+    RETRY_ATTEMPTS,
+    CircuitBreaker,
+    LatencyTracker,
+    backoff_delay,
+    hedged,
+    is_service_failure,
+    service_retries,
+)
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 ENABLE_OPEA_TELEMETRY = bool(os.environ.get("TELEMETRY_ENDPOINT"))
 
+# connection pool shared by all requests of one orchestrator
+POOL_LIMIT = int(os.getenv("ORCHESTRATOR_POOL_LIMIT", 1000))
+POOL_LIMIT_PER_HOST = int(os.getenv("ORCHESTRATOR_POOL_LIMIT_PER_HOST", 200))
+POOL_KEEPALIVE_TIMEOUT = float(os.getenv("ORCHESTRATOR_POOL_KEEPALIVE_TIMEOUT", 60))
+POOL_DNS_CACHE_TTL = int(os.getenv("ORCHESTRATOR_POOL_DNS_CACHE_TTL", 300))
+REQUEST_TIMEOUT = float(os.getenv("ORCHESTRATOR_REQUEST_TIMEOUT", 2000))
+# seconds a whole request may take, unless schedule() is given a deadline
+REQUEST_DEADLINE = float(os.getenv("ORCHESTRATOR_REQUEST_DEADLINE", 600))
+# seconds budget of one call to a non LLM node, e.g. embedding, retriever or rerank
+NODE_TIMEOUT = float(os.getenv("ORCHESTRATOR_NODE_TIMEOUT", 60))
+# per node budgets overriding the defaults, e.g. "embedding=5,retriever=10,llm=300"
+NODE_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, _, seconds in (item.partition("=") for item in os.getenv("ORCHESTRATOR_NODE_TIMEOUTS", "").split(","))
+    if name.strip() and seconds
+}
+# max seconds between two chunks of a streamed LLM reply
+STREAM_READ_TIMEOUT = float(os.getenv("ORCHESTRATOR_STREAM_READ_TIMEOUT", 60))
+# nodes whose calls have no side effects, so they may be retried and hedged
+IDEMPOTENT_SERVICE_TYPES = (ServiceType.EMBEDDING, ServiceType.RETRIEVER, ServiceType.RERANK)
+
 
 class OrchestratorMetrics:
     def __init__(self) -> None:
@@ -45,6 +75,10 @@ class OrchestratorMetrics:
         self.request_update = self._request_update_create
         self.pending_update = self._pending_update_create
 
+        self.cancelled_streams = Counter(
+            "megaservice_cancelled_streams", "LLM streams closed before the end, by reason", ["reason"]
+        )
+
     def _token_update_create(self, token_start: float, is_first: bool) -> float:
         with self._lock:
             # in case another thread already got here
@@ -73,7 +107,9 @@ class OrchestratorMetrics:
             # in case another thread already got here
             if self.pending_update == self._pending_update_create:
                 self.request_pending = Gauge(
-                    "megaservice_request_pending", "Count of currently pending requests (gauge)"
+                    "megaservice_request_pending",
+                    "Count of currently pending requests (gauge)",
+                    multiprocess_mode="livesum",
                 )
                 self.pending_update = self._pending_update_real
         self.pending_update(increase)
@@ -100,14 +136,218 @@ class OrchestratorMetrics:
 _metrics = OrchestratorMetrics()
 
 
+class CancellableStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body and upstream streams once the response is over.
+
+    Starlette stops iterating the body when the client disconnects but leaves the generators
+    suspended, so the upstream LLM would keep generating. Closing them here releases the upstream
+    connection, which makes the inference server abort the generation.
+    """
+
+    def __init__(self, content, *args, on_close: Optional[List[Callable]] = None, **kwargs):
+        super().__init__(content, *args, **kwargs)
+        self.on_close = list(on_close or [])
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        aclose = getattr(self.body_iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        for close in self.on_close:
+            await close()
+
+
 class ServiceOrchestrator(DAG):
     """Manage 1 or N micro services in a DAG through Python API."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        pool_limit: int = POOL_LIMIT,
+        pool_limit_per_host: int = POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = POOL_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: int = POOL_DNS_CACHE_TTL,
+    ) -> None:
         self.metrics = _metrics
         self.services = {}  # all services, id -> service
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self._session = None
+        self._session_loop = None
+        self.node_timeouts = dict(NODE_TIMEOUTS)
+        self.breakers = {}  # service name -> CircuitBreaker
+        self.latencies = {}  # service name -> LatencyTracker
         super().__init__()
 
+    def get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled client session, creating it on the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trust_env=True,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def warmup(self, timeout: float = 5.0):
+        """Open a pooled connection to every remote service so the first request skips connection setup."""
+        session = self.get_session()
+
+        async def _ping(service, host, port):
+            url = f"{service.protocol}://{host}:{port}/health"
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    await response.read()
+            except Exception as e:
+                logger.info(f"Warm-up of {service.name} at {url} failed: {e}")
+
+        targets = []
+        for service in self.services.values():
+            if not service.use_remote_service or service.api_key:
+                continue
+            if getattr(service, "pool", None) is not None:
+                targets.extend((service, replica.host, replica.port) for replica in service.pool.replicas)
+            else:
+                targets.append((service, service.host, service.port))
+        await asyncio.gather(*(_ping(*target) for target in targets))
+
+    async def close(self):
+        """Close the pooled client session and its connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    def set_node_timeout(self, service_name: str, seconds: Optional[float]):
+        """Set the time budget of each call to a service; None only bounds it by the request deadline."""
+        self.node_timeouts[service_name] = seconds
+
+    def node_timeout(self, cur_node: str, deadline: Optional[float], stream: bool = False) -> aiohttp.ClientTimeout:
+        """Timeout of a call to `cur_node`: its budget, capped by what is left until the deadline."""
+        if cur_node in self.node_timeouts:
+            budget = self.node_timeouts[cur_node]
+        elif self.services[cur_node].service_type in (ServiceType.LLM, ServiceType.LVM):
+            budget = None
+        else:
+            budget = NODE_TIMEOUT
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"Request deadline exceeded before calling {cur_node}")
+            budget = remaining if budget is None else min(budget, remaining)
+        return aiohttp.ClientTimeout(total=budget, sock_read=STREAM_READ_TIMEOUT if stream else None)
+
+    def breaker(self, service_name: str) -> CircuitBreaker:
+        if service_name not in self.breakers:
+            self.breakers[service_name] = CircuitBreaker(service_name)
+        return self.breakers[service_name]
+
+    def acquire_endpoint(self, cur_node: str, model=None):
+        """URL of the next call to `cur_node` and the replica it goes to, None without a replica pool."""
+        service = self.services[cur_node]
+        pool = getattr(service, "pool", None)
+        replica = pool.acquire() if pool is not None else None
+        return service.endpoint_path(model, replica), replica
+
+    def release_endpoint(self, cur_node: str, replica, ok: bool = True):
+        if replica is not None:
+            self.services[cur_node].pool.release(replica, ok)
+
+    @staticmethod
+    def record_outcome(breaker: CircuitBreaker, outcome: Optional[bool], probe: bool):
+        """Report a finished call to its breaker; a probe without outcome, e.g. cancelled, is released."""
+        if outcome is True:
+            breaker.record_success()
+        elif outcome is False:
+            breaker.record_failure()
+        elif probe:
+            breaker.release_probe()
+
+    async def check_response_status(self, cur_node: str, response: aiohttp.ClientResponse):
+        """Raise ClientResponseError, with the start of the body as message, for a non 2xx reply."""
+        if response.status < 300:
+            return
+        body = await response.text()
+        raise aiohttp.ClientResponseError(
+            response.request_info,
+            response.history,
+            status=response.status,
+            message=f"{cur_node} replied {response.status}: {body[:500]}",
+            headers=response.headers,
+        )
+
+    async def call_service(self, session, cur_node: str, input_data, headers, deadline=None, model=None):
+        """POST to a non streaming node and return its reply, JSON or audio bytes.
+
+        Every call goes through the node's circuit breaker. Calls to idempotent nodes are retried
+        with jittered backoff while the deadline allows, and are hedged when ORCHESTRATOR_HEDGING
+        is on and the first call is slower than the node's usual latency.
+        """
+        breaker = self.breaker(cur_node)
+        latencies = self.latencies.setdefault(cur_node, LatencyTracker())
+
+        async def attempt():
+            # a passed deadline fails here, before the breaker hands out a half open probe
+            timeout = self.node_timeout(cur_node, deadline)
+            probe = breaker.before_call()
+            endpoint, replica = self.acquire_endpoint(cur_node, model)
+            outcome = None  # True when the service answered, False when it failed
+            start = time.monotonic()
+            try:
+                async with session.post(endpoint, json=input_data, headers=headers, timeout=timeout) as response:
+                    await self.check_response_status(cur_node, response)
+                    if response.content_type == "audio/wav":
+                        data = await response.read()
+                    else:
+                        data = await response.json()
+                outcome = True
+            except BaseException as e:
+                if is_service_failure(e):
+                    outcome = False
+                elif isinstance(e, aiohttp.ClientResponseError):
+                    # a 4xx reply, the service itself works
+                    outcome = True
+                raise
+            finally:
+                # a cancelled hedge is not the replica's fault
+                self.release_endpoint(cur_node, replica, ok=outcome is not False)
+                self.record_outcome(breaker, outcome, probe)
+            latencies.add(time.monotonic() - start)
+            return data
+
+        if self.services[cur_node].service_type not in IDEMPOTENT_SERVICE_TYPES:
+            return await attempt()
+
+        hedge_delay = latencies.quantile(HEDGING_QUANTILE) if HEDGING_ENABLED else None
+        for retry in range(RETRY_ATTEMPTS + 1):
+            try:
+                return await hedged(attempt, hedge_delay, cur_node)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not is_service_failure(e):
+                    # the request itself is wrong, another attempt gets the same reply
+                    raise
+                delay = backoff_delay(retry + 1)
+                if retry == RETRY_ATTEMPTS or (deadline is not None and time.monotonic() + delay >= deadline):
+                    raise
+                logger.info(f"Retrying {cur_node} after {type(e).__name__}: {e}")
+                service_retries.labels(service=cur_node).inc()
+                await asyncio.sleep(delay)
+
     def add(self, service):
         if service.name not in self.services:
             self.services[service.name] = service
@@ -128,77 +368,83 @@ class ServiceOrchestrator(DAG):
     async def schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
         req_start = time.monotonic()
         self.metrics.pending_update(True)
+        # absolute time.monotonic() deadline, passed to every node and hook through kwargs
+        if kwargs.get("deadline") is None:
+            kwargs["deadline"] = req_start + REQUEST_DEADLINE
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        # the graph is compiled once, this request only records its skips on top of the shared plan
+        plan = self.plan()
+        runtime_graph = RuntimeGraph(plan)
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=2000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
-
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for done_task in done:
+        session = self.get_session()
+        pending = {
+            asyncio.create_task(
+                self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+            )
+            for node in plan.ind_nodes
+        }
+        # a streamed LLM reply updates the pending count itself when the stream ends
+        llm_streaming = False
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                try:
                     response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
-
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.stream:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
+                except BaseException:
+                    # a failed or timed out node fails the request, stop the nodes still running
+                    for task in pending:
+                        task.cancel()
+                    if not llm_streaming:
+                        self.metrics.pending_update(False)
+                    raise
+                result_dict[node] = response
+                llm_streaming = llm_streaming or isinstance(response, StreamingResponse)
+
+                # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+                downstreams = runtime_graph.downstream(node)
+
+                # remove all the black nodes that are skipped to be forwarded to
+                if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+                    for black_node in response["downstream_black_list"]:
+                        for downstream in reversed(downstreams):
+                            try:
+                                if re.findall(black_node, downstream):
+                                    if LOGFLAG:
+                                        logger.info(f"skip forwardding to {downstream}...")
+                                    runtime_graph.delete_edge(node, downstream)
+                                    downstreams.remove(downstream)
+                            except re.error as e:
+                                logger.error("Pattern invalid! Operation cancelled.")
+                        if len(downstreams) == 0 and llm_parameters.stream:
+                            # turn the response to a StreamingResponse
+                            # to make the response uniform to UI
+                            def fake_stream(text):
+                                yield "data: b'" + text + "'\n\n"
+                                yield "data: [DONE]\n\n"
+
+                            result_dict[node] = StreamingResponse(
+                                fake_stream(response["text"]), media_type="text/event-stream"
+                            )
 
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
+                for d_node in downstreams:
+                    predecessors = runtime_graph.predecessors(d_node)
+                    if all(i in result_dict for i in predecessors):
+                        inputs = self.process_outputs(predecessors, result_dict)
+                        pending.add(
+                            asyncio.create_task(
+                                self.execute(
+                                    session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
                                 )
                             )
-        nodes_to_keep = []
-        for i in ind_nodes:
-            nodes_to_keep.append(i)
-            nodes_to_keep.extend(runtime_graph.all_downstreams(i))
+                        )
 
-        all_nodes = list(runtime_graph.graph.keys())
+        runtime_graph.prune(plan.ind_nodes)
 
-        for node in all_nodes:
-            if node not in nodes_to_keep:
-                runtime_graph.delete_node_if_exists(node)
-
-        if not llm_parameters.stream:
+        if not llm_parameters.stream or not llm_streaming:
             self.metrics.pending_update(False)
 
         return result_dict, runtime_graph
@@ -211,9 +457,10 @@ class ServiceOrchestrator(DAG):
             all_outputs.update(result_dict[prev_node])
         return all_outputs
 
-    def wrap_iterable(self, iterable, is_first=True):
+    async def wrap_iterable(self, aiterable, is_first=True):
 
         with tracer.start_as_current_span("llm_generate_stream") if ENABLE_OPEA_TELEMETRY else contextlib.nullcontext():
+            aiterator = aiterable.__aiter__()
             while True:
                 with (
                     tracer.start_as_current_span("llm_generate_stream_first_token")
@@ -221,10 +468,10 @@ class ServiceOrchestrator(DAG):
                     else contextlib.nullcontext()
                 ):  #  else tracer.start_as_current_span(f"llm_generate_stream_next_token")
                     try:
-                        token = next(iterable)
+                        token = await aiterator.__anext__()
                         yield token
                         is_first = False
-                    except StopIteration:
+                    except StopAsyncIteration:
                         # Exiting the iterable loop cleanly
                         break
                     except Exception as e:
@@ -237,7 +484,7 @@ class ServiceOrchestrator(DAG):
         req_start: float,
         cur_node: str,
         inputs: Dict,
-        runtime_graph: DAG,
+        runtime_graph: RuntimeGraph,
         llm_parameters: LLMParams = LLMParams(),
         **kwargs,
     ):
@@ -253,41 +500,52 @@ class ServiceOrchestrator(DAG):
                     inputs[field] = value
         # pre-process
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
+        if not is_llm_vlm:
+            # the megaservice may already know the reply, e.g. from a cache
+            data = self.short_circuit(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
+            if data is not None:
+                data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+                return data, cur_node
+        deadline = kwargs.get("deadline")
         access_token = self.services[cur_node].api_key_value
-        if access_token:
-            endpoint = self.services[cur_node].endpoint_path(inputs["model"])
-        else:
-            endpoint = self.services[cur_node].endpoint_path(None)
+        model = inputs["model"] if access_token else None
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
+            # Stream on the shared aiohttp session, so tokens are relayed on the event loop
             if LOGFLAG:
                 logger.info(inputs)
+            headers = {"Content-type": "application/json"}
+            if access_token:
+                headers["Authorization"] = f"Bearer {access_token}"
             with (
                 tracer.start_as_current_span(f"{cur_node}_asyn_generate")
                 if ENABLE_OPEA_TELEMETRY
                 else contextlib.nullcontext()
             ):
-                if access_token:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
-
-                else:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={
-                            "Content-type": "application/json",
-                        },
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
+                # streams are not retried, a failed LLM call only counts against its circuit
+                breaker = self.breaker(cur_node)
+                timeout = self.node_timeout(cur_node, deadline, stream=True)
+                probe = breaker.before_call()
+                endpoint, replica = self.acquire_endpoint(cur_node, model)
+                outcome = None
+                try:
+                    response = await session.post(url=endpoint, data=json.dumps(inputs), headers=headers, timeout=timeout)
+                    try:
+                        await self.check_response_status(cur_node, response)
+                    except BaseException:
+                        response.release()
+                        raise
+                    outcome = True
+                except BaseException as e:
+                    if is_service_failure(e):
+                        outcome = False
+                    elif isinstance(e, aiohttp.ClientResponseError):
+                        outcome = True
+                    # the endpoint is only kept on success, for the stream to release it
+                    self.release_endpoint(cur_node, replica, ok=outcome is not False)
+                    raise
+                finally:
+                    self.record_outcome(breaker, outcome, probe)
+            llm_node = cur_node
 
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
@@ -295,50 +553,38 @@ class ServiceOrchestrator(DAG):
                 cur_node = downstream[0]
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path()
+            completed = False
+            stream_failed = False
 
-            def generate():
+            async def generate():
+                nonlocal completed, stream_failed
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
+                try:
                     buffered_chunk_str = ""
                     is_first = True
-                    for chunk in self.wrap_iterable(response.iter_content(chunk_size=None)):
+                    async for chunk in self.wrap_iterable(self._iter_response_chunks(response)):
                         if chunk:
                             if downstream:
                                 chunk = chunk.decode("utf-8")
                                 buffered_chunk_str += self.extract_chunk_str(chunk)
                                 is_last = chunk.endswith("[DONE]\n\n")
                                 if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    if access_token:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                                "Authorization": f"Bearer {access_token}",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    else:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    res_json = res.json()
+                                    async with session.post(
+                                        url=downstream_endpoint,
+                                        data=json.dumps({"text": buffered_chunk_str}),
+                                        headers=headers,
+                                        timeout=self.node_timeout(cur_node, deadline),
+                                    ) as res:
+                                        res_json = await res.json()
                                     if "text" in res_json:
                                         res_txt = res_json["text"]
                                     else:
                                         raise Exception("Other response types not supported yet!")
                                     buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
+                                    for token in self.token_generator(
                                         res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
+                                    ):
+                                        yield token
                                     token_start = time.monotonic()
                                     is_first = False
                             else:
@@ -347,10 +593,41 @@ class ServiceOrchestrator(DAG):
                                 yield chunk
 
                     self.metrics.request_update(req_start)
+                    completed = True
+                except asyncio.TimeoutError:
+                    stream_failed = True
+                    self.metrics.cancelled_streams.labels(reason="timeout").inc()
+                    raise
+                except aiohttp.ClientError:
+                    stream_failed = True
+                    raise
+                finally:
+                    if completed:
+                        response.release()
+                    else:
+                        # drop the connection mid-stream, so the LLM server stops generating
+                        response.close()
+                    self.release_endpoint(llm_node, replica, ok=not stream_failed)
                     self.metrics.pending_update(False)
 
+            async def close_upstream():
+                if completed or response.closed:
+                    return
+                self.metrics.cancelled_streams.labels(reason="disconnect").inc()
+                if LOGFLAG:
+                    logger.info(f"Client went away, cancelling the {cur_node} stream")
+                await stream.aclose()
+                if not response.closed:
+                    # the stream was never iterated, so its cleanup did not run
+                    response.close()
+                    self.release_endpoint(llm_node, replica)
+                    self.metrics.pending_update(False)
+
+            stream = generate()
             return (
-                StreamingResponse(self.align_generator(generate(), **kwargs), media_type="text/event-stream"),
+                CancellableStreamingResponse(
+                    self.align_generator(stream, **kwargs), media_type="text/event-stream", on_close=[close_upstream]
+                ),
                 cur_node,
             )
         else:
@@ -368,20 +645,17 @@ class ServiceOrchestrator(DAG):
                 if ENABLE_OPEA_TELEMETRY
                 else contextlib.nullcontext()
             ):
-                response = await session.post(
-                    endpoint,
-                    json=input_data,
-                    headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
+                data = await self.call_service(
+                    session,
+                    cur_node,
+                    input_data,
+                    {"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
+                    deadline,
+                    model,
                 )
 
-            if response.content_type == "audio/wav":
-                audio_data = await response.read()
-                data = self.align_outputs(audio_data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
-            else:
-                # Parse as JSON
-                data = await response.json()
-                # post process
-                data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+            # post process
+            data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
 
             return data, cur_node
 
@@ -393,10 +667,25 @@ class ServiceOrchestrator(DAG):
         """Override this method in megaservice definition."""
         return data
 
+    def short_circuit(self, inputs, *args, **kwargs):
+        """Override this method in megaservice definition.
+
+        Return the reply of the node for `inputs` to skip calling its service, or None to call it.
+        """
+        return None
+
     def align_generator(self, gen, *args, **kwargs):
-        """Override this method in megaservice definition."""
+        """Override this method in megaservice definition.
+
+        `gen` is an async generator of raw chunks, the override should return an async iterable too.
+        """
         return gen
 
+    async def _iter_response_chunks(self, response: aiohttp.ClientResponse):
+        """Yield the body of a streaming response chunk by chunk as the server flushes it."""
+        async for data, _ in response.content.iter_chunks():
+            yield data
+
     def get_all_final_outputs(self, result_dict, runtime_graph):
         final_output_dict = {}
         for leaf in runtime_graph.all_leaves():
@@ -0,0 +1,176 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+# consecutive failures that open the circuit of a service
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("ORCHESTRATOR_CIRCUIT_FAILURE_THRESHOLD", 5))
+# seconds an open circuit rejects calls before letting one probe through
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("ORCHESTRATOR_CIRCUIT_RESET_TIMEOUT", 30))
+# seconds after which a half open probe that never reported back is replaced by a new one
+CIRCUIT_PROBE_TIMEOUT = float(os.getenv("ORCHESTRATOR_CIRCUIT_PROBE_TIMEOUT", 60))
+# extra attempts of a failed call to an idempotent node (embedding, retriever, rerank)
+RETRY_ATTEMPTS = int(os.getenv("ORCHESTRATOR_RETRY_ATTEMPTS", 2))
+RETRY_BACKOFF_BASE = float(os.getenv("ORCHESTRATOR_RETRY_BACKOFF_BASE", 0.05))
+RETRY_BACKOFF_MAX = float(os.getenv("ORCHESTRATOR_RETRY_BACKOFF_MAX", 1.0))
+# send a duplicate call to an idempotent node once the first one is slower than its p95
+HEDGING_ENABLED = os.getenv("ORCHESTRATOR_HEDGING", "false").lower() in ("true", "1", "yes")
+HEDGING_QUANTILE = float(os.getenv("ORCHESTRATOR_HEDGING_QUANTILE", 95))
+# latencies a service needs before its quantile is trusted for hedging
+HEDGING_MIN_SAMPLES = int(os.getenv("ORCHESTRATOR_HEDGING_MIN_SAMPLES", 20))
+
+circuit_state = Gauge(
+    "megaservice_circuit_state",
+    "Circuit state per service (0 closed, 1 half open, 2 open)",
+    ["service"],
+    multiprocess_mode="livemax",
+)
+circuit_rejections = Counter("megaservice_circuit_rejections", "Calls rejected by an open circuit", ["service"])
+service_retries = Counter("megaservice_service_retries", "Retried service calls", ["service"])
+service_hedges = Counter("megaservice_service_hedges", "Hedged service calls, by the call that won", ["service", "winner"])
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker of one service.
+
+    After `failure_threshold` failures in a row the circuit opens and calls are rejected for
+    `reset_timeout` seconds. Then one probe call is let through (half open): its success closes
+    the circuit, its failure opens it again. A probe that ends without an outcome, e.g. cancelled,
+    must call `release_probe`; one that never reports back is replaced after `probe_timeout`.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+        probe_timeout: float = CIRCUIT_PROBE_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self._lock = threading.Lock()
+        circuit_state.labels(service=name).set(self.state)
+
+    def _set_state(self, state: int):
+        self.state = state
+        circuit_state.labels(service=self.name).set(state)
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if the service must not be called now.
+
+        Return True when the call is the half open probe.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (self.state == self.OPEN and now - self.opened_at >= self.reset_timeout) or (
+                self.state == self.HALF_OPEN and now - self.probe_started_at >= self.probe_timeout
+            ):
+                self._set_state(self.HALF_OPEN)
+                self.probe_started_at = now
+                return True
+            if self.state != self.CLOSED:
+                # open, or half open with the probe still running
+                circuit_rejections.labels(service=self.name).inc()
+                raise CircuitOpenError(f"Circuit of {self.name} is open")
+            return False
+
+    def release_probe(self):
+        """The probe ended without telling whether the service works, let the next call probe."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.opened_at = time.monotonic() - self.reset_timeout
+                self._set_state(self.OPEN)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class LatencyTracker:
+    """Latencies of the last successful calls of a service, for hedging delays."""
+
+    def __init__(self, size: int = 200):
+        self._latencies = deque(maxlen=size)
+
+    def add(self, latency: float):
+        self._latencies.append(latency)
+
+    def quantile(self, q: float, min_samples: int = HEDGING_MIN_SAMPLES) -> Optional[float]:
+        if len(self._latencies) < min_samples:
+            return None
+        return float(np.percentile(self._latencies, q))
+
+
+def is_service_failure(error: BaseException) -> bool:
+    """Whether a call error counts against the service: timeouts, connection errors and 5xx replies."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BACKOFF_BASE, cap: float = RETRY_BACKOFF_MAX) -> float:
+    """Full jitter exponential backoff before retry number `attempt` (1 based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def hedged(call: Callable[[], Awaitable], delay: Optional[float], service: str):
+    """Await `call()`; if it is still running after `delay` seconds, race a second `call()` against it.
+
+    The first call to succeed wins and the other one is cancelled. Without a delay there is no hedge.
+    """
+    first = asyncio.ensure_future(call())
+    if delay is None:
+        return await first
+    # pending calls are cancelled however this returns, also when the caller itself is cancelled
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        second = asyncio.ensure_future(call())
+        tasks = {first: "first", second: "hedge"}
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    service_hedges.labels(service=service, winner=tasks[task]).inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
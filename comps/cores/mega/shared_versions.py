@@ -0,0 +1,37 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import ctypes
+import multiprocessing
+import zlib
+
+# version counters per SharedVersions; names are hashed onto them
+SHARED_VERSION_SLOTS = 4096
+
+
+class SharedVersions:
+    """Version counters of named entities, shared by the processes forked after creation.
+
+    HTTPService workers each keep their own in-memory caches; a worker that changes or invalidates
+    an entity bumps its version here, and the other workers see it on their next lookup. Names are
+    hashed onto a fixed number of slots in shared memory, so names sharing a slot only cause extra
+    invalidations. Create instances at import time, before the workers fork.
+    """
+
+    def __init__(self, slots: int = SHARED_VERSION_SLOTS):
+        self._counters = multiprocessing.Array(ctypes.c_uint64, slots)
+
+    def _slot(self, name: str) -> int:
+        return zlib.crc32(name.encode()) % len(self._counters)
+
+    def get(self, name: str) -> int:
+        # an aligned 64 bit read needs no lock
+        return self._counters.get_obj()[self._slot(name)]
+
+    def bump(self, name: str) -> int:
+        """Increment the version of `name` and return the new version."""
+        slot = self._slot(name)
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()
+            counters[slot] += 1
+            return counters[slot]
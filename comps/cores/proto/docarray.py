@@ -146,6 +146,16 @@ class SearchedMultimodalDoc(SearchedDoc):
     metadata: List[Dict[str, Any]]
 
 
+class EmbedDocBatch(BaseDoc):
+    # many queries, possibly across collections, searched in one call
+    docs: List[EmbedDoc]
+
+
+class SearchedMultimodalDocBatch(BaseDoc):
+    # one result per query, in the order of EmbedDocBatch.docs
+    results: List[SearchedMultimodalDoc]
+
+
 class LVMSearchedMultimodalDoc(SearchedMultimodalDoc):
     max_new_tokens: conint(ge=0, le=1024) = 512
     top_k: int = 10
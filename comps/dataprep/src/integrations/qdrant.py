@@ -1,19 +1,24 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
+import hashlib
 import json
 import os
+import time
+import uuid
 from typing import List, Optional, Union
 
+import aiohttp
 from fastapi import Body, File, Form, HTTPException, UploadFile
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings, HuggingFaceInferenceAPIEmbeddings
-from langchain_community.vectorstores import Qdrant
 from langchain_huggingface import HuggingFaceEmbeddings
+from prometheus_client import Counter, Histogram
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 
-from comps import CustomLogger, DocPath, OpeaComponent, OpeaComponentRegistry, ServiceType
+from comps import CustomLogger, DocPath, OpeaComponent, OpeaComponentRegistry, ServiceType, SharedVersions
 from comps.cores.proto.api_protocol import DataprepRequest
 from comps.dataprep.src.utils import (
     document_loader,
@@ -29,8 +34,6 @@ from comps.parsers.node import Node
 from comps.parsers.text import Text
 from comps.parsers.table import Table
 
-import requests
-
 logger = CustomLogger("opea_dataprep_qdrant")
 logflag = os.getenv("LOGFLAG", False)
 
@@ -48,6 +51,51 @@ TGI_LLM_ENDPOINT_NO_RAG = os.getenv("TGI_LLM_ENDPOINT_NO_RAG", "http://localhost
 TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "")
 HF_TOKEN = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACEHUB_API_TOKEN", "")
 
+# Comma separated URLs notified with {"collection_name", "version"} whenever a collection changes,
+# e.g. http://chatqna-backend:8888/v1/cache/invalidate,http://retriever:7000/v1/retrieval/invalidate
+# The retriever's result cache (QDRANT_RESULT_CACHE_SIZE) must only be enabled with its URL listed here
+CACHE_INVALIDATION_ENDPOINTS = [url.strip() for url in os.getenv("CACHE_INVALIDATION_ENDPOINTS", "").split(",") if url.strip()]
+
+# Ingest pipeline: chunks per embedding call and points per Qdrant upsert, batches waiting between
+# the stages, and concurrent embedding calls (more helps with a remote TEI embedder)
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 32))
+INGEST_UPSERT_BATCH_SIZE = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", 128))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 4))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", 1))
+
+ingested_chunks = Counter("dataprep_ingested_chunks", "Chunks embedded and stored in Qdrant")
+ingest_throughput = Histogram(
+    "dataprep_ingest_throughput",
+    "Ingest throughput of a document, in chunks per second",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+# Table descriptions: LLM calls in flight for one document, and for all ingests together, so
+# ingestion leaves room on the LLM shared with chat traffic
+TABLE_DESCRIPTION_CONCURRENCY = int(os.getenv("TABLE_DESCRIPTION_CONCURRENCY", 4))
+TABLE_DESCRIPTION_MAX_CONCURRENCY = int(os.getenv("TABLE_DESCRIPTION_MAX_CONCURRENCY", 8))
+TABLE_DESCRIPTION_TIMEOUT = float(os.getenv("TABLE_DESCRIPTION_TIMEOUT", 300))
+# descriptions are cached by heading, table and prompt version in this directory, e.g. a volume
+# mount; unset disables the cache. At most TABLE_DESCRIPTION_CACHE_MAX_FILES are kept, the least
+# recently used are removed first
+TABLE_DESCRIPTION_CACHE_DIR = os.getenv("TABLE_DESCRIPTION_CACHE_DIR", "")
+if TABLE_DESCRIPTION_CACHE_DIR:
+    TABLE_DESCRIPTION_CACHE_DIR = os.path.abspath(TABLE_DESCRIPTION_CACHE_DIR)
+TABLE_DESCRIPTION_CACHE_MAX_FILES = int(os.getenv("TABLE_DESCRIPTION_CACHE_MAX_FILES", 10000))
+# bump whenever TABLE_DESCRIPTION_PROMPT changes, so cached descriptions are regenerated
+TABLE_DESCRIPTION_PROMPT_VERSION = "1"
+TABLE_DESCRIPTION_PROMPT = """
+                        <s>[INST] <<SYS>>\n You are a helpful, respectful, and honest assistant. Your task is to generate a detailed and descriptive summary of the provided table data in Markdown format, based strictly on the table and its heading. <</SYS>> 
+                        [INST] Your job is to create a clear, specific, and **factual** textual description. **Do not add any external information** or provide an abstract summary. Only base the description on the data from the table and its heading.
+                        
+                        1. Link the **columns** with the corresponding **values** in the rows, referencing the exact terms and terminology from the table. 
+                        2. For each row, explain how each column's data relates to the corresponding values. Ensure the description is **step-by-step** and follows the structure of the table in a natural order.
+                        3. **Do not return the table itself.** Provide only the descriptive summary, written in **paragraphs**.
+                        4. The description should be precise, direct, and **avoid interpretation** or generalization. Stay true to the exact data given.
+                        
+                        Think carefully and make sure to describe every column and its respective values in detail. 
+                    """
+
 @OpeaComponentRegistry.register("OPEA_DATAPREP_QDRANT")
 class OpeaQdrantDataprep(OpeaComponent):
     """Dataprep component for Qdrant ingestion and search services."""
@@ -81,6 +129,10 @@ class OpeaQdrantDataprep(OpeaComponent):
             logger.error("OpeaQdrantDataprep health check failed.")
 
         self.tree_parser = TreeParser()
+        self.table_description_semaphore = asyncio.Semaphore(TABLE_DESCRIPTION_MAX_CONCURRENCY)
+        # bumped on every ingest/delete, so caches of a collection can tell stale entries apart;
+        # shared by the workers of the service, so versions keep increasing whichever worker ingests
+        self.collection_versions = SharedVersions()
 
     def check_health(self) -> bool:
         """Checks the health of the Qdrant service."""
@@ -106,7 +158,81 @@ class OpeaQdrantDataprep(OpeaComponent):
     def invoke(self, *args, **kwargs):
         pass
 
-    def get_table_description(self, item: Table):
+    async def bump_collection_version(self, collection_name: str) -> int:
+        """Mark the collection as changed and tell the caches in CACHE_INVALIDATION_ENDPOINTS."""
+        version = self.collection_versions.bump(collection_name)
+        if not CACHE_INVALIDATION_ENDPOINTS:
+            return version
+
+        payload = {"collection_name": collection_name, "version": version}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            for url in CACHE_INVALIDATION_ENDPOINTS:
+                try:
+                    async with session.post(url, json=payload) as response:
+                        if response.status >= 400:
+                            logger.error(f"Cache invalidation at {url} failed with status {response.status}")
+                except Exception as e:
+                    logger.error(f"Cache invalidation at {url} failed: {e}")
+        return version
+
+    def _table_description_cache_path(self, item: Table) -> str:
+        key = hashlib.sha256(
+            "\0".join([TABLE_DESCRIPTION_PROMPT_VERSION, item.heading or "", item.markdown_content or ""]).encode()
+        ).hexdigest()
+        return os.path.join(TABLE_DESCRIPTION_CACHE_DIR, f"{key}.json")
+
+    def _load_table_description(self, item: Table) -> Optional[str]:
+        if not TABLE_DESCRIPTION_CACHE_DIR:
+            return None
+        path = self._table_description_cache_path(item)
+        try:
+            with open(path) as f:
+                description = json.load(f)["description"]
+            # the mtime orders entries for eviction
+            os.utime(path)
+            return description
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_table_description(self, item: Table, description: str):
+        if not TABLE_DESCRIPTION_CACHE_DIR:
+            return
+        path = self._table_description_cache_path(item)
+        try:
+            os.makedirs(TABLE_DESCRIPTION_CACHE_DIR, exist_ok=True)
+            # write then rename, so concurrent ingests never read a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"description": description}, f)
+            os.replace(tmp_path, path)
+            self._evict_table_descriptions()
+        except OSError as e:
+            logger.error(f"Failed to cache table description at {path}: {e}")
+
+    def _evict_table_descriptions(self):
+        """Remove the least recently used cached descriptions beyond TABLE_DESCRIPTION_CACHE_MAX_FILES."""
+        entries = []
+        with os.scandir(TABLE_DESCRIPTION_CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass  # removed by a concurrent ingest
+        if len(entries) <= TABLE_DESCRIPTION_CACHE_MAX_FILES:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - TABLE_DESCRIPTION_CACHE_MAX_FILES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def get_table_description(self, item: Table, session: aiohttp.ClientSession) -> str:
+        description = self._load_table_description(item)
+        if description is not None:
+            return description
+
         server_host_ip = os.getenv("LLM_SERVER_HOST_IP", "localhost")
         server_port = os.getenv("LLM_SERVER_PORT", 8000)
         model_name = os.getenv("LLM_MODEL_ID")
@@ -121,17 +247,7 @@ class OpeaQdrantDataprep(OpeaComponent):
             "messages": [
                 {
                     "role": "system",
-                    "content": """
-                        <s>[INST] <<SYS>>\n You are a helpful, respectful, and honest assistant. Your task is to generate a detailed and descriptive summary of the provided table data in Markdown format, based strictly on the table and its heading. <</SYS>> 
-                        [INST] Your job is to create a clear, specific, and **factual** textual description. **Do not add any external information** or provide an abstract summary. Only base the description on the data from the table and its heading.
-                        
-                        1. Link the **columns** with the corresponding **values** in the rows, referencing the exact terms and terminology from the table. 
-                        2. For each row, explain how each column's data relates to the corresponding values. Ensure the description is **step-by-step** and follows the structure of the table in a natural order.
-                        3. **Do not return the table itself.** Provide only the descriptive summary, written in **paragraphs**.
-                        4. The description should be precise, direct, and **avoid interpretation** or generalization. Stay true to the exact data given.
-                        
-                        Think carefully and make sure to describe every column and its respective values in detail. 
-                    """
+                    "content": TABLE_DESCRIPTION_PROMPT,
                 },
                 {
                     "role": "user",
@@ -146,37 +262,62 @@ class OpeaQdrantDataprep(OpeaComponent):
         else:
             data["file_name"] = ""
 
-        response = requests.post(url, headers=headers, json=data)
-        import sys
-        print(f"DEBUG - Request URL: {url}", file=sys.stderr)
-        print(f"DEBUG - Request data: {data}", file=sys.stderr)
-        print(f"DEBUG - Response status: {response.status_code}", file=sys.stderr)
-        print(f"DEBUG - Response text: '{response.text}'", file=sys.stderr)
-        response_data = json.loads(response.text)
-        return response_data['choices'][0]['message']['content']
-
-    def chunk_node_content(self, node: Node, text_splitter: RecursiveCharacterTextSplitter):
-        content = node.get_content()
+        async with self.table_description_semaphore:
+            async with session.post(url, headers=headers, json=data) as response:
+                response_text = await response.text()
+        if logflag:
+            logger.info(f"Table description request to {url} returned status {response.status}")
+        response_data = json.loads(response_text)
+        description = response_data['choices'][0]['message']['content']
+        self._save_table_description(item, description)
+        return description
+
+    async def get_table_descriptions(self, tables: List[Table]) -> List[str]:
+        """Describe the tables concurrently, at most TABLE_DESCRIPTION_CONCURRENCY at a time."""
+        if not tables:
+            return []
+        semaphore = asyncio.Semaphore(TABLE_DESCRIPTION_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=TABLE_DESCRIPTION_TIMEOUT)
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+
+            async def describe(item: Table) -> str:
+                async with semaphore:
+                    return await self.get_table_description(item, session)
+
+            tasks = [asyncio.ensure_future(describe(item)) for item in tables]
+            try:
+                return await asyncio.gather(*tasks)
+            finally:
+                # the first failure fails the ingest, do not leave the other calls running
+                for task in tasks:
+                    task.cancel()
+
+    def collect_node_content(self, node: Node) -> list:
+        """Text and Table items of the node and its descendants, in document order."""
+        items = [item for item in node.get_content() if isinstance(item, (Text, Table))]
+        for i in range(node.get_length_children()):
+            items.extend(self.collect_node_content(node.get_child(i)))
+        return items
+
+    async def create_chunks(self, node: Node, text_splitter: RecursiveCharacterTextSplitter):
+        items = self.collect_node_content(node)
+        tables = [item for item in items if isinstance(item, Table)]
+        descriptions = iter(await self.get_table_descriptions(tables))
+        if logflag and tables:
+            logger.info(f"Described {len(tables)} tables")
+
         chunks = []
-        for item in content:
+        for item in items:
             if isinstance(item, Text):
-                text_chunks = text_splitter.split_text(item.content)
-                chunks.extend(text_chunks)
-            if isinstance(item, Table):
-                table_description = self.get_table_description(item)
-                table_description_chunks = text_splitter.split_text(table_description)
-                chunks.extend(table_description_chunks)
+                chunks.extend(text_splitter.split_text(item.content))
+            else:
+                chunks.extend(text_splitter.split_text(next(descriptions)))
         return chunks
 
-    def create_chunks(self, node: Node, text_splitter: RecursiveCharacterTextSplitter):
-        node_chunks = self.chunk_node_content(node, text_splitter)
-        total = node.get_length_children()
-        for i in range(total):
-            node_chunks.extend(self.create_chunks(node.get_child(i), text_splitter))
-        return node_chunks
-
     async def ingest_data_to_qdrant(self, doc_path: DocPath, collection_name: str):
         """Ingest document to Qdrant using tree parsing logic."""
+        start = time.monotonic()
         path = doc_path.path
         if logflag:
             logger.info(f"Parsing document {path} for collection {collection_name}.")
@@ -193,7 +334,7 @@ class OpeaQdrantDataprep(OpeaComponent):
         self.tree_parser.generate_output_text(tree)
 
         self.tree_parser.generate_output_json(tree)
-        chunks = self.create_chunks(tree.rootNode, text_splitter)
+        chunks = await self.create_chunks(tree.rootNode, text_splitter)
 
         structured_types = [".xlsx", ".csv", ".json", "jsonl"]
         _, ext = os.path.splitext(path)
@@ -217,23 +358,71 @@ class OpeaQdrantDataprep(OpeaComponent):
                 vectors_config=models.VectorParams(size=768, distance=models.Distance.COSINE),
             )
 
-        batch_size = 32
-        num_chunks = len(chunks)
-        for i in range(0, num_chunks, batch_size):
-            batch_chunks = chunks[i : i + batch_size]
-            batch_texts = batch_chunks
+        await self.embed_and_upsert(chunks, collection_name)
+        elapsed = time.monotonic() - start
+        throughput = len(chunks) / elapsed if elapsed > 0 else 0.0
+        ingest_throughput.observe(throughput)
+        logger.info(f"Ingested {len(chunks)} chunks of {path} in {elapsed:.1f}s ({throughput:.1f} chunks/s)")
+        return True
 
-            _ = Qdrant.from_texts(
-                texts=batch_texts,
-                embedding=self.embedder,
-                collection_name=collection_name,
-                host=QDRANT_HOST,
-                port=QDRANT_PORT,
-            )
-            if logflag:
-                logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1} for collection {collection_name}")
+    async def embed_and_upsert(self, chunks: List[str], collection_name: str):
+        """Embed the chunks and store them in the collection, as a pipeline of bounded stages.
 
-        return True
+        Batches of INGEST_EMBED_BATCH_SIZE chunks are embedded by INGEST_EMBED_WORKERS workers while
+        the points already embedded are upserted, INGEST_UPSERT_BATCH_SIZE at a time, with the
+        persistent client. The blocking calls run in threads so embedding and upload overlap. Points
+        have the payload layout of langchain's Qdrant vector store, which the retriever reads.
+        """
+        embed_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        upsert_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+        async def produce():
+            for i in range(0, len(chunks), INGEST_EMBED_BATCH_SIZE):
+                await embed_queue.put(chunks[i : i + INGEST_EMBED_BATCH_SIZE])
+            for _ in range(INGEST_EMBED_WORKERS):
+                await embed_queue.put(None)
+
+        async def embed():
+            while (texts := await embed_queue.get()) is not None:
+                vectors = await asyncio.to_thread(self.embedder.embed_documents, texts)
+                await upsert_queue.put(
+                    [
+                        models.PointStruct(
+                            id=uuid.uuid4().hex, vector=vector, payload={"page_content": text, "metadata": None}
+                        )
+                        for text, vector in zip(texts, vectors)
+                    ]
+                )
+
+        async def embed_all():
+            try:
+                await asyncio.gather(*(embed() for _ in range(INGEST_EMBED_WORKERS)))
+            finally:
+                await upsert_queue.put(None)
+
+        async def flush(points):
+            await asyncio.to_thread(self.client.upsert, collection_name=collection_name, points=points, wait=True)
+            ingested_chunks.inc(len(points))
+            if logflag:
+                logger.info(f"Upserted {len(points)} points into collection {collection_name}")
+
+        async def upsert():
+            pending = []
+            while (points := await upsert_queue.get()) is not None:
+                pending.extend(points)
+                while len(pending) >= INGEST_UPSERT_BATCH_SIZE:
+                    await flush(pending[:INGEST_UPSERT_BATCH_SIZE])
+                    pending = pending[INGEST_UPSERT_BATCH_SIZE:]
+            if pending:
+                await flush(pending)
+
+        tasks = [asyncio.ensure_future(stage()) for stage in (produce, embed_all, upsert)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # a failing stage fails the ingest, do not leave the others waiting on their queues
+            for task in tasks:
+                task.cancel()
 
     async def ingest_files(
         self,
@@ -270,38 +459,11 @@ class OpeaQdrantDataprep(OpeaComponent):
             if not isinstance(files, list):
                 files = [files]
             uploaded_files = []
-            for file in files:
-                encode_file = encode_filename(file.filename)
-                save_path = self.upload_folder + encode_file
-                await save_content_to_local_disk(save_path, file)
-                await self.ingest_data_to_qdrant(
-                    DocPath(
-                        path=save_path,
-                        chunk_size=chunk_size,
-                        chunk_overlap=chunk_overlap,
-                        process_table=process_table,
-                        table_strategy=table_strategy,
-                    ),
-                    collection_name=collection_name,
-                )
-                uploaded_files.append(save_path)
-                if logflag:
-                    logger.info(f"Successfully saved file {save_path} to collection {collection_name}")
-            result = {"status": 200, "message": "Data preparation succeeded"}
-            if logflag:
-                logger.info(result)
-            return result
-
-        if link_list:
-            link_list = json.loads(link_list)  # Parse JSON string to list
-            if not isinstance(link_list, list):
-                raise HTTPException(status_code=400, detail="link_list should be a list.")
-            for link in link_list:
-                encoded_link = encode_filename(link)
-                save_path = self.upload_folder + encoded_link + ".txt"
-                content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-                try:
-                    await save_content_to_local_disk(save_path, content)
+            try:
+                for file in files:
+                    encode_file = encode_filename(file.filename)
+                    save_path = self.upload_folder + encode_file
+                    await save_content_to_local_disk(save_path, file)
                     await self.ingest_data_to_qdrant(
                         DocPath(
                             path=save_path,
@@ -312,12 +474,46 @@ class OpeaQdrantDataprep(OpeaComponent):
                         ),
                         collection_name=collection_name,
                     )
-                except json.JSONDecodeError:
-                    raise HTTPException(status_code=500, detail="Fail to ingest data into qdrant.")
-
-                if logflag:
-                    logger.info(f"Successfully saved link {link} to collection {collection_name}")
+                    uploaded_files.append(save_path)
+                    if logflag:
+                        logger.info(f"Successfully saved file {save_path} to collection {collection_name}")
+            finally:
+                # also after a failure partway, as the points of the documents before are already stored
+                await self.bump_collection_version(collection_name)
+            result = {"status": 200, "message": "Data preparation succeeded"}
+            if logflag:
+                logger.info(result)
+            return result
 
+        if link_list:
+            link_list = json.loads(link_list)  # Parse JSON string to list
+            if not isinstance(link_list, list):
+                raise HTTPException(status_code=400, detail="link_list should be a list.")
+            try:
+                for link in link_list:
+                    encoded_link = encode_filename(link)
+                    save_path = self.upload_folder + encoded_link + ".txt"
+                    content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+                    try:
+                        await save_content_to_local_disk(save_path, content)
+                        await self.ingest_data_to_qdrant(
+                            DocPath(
+                                path=save_path,
+                                chunk_size=chunk_size,
+                                chunk_overlap=chunk_overlap,
+                                process_table=process_table,
+                                table_strategy=table_strategy,
+                            ),
+                            collection_name=collection_name,
+                        )
+                    except json.JSONDecodeError:
+                        raise HTTPException(status_code=500, detail="Fail to ingest data into qdrant.")
+
+                    if logflag:
+                        logger.info(f"Successfully saved link {link} to collection {collection_name}")
+            finally:
+                # also after a failure partway, as the points of the documents before are already stored
+                await self.bump_collection_version(collection_name)
             result = {"status": 200, "message": "Data preparation succeeded"}
             if logflag:
                 logger.info(result)
@@ -371,6 +567,7 @@ class OpeaQdrantDataprep(OpeaComponent):
 
         if file_path == "all":
             self.client.delete_collection(collection_name)
+            await self.bump_collection_version(collection_name)
             if logflag:
                 logger.info(f"Deleted all files from collection {collection_name}")
             return {"status": 200, "message": f"All files deleted from collection {collection_name}"}
@@ -388,6 +585,7 @@ class OpeaQdrantDataprep(OpeaComponent):
                     )
                 ),
             )
+            await self.bump_collection_version(collection_name)
             if logflag:
                 logger.info(f"Deleted file {file_path} from collection {collection_name}")
             return {"status": 200, "message": f"File {file_path} deleted from collection {collection_name}"}
@@ -0,0 +1,78 @@
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+# off by default; cached vectors go stale when EMBED_MODEL is not updated with the served model
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "false").lower() in ("true", "1", "yes")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# the model served by the embedding service; part of the key so a model change never reuses vectors
+EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-base-en-v1.5")
+
+embedding_cache_hits = Counter("embedding_cache_hits", "Query embedding cache hits")
+embedding_cache_misses = Counter("embedding_cache_misses", "Query embedding cache misses")
+embedding_cache_bytes = Gauge(
+    "embedding_cache_bytes", "Approximate size of the cached query embeddings", multiprocess_mode="livesum"
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """Exact-match LRU cache of query embeddings keyed by normalized text and model id.
+
+    Vectors are kept as float32 arrays, and the least recently used are dropped once the keys and
+    vectors exceed `max_bytes`.
+    """
+
+    def __init__(self, model_id: str = EMBED_MODEL, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (model id, normalized text) => float32 vector
+        self._bytes = 0
+
+    def _key(self, text: str):
+        return (self.model_id, normalize_text(text))
+
+    @staticmethod
+    def _size(key, vector: np.ndarray) -> int:
+        return len(key[1]) + vector.nbytes
+
+    def get(self, text) -> Optional[np.ndarray]:
+        if not isinstance(text, str):
+            return None
+        key = self._key(text)
+        vector = self._entries.get(key)
+        if vector is None:
+            embedding_cache_misses.inc()
+            return None
+        self._entries.move_to_end(key)
+        embedding_cache_hits.inc()
+        return vector
+
+    def put(self, text, embedding):
+        if not isinstance(text, str):
+            return
+        key = self._key(text)
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= self._size(key, previous)
+        self._entries[key] = vector
+        self._bytes += self._size(key, vector)
+
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, old_vector = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_vector)
+        embedding_cache_bytes.set(self._bytes)
+
+    def __len__(self) -> int:
+        return len(self._entries)
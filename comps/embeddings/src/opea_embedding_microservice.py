@@ -0,0 +1,65 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+
+import os
+import time
+
+from fastapi import HTTPException, Request
+
+from comps import (
+    CustomLogger,
+    EmbedDoc,
+    ServiceType,
+    TextDoc,
+    opea_microservices,
+    register_microservice,
+    register_statistics,
+    statistics_dict,
+)
+
+logger = CustomLogger("opea_embedding_microservice")
+logflag = os.getenv("LOGFLAG", False)
+
+TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "http://localhost:6006")
+# Coalesce concurrent requests into one TEI /embed call
+dynamic_batching_timeout = float(os.getenv("EMBEDDING_DYNAMIC_BATCHING_TIMEOUT", 0.005))
+dynamic_batching_max_batch_size = int(os.getenv("EMBEDDING_DYNAMIC_BATCHING_MAX_BATCH_SIZE", 32))
+
+
+@register_microservice(
+    name="opea_service@embedding",
+    service_type=ServiceType.EMBEDDING,
+    endpoint="/embed",
+    host="0.0.0.0",
+    port=6000,
+    provider_endpoint=TEI_EMBEDDING_ENDPOINT,
+    dynamic_batching=True,
+    dynamic_batching_timeout=dynamic_batching_timeout,
+    dynamic_batching_max_batch_size=dynamic_batching_max_batch_size,
+)
+@register_statistics(names=["opea_service@embedding"])
+async def embed(request: Request):
+    """TEI compatible /embed, so EMBEDDING_SERVER_HOST_IP of the megaservice can point here"""
+    start = time.time()
+    data = await request.json()
+    inputs = data.get("inputs")
+    if logflag:
+        logger.info(f"[ embedding ] input:{inputs}")
+
+    # queued with concurrent requests and embedded as one batch
+    try:
+        result: EmbedDoc = await opea_microservices["opea_service@embedding"].submit_dynamic_batch(
+            ServiceType.EMBEDDING, TextDoc(text=inputs)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    statistics_dict["opea_service@embedding"].append_latency(time.time() - start, None)
+    # TEI replies with one vector per input, also for a single string
+    return result.embedding if isinstance(inputs, list) else [result.embedding]
+
+
+if __name__ == "__main__":
+    logger.info("OPEA Embedding Microservice is starting...")
+    opea_microservices["opea_service@embedding"].start()
@@ -1,3 +1,5 @@
+import asyncio
+import aiohttp
 import re
 import os
 import json
@@ -5,8 +7,18 @@ import time
 from uuid import uuid4
 from datetime import datetime
 from typing import List, Dict, Optional
-from langchain_core.prompts import PromptTemplate
-from comps import MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps import (
+    CancellableStreamingResponse,
+    CircuitOpenError,
+    CustomLogger,
+    MegaServiceEndpoint,
+    MicroService,
+    RequestMetricsStore,
+    ServiceOrchestrator,
+    ServiceRoleType,
+    ServiceType,
+    statistics_dict,
+)
 from cores.mega.utils import handle_message
 from proto.api_protocol import (
     ChatCompletionRequest,
@@ -20,8 +32,20 @@ from dotenv import load_dotenv
 from proto.docarray import LLMParams, RerankerParms, RetrieverParms
 from fastapi import Request, HTTPException, File, UploadFile
 from fastapi.responses import StreamingResponse, JSONResponse
-from mongo_client import mongo_client
-import tiktoken
+from pymongo.errors import DuplicateKeyError
+from mongo_client import get_async_mongo_client
+from conversation_cache import ConversationCache
+from token_counter import TokenCounter, get_tokenizer
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, load_faq
+from embedding_cache import EMBEDDING_CACHE_ENABLED, EmbeddingCache
+from prompt_builder import AssembledPrompt, assemble_prompt, compile_template
+from admission import (
+    ADMISSION_DEFAULT_PRIORITY,
+    ADMISSION_ENABLED,
+    AdmissionController,
+    AdmissionRejected,
+    department_priority,
+)
 
 
 
@@ -52,9 +76,32 @@ RERANK_SERVER_HOST_IP = os.getenv("RERANK_SERVER_HOST_IP", "0.0.0.0")
 RERANK_SERVER_PORT = int(os.getenv("RERANK_SERVER_PORT", 80))
 LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP", "0.0.0.0")
 LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
+# comma separated host:port replicas, load balanced by the megaservice instead of the single host above
+EMBEDDING_SERVER_REPLICAS = [r.strip() for r in os.getenv("EMBEDDING_SERVER_REPLICAS", "").split(",") if r.strip()]
+RETRIEVER_SERVICE_REPLICAS = [r.strip() for r in os.getenv("RETRIEVER_SERVICE_REPLICAS", "").split(",") if r.strip()]
+RERANK_SERVER_REPLICAS = [r.strip() for r in os.getenv("RERANK_SERVER_REPLICAS", "").split(",") if r.strip()]
+LLM_SERVER_REPLICAS = [r.strip() for r in os.getenv("LLM_SERVER_REPLICAS", "").split(",") if r.strip()]
 LLM_MODEL = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
-
-TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+# ask the OpenAI-compatible LLM server for the exact completion token count at the end of a stream
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() in ("true", "1", "yes")
+# minimum seconds between two live token rate events of a stream
+STREAM_PROGRESS_INTERVAL = float(os.getenv("STREAM_PROGRESS_INTERVAL", "1.0"))
+
+logger = CustomLogger("chatqna")
+LOGFLAG = os.getenv("LOGFLAG", False)
+
+# TTFT / e2e latency / throughput of chat requests, aggregated per minute on /v1/statistics
+request_metrics = RequestMetricsStore()
+statistics_dict["chatqna_requests"] = request_metrics
+
+# answers of past questions, looked up right after the embedding node (SEMANTIC_CACHE_ENABLED)
+semantic_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
+# embeddings of repeated questions, so the embedding node is skipped for them (EMBEDDING_CACHE_ENABLED)
+embedding_cache = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
+# concurrency limit and priority queue in front of the pipeline (ADMISSION_ENABLED)
+admission = AdmissionController() if ADMISSION_ENABLED else None
+# seconds a user's admission priority is reused before it is read again from Mongo
+USER_PRIORITY_TTL = float(os.getenv("USER_PRIORITY_TTL", "300"))
 # ==========================================================
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-this")
@@ -62,6 +109,56 @@ JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-this")
 
 
 
+class RequestContext:
+    """Per-request state carried from the megaservice through the response stream.
+
+    Each request gets its own context instead of sharing attributes on the service, so concurrent
+    streams cannot read each other's sources or metrics. `release` drops the references once the
+    response is done.
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or str(uuid4())
+        self.result_dict = {}
+        self.sources = []
+        self.metrics = None
+        self.answer_parts = []
+        self.collection_name = None
+        self.query_embedding = None
+        self.cache_hit = None
+        self.priority = ADMISSION_DEFAULT_PRIORITY
+        self.admitted_at = None
+
+    def answer(self) -> str:
+        return "".join(self.answer_parts)
+
+    def find_sources(self) -> List[Dict]:
+        if self.sources:
+            return self.sources
+        for node_name, node_data in self.result_dict.items():
+            if isinstance(node_data, dict) and "selected_sources" in node_data:
+                if LOGFLAG:
+                    logger.info(f"Found {len(node_data['selected_sources'])} sources in node {node_name}")
+                return node_data["selected_sources"]
+        return []
+
+    def completed_metrics(self) -> Optional[Dict]:
+        if not self.metrics or not self.metrics.get("completed", False):
+            return None
+        return {
+            "ttft": float(self.metrics.get("ttft", 0.0)),
+            "e2e_latency": float(self.metrics.get("e2e_latency", 0.0)),
+            "output_tokens": int(self.metrics.get("output_tokens", 0)),
+            "prompt_tokens": int(self.metrics.get("prompt_tokens") or 0),
+            "throughput": float(self.metrics.get("throughput", 0.0))
+        }
+
+    def release(self):
+        self.result_dict = {}
+        self.sources = []
+        self.answer_parts = []
+
+
 def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
         inputs["inputs"] = inputs["text"]
@@ -76,9 +173,12 @@ def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **k
         next_inputs = {}
         next_inputs["model"] = LLM_MODEL
         next_inputs["messages"] = [{"role": "user", "content": inputs["inputs"]}]
-        next_inputs["max_tokens"] = llm_parameters_dict["max_tokens"]
+        # lowered by prompt assembly when the prompt needs more of the context window
+        next_inputs["max_tokens"] = inputs.get("answer_max_tokens", llm_parameters_dict["max_tokens"])
         next_inputs["top_p"] = llm_parameters_dict["top_p"]
         next_inputs["stream"] = inputs["stream"]
+        if inputs["stream"] and LLM_STREAM_USAGE:
+            next_inputs["stream_options"] = {"include_usage": True}
         next_inputs["frequency_penalty"] = inputs["frequency_penalty"]
         # next_inputs["presence_penalty"] = inputs["presence_penalty"]
         # next_inputs["repetition_penalty"] = inputs["repetition_penalty"]
@@ -86,11 +186,69 @@ def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **k
         inputs = next_inputs
     return inputs
 
+def short_circuit(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
+    if self.services[cur_node].service_type == ServiceType.EMBEDDING and embedding_cache is not None:
+        embedding = embedding_cache.get(inputs["inputs"])
+        if embedding is not None:
+            # same shape as the TEI /embed reply
+            return [embedding.tolist()]
+    return None
+
+def build_prompt(question, docs, scores, llm_parameters_dict, context=None) -> AssembledPrompt:
+    """Assemble the LLM prompt from the retrieved or reranked docs within the model's token budget.
+
+    A user chat template is used if it takes ['question', 'context'] or only ['question'],
+    otherwise the default RAG template.
+    """
+    template = None
+    question_only = False
+    chat_template = llm_parameters_dict["chat_template"]
+    if chat_template:
+        prompt_template = compile_template(chat_template)
+        input_variables = prompt_template.input_variables
+        if sorted(input_variables) == ["context", "question"]:
+            template = prompt_template
+        elif input_variables == ["question"]:
+            question_only = True
+            template = prompt_template
+        else:
+            print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
+
+    if question_only:
+        prompt = template.format(question=question)
+        assembled = AssembledPrompt(
+            prompt, list(range(len(docs))), get_tokenizer(LLM_MODEL)(prompt), 0, llm_parameters_dict["max_tokens"]
+        )
+    else:
+        assembled = assemble_prompt(
+            template if template is not None else ChatTemplate.rag_template(docs),
+            question,
+            docs,
+            scores,
+            model_id=LLM_MODEL,
+            max_tokens=llm_parameters_dict["max_tokens"],
+        )
+        if LOGFLAG:
+            logger.info(f"Prompt uses {len(assembled.selected)} of {len(docs)} docs, {assembled.prompt_tokens} tokens")
+
+    if context is not None and context.metrics is not None:
+        context.metrics["prompt_tokens"] = assembled.prompt_tokens
+    return assembled
+
 def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs):
     next_data = {}
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
         assert isinstance(data, list)
         next_data = {"text": inputs["inputs"], "embedding": data[0]}
+        if embedding_cache is not None:
+            embedding_cache.put(inputs["inputs"], data[0])
+        context = kwargs.get("request_context")
+        if semantic_cache is not None and context is not None:
+            context.query_embedding = data[0]
+            context.cache_hit = semantic_cache.lookup(context.collection_name, data[0])
+            if context.cache_hit is not None:
+                # skip retrieval and generation, run_chat answers from the cache
+                next_data["downstream_black_list"] = [".*"]
     elif self.services[cur_node].service_type == ServiceType.RETRIEVER:
         if "retrieved_docs" in data:
             enhanced_docs = []
@@ -118,31 +276,15 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
             if not docs and with_rerank:
                 # delete the rerank from retriever -> rerank -> llm
                 for ds in reversed(runtime_graph.downstream(cur_node)):
-                    for nds in runtime_graph.downstream(ds):
-                        runtime_graph.add_edge(cur_node, nds)
-                    runtime_graph.delete_node_if_exists(ds)
-
-            # handle template
-            # if user provides template, then format the prompt with it
-            # otherwise, use the default template
-            prompt = data["initial_query"]
-            chat_template = llm_parameters_dict["chat_template"]
-            if chat_template:
-                prompt_template = PromptTemplate.from_template(chat_template)
-                input_variables = prompt_template.input_variables
-                if sorted(input_variables) == ["context", "question"]:
-                    prompt = prompt_template.format(question=data["initial_query"], context="\n".join(docs))
-                elif input_variables == ["question"]:
-                    prompt = prompt_template.format(question=data["initial_query"])
-                else:
-                    print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
-                    prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
-            else:
-                prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
-            next_data["inputs"] = prompt
+                    runtime_graph.skip(ds)
+
+            # retrieved docs come in similarity order, which is the packing order
+            assembled = build_prompt(data["initial_query"], docs, None, llm_parameters_dict, kwargs.get("request_context"))
+            next_data["inputs"] = assembled.prompt
+            next_data["answer_max_tokens"] = assembled.max_tokens
             enhanced_sources = []
-            for doc in data["retrieved_docs"]:
-                source = doc.copy()
+            for idx in assembled.selected:
+                source = data["retrieved_docs"][idx].copy()
                 if "relevance_score" not in source:
                     source["relevance_score"] = 1.0
                 enhanced_sources.append(source)
@@ -154,7 +296,8 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
         top_n = reranker_parameters.top_n if reranker_parameters else 5
         docs = inputs["texts"]
         reranked_docs = []
-        selected_sources = []
+        reranked_scores = []
+        reranked_sources = []
         
         # doc_metadata = inputs.get("doc_metadata", [])
         doc_metadata = inputs.get("source_docs", [])
@@ -162,6 +305,8 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
         for best_response in data[:top_n]:
             idx = best_response["index"]
             reranked_docs.append(docs[idx])
+            reranked_scores.append(float(best_response["score"]))
+            reranked_sources.append(None)
             
             if idx < len(doc_metadata):
                 source_info = doc_metadata[idx].copy()
@@ -177,32 +322,21 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
                 #     file_name = get_file_name_for_chunk(chunk_id)
                 #     source_info["file_name"] = file_name
                 
-                selected_sources.append(source_info)
+                reranked_sources[-1] = source_info
                 print(f"DEBUG: Added reranked source: {source_info.get('source', 'unknown')} with score {source_info.get('relevance_score', 0.0)}")
 
-        # handle template
-        # if user provides template, then format the prompt with it
-        # otherwise, use the default template
-        prompt = inputs["query"]
-        chat_template = llm_parameters_dict["chat_template"]
-        if chat_template:
-            prompt_template = PromptTemplate.from_template(chat_template)
-            input_variables = prompt_template.input_variables
-            if sorted(input_variables) == ["context", "question"]:
-                prompt = prompt_template.format(question=prompt, context="\n".join(reranked_docs))
-            elif input_variables == ["question"]:
-                prompt = prompt_template.format(question=prompt)
-            else:
-                print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
-                prompt = ChatTemplate.generate_rag_prompt(prompt, reranked_docs)
-        else:
-            prompt = ChatTemplate.generate_rag_prompt(prompt, reranked_docs)
-
-        next_data["inputs"] = prompt
-        next_data["selected_sources"] = selected_sources
+        assembled = build_prompt(
+            inputs["query"], reranked_docs, reranked_scores, llm_parameters_dict, kwargs.get("request_context")
+        )
+        next_data["inputs"] = assembled.prompt
+        next_data["answer_max_tokens"] = assembled.max_tokens
+        next_data["selected_sources"] = [
+            reranked_sources[idx] for idx in assembled.selected if reranked_sources[idx] is not None
+        ]
 
     elif self.services[cur_node].service_type == ServiceType.LLM and not llm_parameters_dict["stream"]:
         next_data["text"] = data["choices"][0]["message"]["content"]
+        next_data["usage"] = data.get("usage")
         if "selected_sources" in inputs:
             next_data["selected_sources"] = inputs["selected_sources"]
     else:
@@ -212,106 +346,132 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
 
     return next_data
 
-def align_generator(self, gen, **kwargs):
-    buffer = ""
-    request_id = kwargs.get("request_id", str(uuid4()))
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event of the chat stream protocol.
+
+    Events: `sources` (before the first token), `token`, `progress` (live token rate),
+    `metrics`, `error` and a final `done`.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def iter_stream_lines(gen):
+    """Decoded lines of an upstream byte stream.
+
+    Bytes are buffered up to each newline before decoding, so an event or a multi-byte character
+    split across chunks arrives whole; undecodable bytes are replaced instead of failing the stream.
+    """
+    buffer = b""
+    async for chunk in gen:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+def stream_metrics(context, token_counter, ttft, e2e_start_time, end_time=None):
+    e2e_latency = (end_time or time.perf_counter()) - e2e_start_time
+    token_count = token_counter.total
+    throughput = token_count / max(e2e_latency - ttft if ttft > 0 else e2e_latency, 0.001)
+
+    final_metrics = {"e2e_latency": e2e_latency, "output_tokens": token_count, "throughput": throughput}
+    if ttft > 0:
+        final_metrics["ttft"] = ttft
+    context.metrics = request_metrics.complete(context.request_id, **final_metrics)
+
+    return {
+        "ttft": ttft if ttft > 0 else e2e_latency,
+        "output_tokens": token_count,
+        "prompt_tokens": int(context.metrics.get("prompt_tokens") or 0),
+        "throughput": throughput,
+        "e2e_latency": e2e_latency
+    }
+
+
+async def align_generator(self, gen, **kwargs):
+    context = kwargs.get("request_context") or RequestContext(kwargs.get("request_id"))
     
     ttft_start_time = kwargs.get("ttft_start_time", time.perf_counter())
     e2e_start_time = ttft_start_time
     
     ttft = 0.0
     first_token_received = False
-    token_count = 0
-    
-    self.__class__._metrics_registry[request_id] = {
-        "ttft": 0.0,
-        "e2e_latency": 0.0,
-        "completed": False,
-        "output_tokens": 0,
-        "throughput": 0
-    }
+    finished_at = None
+    failed = False
+    token_counter = TokenCounter(LLM_MODEL, start_time=e2e_start_time)
+    last_progress = e2e_start_time
     
-    full_response = ""
+    context.metrics = request_metrics.get(context.request_id) or request_metrics.start(context.request_id)
+
+    # retrieval is done once the LLM streams, so citations can be rendered before the answer
+    yield sse_event("sources", context.find_sources())
     
-    for line in gen:
-        line = line.decode("utf-8")
-        start = line.find("{")
-        end = line.rfind("}") + 1
-        json_str = line[start:end]
+    try:
+        async for line in iter_stream_lines(gen):
+            start = line.find("{")
+            end = line.rfind("}") + 1
+            json_str = line[start:end]
         
-        try:
-            json_data = json.loads(json_str)
-            if not first_token_received and json_data.get("choices") and json_data["choices"] and json_data["choices"][0].get("delta") and json_data["choices"][0]["delta"].get("content"):
-                ttft = time.perf_counter() - ttft_start_time
-                first_token_received = True
-                self.__class__._metrics_registry[request_id]["ttft"] = ttft
-            
-            if (
-                json_data["choices"][0]["finish_reason"] != "eos_token"
-                and "content" in json_data["choices"][0]["delta"]
-            ):
-                new_content = json_data["choices"][0]["delta"]["content"]
-                buffer += new_content
-                full_response += new_content
-
-                if buffer:
-                    yield buffer
-                    buffer = ""
-            
-            if json_data["choices"][0]["finish_reason"] == "stop":
-                e2e_latency = time.perf_counter() - e2e_start_time
-                token_count = len(TOKEN_ENCODING.encode(full_response))
-                throughput = token_count / max(e2e_latency - ttft if ttft > 0 else e2e_latency, 0.001)
-                
-                self.__class__._metrics_registry[request_id]["e2e_latency"] = e2e_latency
-                self.__class__._metrics_registry[request_id]["completed"] = True
-                self.__class__._metrics_registry[request_id]["output_tokens"] = token_count
-                self.__class__._metrics_registry[request_id]["throughput"] = throughput
-                
-                metrics_json = json.dumps({
-                    "metrics": {
-                        "ttft": ttft if ttft > 0 else e2e_latency,
-                        "output_tokens": token_count,
-                        "throughput": throughput,
-                        "e2e_latency": e2e_latency
-                    }
-                })
-                
-                yield f"__METRICS__{metrics_json}__METRICS__"
+            try:
+                json_data = json.loads(json_str)
+                # with stream_options.include_usage the last chunk carries the usage and no choices
+                token_counter.set_usage(json_data.get("usage"))
+                if not json_data.get("choices"):
+                    continue
+
+                if not first_token_received and json_data["choices"][0].get("delta") and json_data["choices"][0]["delta"].get("content"):
+                    ttft = time.perf_counter() - ttft_start_time
+                    first_token_received = True
+                    context.metrics["ttft"] = ttft
+            
+                if (
+                    json_data["choices"][0]["finish_reason"] != "eos_token"
+                    and "content" in json_data["choices"][0]["delta"]
+                ):
+                    new_content = json_data["choices"][0]["delta"]["content"]
+                    if new_content:
+                        context.answer_parts.append(new_content)
+                        token_counter.add_delta(new_content)
+                        yield sse_event("token", {"content": new_content})
+
+                        now = time.perf_counter()
+                        if now - last_progress >= STREAM_PROGRESS_INTERVAL:
+                            last_progress = now
+                            context.metrics["output_tokens"] = token_counter.total
+                            yield sse_event("progress", {
+                                "output_tokens": token_counter.total,
+                                "tokens_per_second": token_counter.tokens_per_second(now)
+                            })
+            
+                if json_data["choices"][0]["finish_reason"] == "stop":
+                    finished_at = time.perf_counter()
                 
-        except Exception as e:
-            if buffer:
-                yield buffer
-                buffer = ""
-            
-            cleaned_json_str = json_str.strip()
-            if cleaned_json_str:
-                yield cleaned_json_str
-    
-    if not self.__class__._metrics_registry[request_id]["completed"]:
-        e2e_latency = time.perf_counter() - e2e_start_time
-        token_count = len(TOKEN_ENCODING.encode(full_response))
-        throughput = token_count / max(e2e_latency - ttft if ttft > 0 else e2e_latency, 0.001)
-        
-        self.__class__._metrics_registry[request_id]["e2e_latency"] = e2e_latency
-        self.__class__._metrics_registry[request_id]["completed"] = True
-        self.__class__._metrics_registry[request_id]["output_tokens"] = token_count
-        self.__class__._metrics_registry[request_id]["throughput"] = throughput
-        
-        metrics_json = json.dumps({
-            "metrics": {
-                "ttft": ttft if ttft > 0 else e2e_latency,
-                "output_tokens": token_count,
-                "throughput": throughput,
-                "e2e_latency": e2e_latency
-            }
-        })
-        yield f"__METRICS__{metrics_json}__METRICS__"
+            except Exception as e:
+                cleaned_json_str = json_str.strip()
+                if cleaned_json_str:
+                    failed = True
+                    yield sse_event("error", {"message": cleaned_json_str})
+    except asyncio.TimeoutError:
+        # the request deadline or the LLM node budget ran out mid-stream
+        failed = True
+        yield sse_event("error", {"message": "The answer took too long and was cut off"})
+    except aiohttp.ClientError as e:
+        # the LLM server dropped the connection or sent a broken body mid-stream
+        failed = True
+        logger.error(f"LLM stream of request {context.request_id} failed: {e}")
+        yield sse_event("error", {"message": "The answer was cut off by an upstream error"})
     
-    if buffer:
-        yield buffer
+    # sent once the stream is over, as the upstream usage chunk follows the "stop" chunk
+    yield sse_event("metrics", stream_metrics(context, token_counter, ttft, e2e_start_time, finished_at))
+
+    if semantic_cache is not None and context.query_embedding is not None and finished_at and not failed:
+        semantic_cache.store(
+            context.collection_name, kwargs.get("question", ""), context.query_embedding, context.answer(), context.find_sources()
+        )
     
-    yield ""
+    yield sse_event("done", {"request_id": context.request_id})
 
 
 class SourceInfo(BaseModel):
@@ -370,6 +530,10 @@ class ConversationResponse(BaseModel):
 class ChatTemplate:
     @staticmethod
     def generate_rag_prompt(question, documents):
+        return ChatTemplate.rag_template(documents).format(context="\n".join(documents), question=question)
+
+    @staticmethod
+    def rag_template(documents) -> str:
         context_str = "\n".join(documents)
         if context_str and len(re.findall("[\u4E00-\u9FFF]", context_str)) / len(context_str) >= 0.3:
             # chinese context
@@ -389,7 +553,7 @@ If you don't know the answer to a question, please don't share false information
 ### Question: {question} \n
 ### Answer:
 """
-        return template.format(context=context_str, question=question)
+        return template
 
 class ChatQnAService:
     def __init__(self, host="0.0.0.0", port=8000):
@@ -398,10 +562,12 @@ class ChatQnAService:
         ServiceOrchestrator.align_inputs = align_inputs
         ServiceOrchestrator.align_outputs = align_outputs
         ServiceOrchestrator.align_generator = align_generator
-        ServiceOrchestrator._metrics_registry = {}
+        ServiceOrchestrator.short_circuit = short_circuit
         self.megaservice = ServiceOrchestrator()
         self.endpoint = str(MegaServiceEndpoint.CHAT_QNA)
-        self.last_result_dict = {}
+        self.user_priorities = {}  # user id -> (priority, expiry)
+        # load the tokenizer now rather than on the first streamed answer
+        get_tokenizer(LLM_MODEL)
 
     def add_remote_service(self):
 
@@ -409,6 +575,7 @@ class ChatQnAService:
             name="embedding",
             host=EMBEDDING_SERVER_HOST_IP,
             port=EMBEDDING_SERVER_PORT,
+            replicas=EMBEDDING_SERVER_REPLICAS,
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
@@ -418,6 +585,7 @@ class ChatQnAService:
             name="retriever",
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
+            replicas=RETRIEVER_SERVICE_REPLICAS,
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
@@ -427,6 +595,7 @@ class ChatQnAService:
             name="rerank",
             host=RERANK_SERVER_HOST_IP,
             port=RERANK_SERVER_PORT,
+            replicas=RERANK_SERVER_REPLICAS,
             endpoint="/rerank",
             use_remote_service=True,
             service_type=ServiceType.RERANK,
@@ -436,6 +605,7 @@ class ChatQnAService:
             name="llm",
             host=LLM_SERVER_HOST_IP,
             port=LLM_SERVER_PORT,
+            replicas=LLM_SERVER_REPLICAS,
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
@@ -451,6 +621,7 @@ class ChatQnAService:
             name="embedding",
             host=EMBEDDING_SERVER_HOST_IP,
             port=EMBEDDING_SERVER_PORT,
+            replicas=EMBEDDING_SERVER_REPLICAS,
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
@@ -460,6 +631,7 @@ class ChatQnAService:
             name="retriever",
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
+            replicas=RETRIEVER_SERVICE_REPLICAS,
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
@@ -469,6 +641,7 @@ class ChatQnAService:
             name="llm",
             host=LLM_SERVER_HOST_IP,
             port=LLM_SERVER_PORT,
+            replicas=LLM_SERVER_REPLICAS,
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
@@ -490,6 +663,7 @@ class ChatQnAService:
             name="embedding",
             host=EMBEDDING_SERVER_HOST_IP,
             port=EMBEDDING_SERVER_PORT,
+            replicas=EMBEDDING_SERVER_REPLICAS,
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
@@ -498,6 +672,7 @@ class ChatQnAService:
             name="retriever",
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
+            replicas=RETRIEVER_SERVICE_REPLICAS,
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
@@ -506,6 +681,7 @@ class ChatQnAService:
             name="rerank",
             host=RERANK_SERVER_HOST_IP,
             port=RERANK_SERVER_PORT,
+            replicas=RERANK_SERVER_REPLICAS,
             endpoint="/rerank",
             use_remote_service=True,
             service_type=ServiceType.RERANK,
@@ -514,6 +690,7 @@ class ChatQnAService:
             name="llm",
             host=LLM_SERVER_HOST_IP,
             port=LLM_SERVER_PORT,
+            replicas=LLM_SERVER_REPLICAS,
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
@@ -536,13 +713,72 @@ class ChatQnAService:
 
     async def handle_request(self, request: Request):
         data = await request.json()
+        context = RequestContext()
+        context.priority = await self.request_priority(request, data.get("db_name"))
+        return await self.run_chat(data, context)
+
+    async def request_priority(self, request: Request, db_name: Optional[str] = None) -> int:
+        """Admission priority of the caller, from the departments of the user in its bearer token."""
+        authorization = request.headers.get("Authorization", "")
+        if admission is None or not authorization.startswith("Bearer "):
+            return ADMISSION_DEFAULT_PRIORITY
+        try:
+            user_id = jwt.decode(authorization[len("Bearer "):], JWT_SECRET, algorithms=["HS256"])["user_id"]
+        except Exception:
+            return ADMISSION_DEFAULT_PRIORITY
+
+        cached = self.user_priorities.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        user = await get_async_mongo_client()[db_name or "lenovo-db"]["users"].find_one(
+            {"id": user_id}, {"_id": 0, "departments": 1, "priority": 1}
+        )
+        priority = ADMISSION_DEFAULT_PRIORITY
+        if user is not None:
+            # an explicit per-user priority wins over the departments
+            priority = user["priority"] if user.get("priority") is not None else department_priority(user.get("departments"))
+        self.user_priorities[user_id] = (priority, time.monotonic() + USER_PRIORITY_TTL)
+        return priority
+
+    def release_admission(self, context: RequestContext, streamed: bool = False):
+        if admission is None or context.admitted_at is None:
+            return
+        ttft = context.metrics.get("ttft") if streamed and context.metrics else None
+        admission.release(context.admitted_at, ttft=ttft or None)
+        context.admitted_at = None
+
+    async def run_chat(self, data: Dict, context: RequestContext):
+        """Run the pipeline for a chat request once admission control lets it in.
+
+        A streamed answer keeps its slot until the stream is over or the client goes away.
+        """
+        if admission is not None:
+            try:
+                await admission.acquire(context.priority)
+            except AdmissionRejected as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            context.admitted_at = time.monotonic()
+
+        response = None
+        try:
+            response = await self.run_pipeline(data, context)
+            return response
+        finally:
+            if isinstance(response, CancellableStreamingResponse):
+                async def release_stream_slot():
+                    self.release_admission(context, streamed=True)
+
+                response.on_close.append(release_stream_slot)
+            else:
+                self.release_admission(context)
+
+    async def run_pipeline(self, data: Dict, context: RequestContext):
         stream_opt = data.get("stream", True)
         chat_request = ChatCompletionRequest.parse_obj(data)
         prompt = handle_message(chat_request.messages)
-        request_id = str(uuid4())
+        request_id = context.request_id
         
         sources = []
-        self.last_sources = []
 
         collection_name = data.get("collection_name", None)
         
@@ -572,6 +808,10 @@ class ChatQnAService:
 
         e2e_start_time = time.perf_counter()
         ttft_start_time = e2e_start_time
+        # the client's timeout bounds every service call of the request
+        deadline = time.monotonic() + chat_request.timeout if chat_request.timeout else None
+        context.metrics = request_metrics.start(request_id)
+        context.collection_name = collection_name
         
         try:
             result_dict, runtime_graph = await self.megaservice.schedule(
@@ -581,9 +821,15 @@ class ChatQnAService:
                 reranker_parameters=reranker_parameters,
                 ttft_start_time=ttft_start_time,
                 request_id=request_id,
+                request_context=context,
+                question=prompt,
+                deadline=deadline,
             )
             
-            self.last_result_dict = result_dict
+            context.result_dict = result_dict
+
+            if context.cache_hit is not None:
+                return self.cached_response(context, stream_opt, data.get("include_metrics", False), e2e_start_time)
 
             sources = []
             try:
@@ -594,14 +840,9 @@ class ChatQnAService:
             except (IndexError, TypeError, KeyError) as e:
                 print(f"Error accessing last node sources: {e}")
 
-            if not sources:
-                for node_name, node_data in result_dict.items():
-                    if isinstance(node_data, dict) and "selected_sources" in node_data:
-                        sources = node_data["selected_sources"]
-                        print(f"DEBUG: Found {len(sources)} sources in node {node_name}")
-                        break
-
-            self.last_sources = sources
+            context.sources = sources
+            sources = context.find_sources()
+            context.sources = sources
             
             for node, response in result_dict.items():
                 if isinstance(response, StreamingResponse):
@@ -611,10 +852,12 @@ class ChatQnAService:
             e2e_latency = e2e_end_time - e2e_start_time
                     
             response = "No response generated"
+            llm_usage = None
             try:
                 last_node = runtime_graph.all_leaves()[-1]
                 if isinstance(result_dict[last_node], dict) and "text" in result_dict[last_node]:
                     response = result_dict[last_node]["text"]
+                    llm_usage = result_dict[last_node].get("usage")
                 else:
                     print(f"WARNING: No response text found in result_dict[{last_node}]")
             except (IndexError, TypeError, KeyError) as e:
@@ -622,8 +865,19 @@ class ChatQnAService:
                 
             print(f"DEBUG: Using {len(sources)} pre-extracted sources for response")
                 
+            token_counter = TokenCounter(LLM_MODEL, start_time=e2e_start_time)
+            token_counter.set_usage(llm_usage)
+            if token_counter.usage_tokens is None:
+                token_counter.add_text(response)
+
             choices = []
-            usage = UsageInfo()
+            # the server's count when it reports usage, else the count of the assembled prompt
+            prompt_tokens = int((llm_usage or {}).get("prompt_tokens") or context.metrics.get("prompt_tokens") or 0)
+            usage = UsageInfo(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=token_counter.total,
+                total_tokens=prompt_tokens + token_counter.total,
+            )
             choices.append(
                 ChatCompletionResponseChoice(
                     index=0,
@@ -641,30 +895,25 @@ class ChatQnAService:
             response_dict = completion_response.dict()
             response_dict["sources"] = sources
 
+            if semantic_cache is not None and context.query_embedding is not None and response != "No response generated":
+                semantic_cache.store(collection_name, prompt, context.query_embedding, response, sources)
+
             if not stream_opt:
-                token_count = len(TOKEN_ENCODING.encode(response))
+                token_count = token_counter.total
                 throughput = token_count / max(e2e_latency, 0.001)
-                self.megaservice.__class__._metrics_registry[request_id] = {
-                    "ttft": e2e_latency,
-                    "e2e_latency": e2e_latency,
-                    "completed": True,
-                    "output_tokens": token_count,
-                    "throughput": throughput
-                }
+                context.metrics = request_metrics.complete(
+                    request_id,
+                    ttft=e2e_latency,
+                    e2e_latency=e2e_latency,
+                    output_tokens=token_count,
+                    throughput=throughput,
+                )
 
             include_metrics = data.get("include_metrics", False)
 
-            metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-
             if include_metrics:
-                if metrics_registry_data and metrics_registry_data.get("completed", False):
-                    metrics_data = {
-                        "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                        "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                        "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                        "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                    }
-                else:
+                metrics_data = context.completed_metrics()
+                if not metrics_data:
                     metrics_data = {
                         "ttft": 0.0,
                         "e2e_latency": 0.0,
@@ -672,9 +921,6 @@ class ChatQnAService:
                         "throughput": 0.0
                     }
                 response_dict["metrics"] = metrics_data
-
-            if request_id in self.megaservice.__class__._metrics_registry:
-                del self.megaservice.__class__._metrics_registry[request_id]
             
             print(f"DEBUG: Returning response with {len(sources)} sources")
             for i, src in enumerate(sources):
@@ -682,12 +928,109 @@ class ChatQnAService:
             
             return JSONResponse(content=response_dict)
             
+        except CircuitOpenError as e:
+            print(f"ERROR in handle_request: {str(e)}")
+            request_metrics.discard(request_id)
+            raise HTTPException(status_code=503, detail=str(e))
+        except aiohttp.ClientResponseError as e:
+            # a pipeline service rejected the request the megaservice built
+            print(f"ERROR in handle_request: {e.message}")
+            request_metrics.discard(request_id)
+            raise HTTPException(status_code=502, detail=e.message)
+        except asyncio.TimeoutError as e:
+            print(f"ERROR in handle_request: request {request_id} timed out: {str(e)}")
+            request_metrics.discard(request_id)
+            raise HTTPException(status_code=504, detail=str(e) or "Request timed out")
         except Exception as e:
             print(f"ERROR in handle_request: {str(e)}")
             import traceback
             traceback.print_exc()
+            request_metrics.discard(request_id)
             raise HTTPException(status_code=500, detail=str(e))
 
+    def cached_response(self, context: RequestContext, stream_opt: bool, include_metrics: bool, e2e_start_time: float):
+        """Answer from the semantic cache, in the same shape as a generated answer"""
+        entry = context.cache_hit
+        context.sources = entry.sources
+        context.answer_parts = [entry.answer]
+
+        token_counter = TokenCounter(LLM_MODEL, start_time=e2e_start_time)
+        token_counter.add_text(entry.answer)
+        e2e_latency = time.perf_counter() - e2e_start_time
+        metrics_data = {
+            "ttft": e2e_latency,
+            "e2e_latency": e2e_latency,
+            "output_tokens": token_counter.total,
+            "throughput": token_counter.total / max(e2e_latency, 0.001)
+        }
+        context.metrics = request_metrics.complete(context.request_id, **metrics_data)
+
+        if stream_opt:
+            async def cached_stream():
+                yield sse_event("sources", entry.sources)
+                yield sse_event("token", {"content": entry.answer})
+                yield sse_event("metrics", metrics_data)
+                yield sse_event("done", {"request_id": context.request_id, "cached": True})
+
+            return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+        completion_response = ChatCompletionResponse(
+            model="chatqna",
+            choices=[
+                ChatCompletionResponseChoice(
+                    index=0,
+                    message=ChatMessage(role="assistant", content=entry.answer),
+                    finish_reason="stop",
+                )
+            ],
+            usage=UsageInfo(completion_tokens=token_counter.total, total_tokens=token_counter.total),
+        )
+        response_dict = completion_response.dict()
+        response_dict["sources"] = entry.sources
+        if include_metrics:
+            response_dict["metrics"] = metrics_data
+        return JSONResponse(content=response_dict)
+
+    async def handle_cache_invalidate(self, request: Request):
+        """Drop cached answers of a collection; called by dataprep when its files change"""
+        data = await request.json()
+        collection_name = data.get("collection_name")
+        if semantic_cache is not None:
+            semantic_cache.invalidate(collection_name)
+        return JSONResponse(content={"message": "Cache invalidated", "collection_name": collection_name})
+
+    async def preload_semantic_cache(self):
+        """Seed the semantic cache with the FAQ in SEMANTIC_CACHE_FAQ_FILE"""
+        if semantic_cache is None:
+            return
+        faq = load_faq()
+        if not faq:
+            return
+
+        embedding = next(s for s in self.megaservice.services.values() if s.service_type == ServiceType.EMBEDDING)
+        session = self.megaservice.get_session()
+        async with session.post(embedding.endpoint_path(None), json={"inputs": [item["question"] for item in faq]}) as response:
+            response.raise_for_status()
+            embeddings = await response.json()
+
+        for item, question_embedding in zip(faq, embeddings):
+            semantic_cache.store(
+                item.get("collection_name"),
+                item["question"],
+                question_embedding,
+                item["answer"],
+                item.get("sources", []),
+                pinned=True,
+            )
+        print(f"Preloaded {len(faq)} FAQ answers into the semantic cache")
+
+    def setup_semantic_cache(self):
+        self.service.add_route("/v1/cache/invalidate", self.handle_cache_invalidate, methods=["POST"])
+        try:
+            self.service.event_loop.run_until_complete(self.preload_semantic_cache())
+        except Exception as e:
+            print(f"Error preloading the semantic cache: {str(e)}")
+
     def start(self):
         self.service = MicroService(
             self.__class__.__name__,
@@ -700,19 +1043,23 @@ class ChatQnAService:
         )
 
         self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
+        self.service.add_shutdown_event(self.megaservice.close)
+        self.service.add_worker_init(self.megaservice.warmup)
+        self.setup_semantic_cache()
 
         self.service.start()
 
 class ConversationRAGService(ChatQnAService):
     def __init__(self, host="0.0.0.0", port=8000):
         super().__init__(host=host, port=port)
-        self.active_conversations = {}
-        
-        try:
-            self.mongo_client = mongo_client
-        except Exception as e:
-            print(f"Error connecting to MongoDB: {str(e)}")
-            raise Exception("Failed to connect to MongoDB")
+        self.active_conversations = ConversationCache()
+        self.indexed_collections = set()
+
+
+    @property
+    def mongo_client(self):
+        # created per process, forked workers must not share the client of the master
+        return get_async_mongo_client()
     
     # Password management methods
     def hash_password(self, password: str) -> str:
@@ -721,14 +1068,14 @@ class ConversationRAGService(ChatQnAService):
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         return pwd_context.verify(plain_password, hashed_password)
 
-    def create_default_admin_sync(self):
-        """Create default admin user if none exists (synchronous version)"""
+    async def create_default_admin(self):
+        """Create default admin user if none exists"""
         try:
             db = self.mongo_client['lenovo-db']
             users_collection = db["users"]
             
             # Check if any admin user exists
-            admin_exists = users_collection.find_one({"role": "admin"})
+            admin_exists = await users_collection.find_one({"role": "admin"})
             
             if not admin_exists:
                 # Create default admin
@@ -744,7 +1091,12 @@ class ConversationRAGService(ChatQnAService):
                     "updated_at": datetime.now()
                 }
                 
-                users_collection.insert_one(default_admin)
+                try:
+                    # a fixed _id, so workers bootstrapping at the same time create a single admin
+                    await users_collection.insert_one({"_id": "default-admin", **default_admin})
+                except DuplicateKeyError:
+                    print("✅ Admin user already exists")
+                    return
                 print("✅ Default admin user created:")
                 print("   Email: admin@lenovo.com")
                 print("   Password: admin123")
@@ -762,8 +1114,8 @@ class ConversationRAGService(ChatQnAService):
             db = self.mongo_client[data["db_name"]]
             conversations_collection = db["conversations"]
             conversation_id = str(uuid4())
-            self.active_conversations[conversation_id] = []
-            conversations_collection.insert_one({
+            self.active_conversations.put(conversation_id, [])
+            await conversations_collection.insert_one({
                 "conversation_id": conversation_id,
                 "created_at": datetime.now(),
                 "last_updated": datetime.now(),
@@ -774,7 +1126,7 @@ class ConversationRAGService(ChatQnAService):
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def save_conversation_turn(self, conversation_id: str, question: str, conversations_collection, answer: str, sources: List[Dict], metrics: Dict = None):
+    async def save_conversation_turn(self, conversation_id: str, question: str, conversations_collection, answer: str, sources: List[Dict], metrics: Dict = None):
         turn = {
             "question": question,
             "answer": answer,
@@ -790,25 +1142,33 @@ class ConversationRAGService(ChatQnAService):
                 "throughput": float(metrics.get("throughput", 0.0))
             }
 
-        if conversation_id not in self.active_conversations:
-            self.active_conversations[conversation_id] = []
-        
-        self.active_conversations[conversation_id].append(turn)
-
         serialized_turn = self.serialize_datetime(turn)
         
-        conversations_collection.update_one(
+        # Append only the new turn, so saving costs the same however long the
+        # conversation is and concurrent workers do not overwrite each other's turns
+        await self.ensure_conversation_indexes(conversations_collection)
+        await conversations_collection.update_one(
             {"conversation_id": conversation_id},
             {
-                "$set": {
-                    "last_updated": datetime.now().isoformat(),
-                    "history": self.serialize_datetime(self.active_conversations[conversation_id])
-                }
+                "$push": {"history": serialized_turn},
+                "$set": {"last_updated": datetime.now().isoformat()},
+                "$setOnInsert": {"created_at": datetime.now()}
             },
             upsert=True
         )
+        # Only complete histories are cached; a conversation that is not cached is reloaded from Mongo on use.
+        # The turn is cached once stored, so other workers reloading on its version bump see it in Mongo
+        self.active_conversations.append(conversation_id, turn)
         print(f"DEBUG: Saved conversation turn with metrics: {turn.get('metrics', {})}")
 
+    async def ensure_conversation_indexes(self, conversations_collection):
+        """Index conversation_id once per database so turn appends do not scan the collection"""
+        key = conversations_collection.full_name
+        if key in self.indexed_collections:
+            return
+        await conversations_collection.create_index("conversation_id")
+        self.indexed_collections.add(key)
+
     def prepare_source_info_list(self, sources_data: List[Dict]) -> List[SourceInfo]:
         source_info_list = []
         for source in sources_data:
@@ -840,14 +1200,14 @@ class ConversationRAGService(ChatQnAService):
             if not conversation_request.conversation_id and "conversation_id" in request.path_params:
                 conversation_request.conversation_id = request.path_params["conversation_id"]
 
-            if conversation_request.conversation_id not in self.active_conversations:
-                stored_conversation = conversations_collection.find_one(
-                    {"conversation_id": conversation_request.conversation_id}
+            if self.active_conversations.get(conversation_request.conversation_id) is None:
+                version = self.active_conversations.version(conversation_request.conversation_id)
+                stored_conversation = await conversations_collection.find_one(
+                    {"conversation_id": conversation_request.conversation_id},
+                    {"_id": 0, "history": 1}
                 )
-                if stored_conversation:
-                    self.active_conversations[conversation_request.conversation_id] = stored_conversation["history"]
-                else:
-                    self.active_conversations[conversation_request.conversation_id] = []
+                history = stored_conversation.get("history", []) if stored_conversation else []
+                self.active_conversations.put(conversation_request.conversation_id, history, version)
 
             chat_data = {
                 "messages": [{"role": "user", "content": conversation_request.question}],
@@ -860,74 +1220,34 @@ class ConversationRAGService(ChatQnAService):
                 "include_metrics": include_metrics
             }
 
-            new_request = Request(scope=request.scope)
-            async def receive():
-                return {"type": "http.request", "body": json.dumps(chat_data).encode()}
-            new_request._receive = receive
-
-            rag_response = await super().handle_request(new_request)
+            context = RequestContext(request_id)
+            context.priority = await self.request_priority(request, conversation_request.db_name)
+            rag_response = await self.run_chat(chat_data, context)
             
             if isinstance(rag_response, StreamingResponse):
                 if stream:
                     original_body_iterator = rag_response.body_iterator
                     
                     async def capture_and_forward():
-                        full_response = ""
-                        metrics_data = None
-                        
+                        # align_generator collects the answer and metrics in the request context,
+                        # so the events are forwarded untouched
                         try:
                             async for chunk in original_body_iterator:
                                 yield chunk
-                                chunk_str = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
-                                
-                                metrics_match = re.search(r"__METRICS__(.*?)__METRICS__", chunk_str)
-                                if metrics_match:
-                                    try:
-                                        metrics_json = json.loads(metrics_match.group(1))
-                                        metrics_data = metrics_json.get("metrics", {})
-                                        chunk_str = chunk_str.replace(metrics_match.group(0), "")
-                                    except Exception as e:
-                                        print(f"Failed to parse metrics: {e}")
-                                        metrics_data = {
-                                            "ttft": 0.0,
-                                            "e2e_latency": 0.0,
-                                            "output_tokens": 0,
-                                            "throughput": 0.0
-                                        }
-                                
-                                full_response += chunk_str
                         except Exception as e:
                             print(f"Error during streaming: {e}")
-                            error_message = f"Streaming error occurred: {str(e)}"
-                            yield error_message.encode('utf-8') if isinstance(chunk, bytes) else error_message
-                        
-                        sources = []
-                        metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-                        
-                        if hasattr(self, 'last_result_dict') and self.last_result_dict:
-                            for node_name, node_data in self.last_result_dict.items():
-                                if isinstance(node_data, dict) and "selected_sources" in node_data:
-                                    sources = node_data["selected_sources"]
-                                    print(f"DEBUG: Found {len(sources)} sources in node {node_name}")
-                                    break
+                            yield sse_event("error", {"message": f"Streaming error occurred: {str(e)}"})
                         
-                        if not sources and hasattr(self, 'last_sources') and self.last_sources:
-                            sources = self.last_sources
-                            print(f"DEBUG: Using {len(sources)} pre-extracted sources")
+                        sources = context.find_sources()
+                        if LOGFLAG:
+                            logger.info(f"Using {len(sources)} sources of request {request_id}")
                         
-                        full_response = re.sub(r"__METRICS__.*?__METRICS__", "", full_response)
-                        full_response = full_response.strip()
+                        full_response = context.answer().strip()
                         
                         full_response = full_response.replace('\r\n', '\n').replace('\n{3,}', '\n\n')
                                                 
-                        if not metrics_data and metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
-                        elif not metrics_data:
+                        metrics_data = context.completed_metrics()
+                        if not metrics_data:
                             metrics_data = {
                                 "ttft": 0.0,
                                 "e2e_latency": 0.0,
@@ -937,7 +1257,7 @@ class ConversationRAGService(ChatQnAService):
                         
                         print(f"DEBUG: Saving streamed content to MongoDB: {len(full_response)} chars, {len(sources)} sources")
                         if include_metrics:
-                            self.save_conversation_turn(
+                            await self.save_conversation_turn(
                                 conversation_request.conversation_id,
                                 conversation_request.question,
                                 conversations_collection,
@@ -946,7 +1266,7 @@ class ConversationRAGService(ChatQnAService):
                                 metrics_data
                             )
                         else:
-                            self.save_conversation_turn(
+                            await self.save_conversation_turn(
                                 conversation_request.conversation_id,
                                 conversation_request.question,
                                 conversations_collection,
@@ -955,14 +1275,15 @@ class ConversationRAGService(ChatQnAService):
                                 None
                             )
                         
-                        if request_id in self.megaservice.__class__._metrics_registry:
-                            del self.megaservice.__class__._metrics_registry[request_id]
+                        context.release()
                                                 
-                    new_streaming_response = StreamingResponse(
+                    # closing the wrapper on disconnect also cancels the LLM stream
+                    new_streaming_response = CancellableStreamingResponse(
                         capture_and_forward(),
                         status_code=rag_response.status_code,
                         headers=dict(rag_response.headers),
-                        media_type=rag_response.media_type
+                        media_type=rag_response.media_type,
+                        on_close=[rag_response.aclose] if isinstance(rag_response, CancellableStreamingResponse) else None,
                     )
                     
                     return new_streaming_response
@@ -975,21 +1296,13 @@ class ConversationRAGService(ChatQnAService):
                         "throughput": 0.0
                     }
                     
-                    metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-
                     if include_metrics:
-                        if metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
+                        metrics_data = context.completed_metrics() or metrics_data
                     
                     answer_text = answer_text.replace('\r\n', '\n').replace('\n{3,}', '\n\n')
                     
                     if include_metrics:
-                        self.save_conversation_turn(
+                        await self.save_conversation_turn(
                             conversation_request.conversation_id,
                             conversation_request.question,
                             conversations_collection,
@@ -998,7 +1311,7 @@ class ConversationRAGService(ChatQnAService):
                             metrics_data
                         )
                     else:
-                        self.save_conversation_turn(
+                        await self.save_conversation_turn(
                             conversation_request.conversation_id,
                             conversation_request.question,
                             conversations_collection,
@@ -1035,15 +1348,8 @@ class ConversationRAGService(ChatQnAService):
                 if include_metrics:
                     metrics_data = response_data.get("metrics")
                     if not metrics_data:
-                        metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-                        if metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
-                        else:
+                        metrics_data = context.completed_metrics()
+                        if not metrics_data:
                             metrics_data = {
                                 "ttft": 0.0,
                                 "e2e_latency": 0.0,
@@ -1062,7 +1368,7 @@ class ConversationRAGService(ChatQnAService):
                         processed_sources.append(processed_source)
 
                 if include_metrics and metrics_data:
-                    self.save_conversation_turn(
+                    await self.save_conversation_turn(
                         conversation_request.conversation_id,
                         conversation_request.question,
                         conversations_collection,
@@ -1071,7 +1377,7 @@ class ConversationRAGService(ChatQnAService):
                         metrics_data
                     )
                 else:
-                    self.save_conversation_turn(
+                    await self.save_conversation_turn(
                         conversation_request.conversation_id,
                         conversation_request.question,
                         conversations_collection,
@@ -1080,8 +1386,7 @@ class ConversationRAGService(ChatQnAService):
                         None
                     )
 
-                if request_id in self.megaservice.__class__._metrics_registry:
-                    del self.megaservice.__class__._metrics_registry[request_id]
+                context.release()
 
                 source_info_list = self.prepare_source_info_list(processed_sources)
 
@@ -1101,6 +1406,9 @@ class ConversationRAGService(ChatQnAService):
 
             return rag_response
 
+        except HTTPException:
+            # e.g. 429 from admission control, with its Retry-After header
+            raise
         except Exception as e:
             print(f"Error processing request: {str(e)}")
             import traceback
@@ -1117,17 +1425,39 @@ class ConversationRAGService(ChatQnAService):
             db = self.mongo_client[db_name]
             conversations_collection = db["conversations"]
             conversation_id = request.path_params["conversation_id"]
-            
-            if conversation_id in self.active_conversations:
-                stored_conversation = conversations_collection.find_one(
-                    {"conversation_id": conversation_id}
-                )
-                if stored_conversation:
-                    stored_conversation.pop('_id', None)
-                    serialized_data = self.serialize_datetime(stored_conversation)
-                    return JSONResponse(content=serialized_data)
-            
-            stored_conversation = conversations_collection.find_one(
+
+            # Optional pagination over the turns: ?skip=<first turn>&limit=<number of turns>
+            if "limit" in query_params or "skip" in query_params:
+                try:
+                    skip = max(int(query_params.get("skip", 0)), 0)
+                    limit = int(query_params.get("limit", 50))
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="'skip' and 'limit' must be integers")
+                if limit <= 0:
+                    raise HTTPException(status_code=400, detail="'limit' must be a positive integer")
+
+                pipeline = [
+                    {"$match": {"conversation_id": conversation_id}},
+                    {"$limit": 1},
+                    {"$project": {
+                        "_id": 0,
+                        "conversation_id": 1,
+                        "created_at": 1,
+                        "last_updated": 1,
+                        "total_turns": {"$size": {"$ifNull": ["$history", []]}},
+                        "history": {"$slice": [{"$ifNull": ["$history", []]}, skip, limit]}
+                    }}
+                ]
+                results = await conversations_collection.aggregate(pipeline).to_list(length=1)
+                if not results:
+                    raise HTTPException(status_code=404, detail="Conversation not found")
+
+                stored_conversation = results[0]
+                stored_conversation["skip"] = skip
+                stored_conversation["limit"] = limit
+                return JSONResponse(content=self.serialize_datetime(stored_conversation))
+
+            stored_conversation = await conversations_collection.find_one(
                 {"conversation_id": conversation_id}
             )
             
@@ -1157,7 +1487,7 @@ class ConversationRAGService(ChatQnAService):
             
             self.active_conversations.pop(conversation_id, None)
             
-            result = conversations_collection.delete_one(
+            result = await conversations_collection.delete_one(
                 {"conversation_id": conversation_id}
             )
             
@@ -1181,13 +1511,14 @@ class ConversationRAGService(ChatQnAService):
             limit = int(query_params.get("limit", 10))
             skip = int(query_params.get("skip", 0))
             
-            conversations = list(conversations_collection
-                                .find({}, {'_id': 0})
-                                .sort('last_updated', -1)
-                                .skip(skip)
-                                .limit(limit))
+            conversations = await (conversations_collection
+                                   .find({}, {'_id': 0})
+                                   .sort('last_updated', -1)
+                                   .skip(skip)
+                                   .limit(limit)
+                                   .to_list(length=None))
             
-            total = conversations_collection.count_documents({})
+            total = await conversations_collection.count_documents({})
             
             serialized_conversations = self.serialize_datetime(conversations)
             
@@ -1223,7 +1554,7 @@ class ConversationRAGService(ChatQnAService):
                 query["collection_name"] = collection_name
             
             files_cursor = uploads_collection.find(query, {'_id': 0}).sort('upload_date', -1)
-            files_list = list(files_cursor)
+            files_list = await files_cursor.to_list(length=None)
             
             serialized_files = self.serialize_datetime(files_list)
             
@@ -1264,7 +1595,7 @@ class ConversationRAGService(ChatQnAService):
                 "metadata": data.get("metadata", {})
             }
             
-            uploads_collection.insert_one(file_record)
+            await uploads_collection.insert_one(file_record)
             
             file_record.pop('_id', None)
             serialized_record = self.serialize_datetime(file_record)
@@ -1290,7 +1621,7 @@ class ConversationRAGService(ChatQnAService):
             db = self.mongo_client[db_name]
             users_collection = db["users"]
             
-            existing_user = users_collection.find_one({"email": user_data.email})
+            existing_user = await users_collection.find_one({"email": user_data.email})
             if existing_user:
                 raise HTTPException(status_code=400, detail="User with this email already exists")
             
@@ -1301,7 +1632,7 @@ class ConversationRAGService(ChatQnAService):
                 "id": str(uuid4()),
                 "name": user_data.name,
                 "email": user_data.email,
-                "password_hash": self.hash_password(user_data.password),
+                "password_hash": await asyncio.to_thread(self.hash_password, user_data.password),
                 "departments": user_data.departments,
                 "role": user_data.role,
                 "status": "Active",
@@ -1309,7 +1640,7 @@ class ConversationRAGService(ChatQnAService):
                 "updated_at": datetime.now()
             }
             
-            users_collection.insert_one(user_doc)
+            await users_collection.insert_one(user_doc)
             
             user_doc.pop('_id', None)
             user_doc.pop('password_hash', None)
@@ -1340,17 +1671,17 @@ class ConversationRAGService(ChatQnAService):
             users_collection = db["users"]
             
             # Check if collection exists and has users
-            user_count = users_collection.count_documents({})
+            user_count = await users_collection.count_documents({})
             print(f"DEBUG: Total users in collection: {user_count}")
             
             # Find user by email
-            user = users_collection.find_one({"email": login_data.email})
+            user = await users_collection.find_one({"email": login_data.email})
             print(f"DEBUG: User found: {user is not None}")
             
             if not user:
                 print(f"DEBUG: No user found with email: {login_data.email}")
                 # Let's see what users actually exist
-                all_users = list(users_collection.find({}, {"email": 1, "role": 1}))
+                all_users = await users_collection.find({}, {"email": 1, "role": 1}).to_list(length=None)
                 print(f"DEBUG: All users in DB: {all_users}")
                 raise HTTPException(status_code=401, detail="Invalid email or password")
             
@@ -1361,7 +1692,7 @@ class ConversationRAGService(ChatQnAService):
                 raise HTTPException(status_code=401, detail="User account is inactive")
             
             # Verify password
-            password_valid = self.verify_password(login_data.password, user["password_hash"])
+            password_valid = await asyncio.to_thread(self.verify_password, login_data.password, user["password_hash"])
             print(f"DEBUG: Password valid: {password_valid}")
             
             if not password_valid:
@@ -1402,7 +1733,7 @@ class ConversationRAGService(ChatQnAService):
             users_collection = db["users"]
             
             users_cursor = users_collection.find({}, {'password_hash': 0, '_id': 0}).sort('created_at', -1)
-            users_list = list(users_cursor)
+            users_list = await users_cursor.to_list(length=None)
             
             return JSONResponse(content={
                 "users": self.serialize_datetime(users_list),
@@ -1422,7 +1753,7 @@ class ConversationRAGService(ChatQnAService):
             db = self.mongo_client[db_name]
             users_collection = db["users"]
             
-            existing_user = users_collection.find_one({"id": user_id})
+            existing_user = await users_collection.find_one({"id": user_id})
             if not existing_user:
                 raise HTTPException(status_code=404, detail="User not found")
             
@@ -1433,7 +1764,7 @@ class ConversationRAGService(ChatQnAService):
             if "name" in data:
                 update_data["name"] = data["name"]
             if "email" in data:
-                email_check = users_collection.find_one({"email": data["email"], "id": {"$ne": user_id}})
+                email_check = await users_collection.find_one({"email": data["email"], "id": {"$ne": user_id}})
                 if email_check:
                     raise HTTPException(status_code=400, detail="Email already exists")
                 update_data["email"] = data["email"]
@@ -1446,9 +1777,9 @@ class ConversationRAGService(ChatQnAService):
             if "password" in data and data["password"]:
                 if len(data["password"]) < 6:
                     raise HTTPException(status_code=400, detail="Password must be at least 6 characters long")
-                update_data["password_hash"] = self.hash_password(data["password"])
+                update_data["password_hash"] = await asyncio.to_thread(self.hash_password, data["password"])
             
-            result = users_collection.update_one(
+            result = await users_collection.update_one(
                 {"id": user_id},
                 {"$set": update_data}
             )
@@ -1456,7 +1787,7 @@ class ConversationRAGService(ChatQnAService):
             if result.modified_count == 0:
                 raise HTTPException(status_code=404, detail="User not found or no changes made")
             
-            updated_user = users_collection.find_one({"id": user_id}, {'password_hash': 0, '_id': 0})
+            updated_user = await users_collection.find_one({"id": user_id}, {'password_hash': 0, '_id': 0})
             
             return JSONResponse(content={
                 "message": "User updated successfully",
@@ -1478,7 +1809,7 @@ class ConversationRAGService(ChatQnAService):
             db = self.mongo_client[db_name]
             users_collection = db["users"]
             
-            result = users_collection.delete_one({"id": user_id})
+            result = await users_collection.delete_one({"id": user_id})
             
             if result.deleted_count == 0:
                 raise HTTPException(status_code=404, detail="User not found")
@@ -1531,9 +1862,14 @@ class ConversationRAGService(ChatQnAService):
         self.service.add_route("/api/users/{user_id}", self.handle_update_user, methods=["PUT"])
         self.service.add_route("/api/users/{user_id}", self.handle_delete_user, methods=["DELETE"])
 
-        # Create default admin synchronously BEFORE starting the service
+        # Create default admin in every serving process BEFORE it serves requests, on its own Mongo client
         print("Creating default admin user...")
-        self.create_default_admin_sync()
+        self.service.add_worker_init(self.create_default_admin)
+
+        # Pooled connections to the embed -> retrieve -> rerank -> llm chain, opened by each worker
+        self.service.add_shutdown_event(self.megaservice.close)
+        self.service.add_worker_init(self.megaservice.warmup)
+        self.setup_semantic_cache()
         
         print("Starting service...")
         self.service.start()
@@ -1,6 +1,6 @@
-import pymongo
 import os
 from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
 
 
 load_dotenv()
@@ -9,19 +9,29 @@ MONGO_USERNAME = os.getenv("MONGO_USERNAME")
 MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
 MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
 MONGO_PORT = os.getenv("MONGO_PORT", "27017")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
 
 if MONGO_USERNAME and MONGO_PASSWORD:
     MONGO_URI = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}"
 else:
     MONGO_URI = f"mongodb://{MONGO_HOST}:{MONGO_PORT}"
 
-try:
-    mongo_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    mongo_client.server_info()
-    print("Successfully connected to MongoDB")
+# Request handlers run on the service event loop and must not block it, so they use the
+# motor client. It connects lazily on the loop of its first operation.
+_async_mongo_client = None
+_async_mongo_client_pid = None
 
-except Exception as e:
-    print(f"Error connecting to MongoDB: {str(e)}")
-    mongo_client = None
-    db = None
-    conversations_collection = None
+
+def get_async_mongo_client() -> AsyncIOMotorClient:
+    """Motor client of this process, created on first use.
+
+    Forked HTTPService workers create their own: the connections, monitor threads and event loop
+    of a client created before the fork do not carry over to the child.
+    """
+    global _async_mongo_client, _async_mongo_client_pid
+    if _async_mongo_client is None or _async_mongo_client_pid != os.getpid():
+        _async_mongo_client = AsyncIOMotorClient(
+            MONGO_URI, serverSelectionTimeoutMS=5000, maxPoolSize=MONGO_MAX_POOL_SIZE
+        )
+        _async_mongo_client_pid = os.getpid()
+    return _async_mongo_client
@@ -0,0 +1,164 @@
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+from comps import CustomLogger
+from langchain_core.prompts import PromptTemplate
+from prometheus_client import Counter, Histogram
+
+from token_counter import get_tokenizer
+
+logger = CustomLogger("prompt_builder")
+
+# context window of the served model, in tokens; register_context_window overrides it per model
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+# tokens kept free for the chat template and special tokens the LLM server adds around the prompt
+PROMPT_RESERVED_TOKENS = int(os.getenv("PROMPT_RESERVED_TOKENS", "64"))
+# word-shingle Jaccard similarity from which a chunk counts as a duplicate of a better ranked one
+PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.9"))
+# a chunk is only truncated to fit when at least this many tokens of it would remain
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", "32"))
+# tokens kept for retrieved docs when max_tokens would leave less; the answer's max_tokens is lowered instead
+PROMPT_MIN_CONTEXT_TOKENS = int(os.getenv("PROMPT_MIN_CONTEXT_TOKENS", "512"))
+
+prompt_tokens_histogram = Histogram(
+    "chatqna_prompt_tokens",
+    "Tokens of the assembled LLM prompt",
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+prompt_chunks = Counter("chatqna_prompt_chunks", "Retrieved chunks by prompt assembly outcome", ["outcome"])
+
+_context_windows: Dict[str, int] = {}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+|\n+")
+_WORD = re.compile(r"\w+")
+
+
+def register_context_window(model_id: str, tokens: int):
+    """Set the context window of a model, for models served with a non default max length."""
+    _context_windows[model_id] = tokens
+
+
+def context_window(model_id: str) -> int:
+    return _context_windows.get(model_id, LLM_CONTEXT_WINDOW)
+
+
+@lru_cache(maxsize=128)
+def compile_template(template: str) -> PromptTemplate:
+    """Parse a user chat template once; requests reuse the compiled template."""
+    return PromptTemplate.from_template(template)
+
+
+def _shingles(text: str, size: int = 3) -> frozenset:
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return frozenset([" ".join(words)])
+    return frozenset(" ".join(words[i : i + size]) for i in range(len(words) - size + 1))
+
+
+def _is_duplicate(shingles: frozenset, kept: List[frozenset], threshold: float) -> bool:
+    for other in kept:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= threshold:
+            return True
+    return False
+
+
+def truncate_to_sentences(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """Longest prefix of whole sentences of `text` that fits in `max_tokens`."""
+    kept = []
+    used = 0
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence + " ")
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+class AssembledPrompt:
+    def __init__(self, prompt: str, selected: List[int], prompt_tokens: int, context_tokens: int, max_tokens: int):
+        self.prompt = prompt
+        # positions in the input docs of the chunks that made it into the prompt, best first
+        self.selected = selected
+        self.prompt_tokens = prompt_tokens
+        self.context_tokens = context_tokens
+        # answer tokens to request from the LLM, at most the requested max_tokens
+        self.max_tokens = max_tokens
+
+
+def assemble_prompt(
+    template,
+    question: str,
+    docs: Sequence[str],
+    scores: Optional[Sequence[float]] = None,
+    model_id: str = "",
+    max_tokens: int = 1024,
+    dedup_threshold: float = PROMPT_DEDUP_THRESHOLD,
+) -> AssembledPrompt:
+    """Fill `template` ({context} and {question}) with as many docs as the token budget allows.
+
+    Docs are taken by descending score (input order when no scores are given), near-duplicates of
+    a better ranked doc are dropped, and the first doc that does not fit is cut at a sentence
+    boundary. The budget is the model's context window minus `max_tokens` for the answer, the
+    template with the question, and PROMPT_RESERVED_TOKENS. When that leaves docs less than
+    PROMPT_MIN_CONTEXT_TOKENS, the minimum is kept for them and `max_tokens` is lowered to fit.
+    """
+    count_tokens = get_tokenizer(model_id)
+    overhead = count_tokens(template.format(context="", question=question))
+    available = context_window(model_id) - overhead - PROMPT_RESERVED_TOKENS
+    budget = available - max_tokens
+    if budget < PROMPT_MIN_CONTEXT_TOKENS and docs:
+        budget = min(PROMPT_MIN_CONTEXT_TOKENS, max(available - 1, 0))
+        logger.warning(
+            f"max_tokens {max_tokens} leaves {available - max_tokens} of the {context_window(model_id)} token "
+            f"context window of {model_id or 'the model'} for retrieved docs; keeping {budget} for them "
+            f"and lowering max_tokens to {available - budget}"
+        )
+        max_tokens = available - budget
+
+    order = list(range(len(docs)))
+    if scores is not None:
+        order.sort(key=lambda i: scores[i], reverse=True)
+
+    selected = []
+    parts = []
+    kept_shingles = []
+    used = 0
+    for position, i in enumerate(order):
+        text = docs[i].strip()
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if _is_duplicate(shingles, kept_shingles, dedup_threshold):
+            prompt_chunks.labels(outcome="duplicate").inc()
+            continue
+
+        # each chunk is followed by the newline joining it to the next one
+        tokens = count_tokens(text + "\n")
+        if used + tokens > budget:
+            remaining = budget - used
+            text = truncate_to_sentences(text, remaining, count_tokens) if remaining >= PROMPT_MIN_CHUNK_TOKENS else ""
+            if text:
+                selected.append(i)
+                parts.append(text)
+                used += count_tokens(text + "\n")
+                prompt_chunks.labels(outcome="truncated").inc()
+            prompt_chunks.labels(outcome="over_budget").inc(len(order) - position - (1 if text else 0))
+            break
+
+        selected.append(i)
+        parts.append(text)
+        kept_shingles.append(shingles)
+        used += tokens
+        prompt_chunks.labels(outcome="kept").inc()
+
+    prompt = template.format(context="\n".join(parts), question=question)
+    prompt_tokens = count_tokens(prompt)
+    prompt_tokens_histogram.observe(prompt_tokens)
+    return AssembledPrompt(prompt, selected, prompt_tokens, used, max_tokens)
@@ -65,6 +65,16 @@ QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
 QDRANT_EMBED_DIMENSION = os.getenv("QDRANT_EMBED_DIMENSION", 768)
 QDRANT_INDEX_NAME = os.getenv("QDRANT_INDEX_NAME", "rag-qdrant")
+# Max number of collections whose document store / retriever are kept alive
+QDRANT_CLIENT_CACHE_SIZE = int(os.getenv("QDRANT_CLIENT_CACHE_SIZE", 16))
+# Seconds a cached document store is reused before it is rebuilt, 0 disables expiry
+QDRANT_CLIENT_CACHE_TTL = float(os.getenv("QDRANT_CLIENT_CACHE_TTL", 0))
+# Max number of cached search results, 0 (default) disables the retrieval result cache. Only enable it
+# together with dataprep's CACHE_INVALIDATION_ENDPOINTS listing this retriever's /v1/retrieval/invalidate,
+# otherwise results from before an ingest or delete are served until they expire
+QDRANT_RESULT_CACHE_SIZE = int(os.getenv("QDRANT_RESULT_CACHE_SIZE", 0))
+# Seconds a cached search result is served, as a safety net for changes dataprep did not announce
+QDRANT_RESULT_CACHE_TTL = float(os.getenv("QDRANT_RESULT_CACHE_TTL", 300))
 
 
 # Summarizer Configuration
@@ -2,19 +2,106 @@
 # SPDX-License-Identifier: Apache-2.0
 
 
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from types import SimpleNamespace
+from typing import List
 
+import numpy as np
 from haystack_integrations.components.retrievers.qdrant import QdrantEmbeddingRetriever
 from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+from haystack_integrations.document_stores.qdrant.converters import (
+    DENSE_VECTORS_NAME,
+    convert_qdrant_point_to_haystack_document,
+)
+from prometheus_client import Counter, Gauge
+from qdrant_client.http import models
 
-from comps import CustomLogger, EmbedDoc, OpeaComponent, OpeaComponentRegistry, ServiceType
+from comps import CustomLogger, EmbedDoc, OpeaComponent, OpeaComponentRegistry, ServiceType, SharedVersions
 
-from .config import QDRANT_EMBED_DIMENSION, QDRANT_HOST, QDRANT_INDEX_NAME, QDRANT_PORT
+from .config import (
+    QDRANT_CLIENT_CACHE_SIZE,
+    QDRANT_CLIENT_CACHE_TTL,
+    QDRANT_EMBED_DIMENSION,
+    QDRANT_HOST,
+    QDRANT_INDEX_NAME,
+    QDRANT_PORT,
+    QDRANT_RESULT_CACHE_SIZE,
+    QDRANT_RESULT_CACHE_TTL,
+)
 
 logger = CustomLogger("qdrant_retrievers")
 logflag = os.getenv("LOGFLAG", False)
 
+client_cache_hits = Counter("retriever_qdrant_client_cache_hits", "Qdrant client cache hits")
+client_cache_misses = Counter("retriever_qdrant_client_cache_misses", "Qdrant client cache misses")
+client_cache_evictions = Counter(
+    "retriever_qdrant_client_cache_evictions", "Qdrant client cache evictions", ["reason"]
+)
+client_cache_size = Gauge(
+    "retriever_qdrant_client_cache_size", "Number of cached Qdrant collections", multiprocess_mode="livesum"
+)
+result_cache_hits = Counter("retriever_qdrant_result_cache_hits", "Qdrant search result cache hits")
+result_cache_misses = Counter("retriever_qdrant_result_cache_misses", "Qdrant search result cache misses")
+result_cache_size = Gauge(
+    "retriever_qdrant_result_cache_size", "Number of cached Qdrant search results", multiprocess_mode="livesum"
+)
+
+
+def _is_missing_collection_error(e: Exception) -> bool:
+    """Whether the error means the collection behind a cached store no longer exists."""
+    if getattr(e, "status_code", None) == 404:
+        return True
+    message = str(e).lower()
+    return "not found" in message or "doesn't exist" in message or "does not exist" in message
+
+
+def _copy_results(results: list) -> list:
+    """Copies search results, so callers may edit them without touching the cached ones."""
+    copies = []
+    for res in results:
+        fields = dict(vars(res))
+        if isinstance(fields.get("metadata"), dict):
+            fields["metadata"] = dict(fields["metadata"])
+        copies.append(SimpleNamespace(**fields))
+    return copies
+
+
+def maximal_marginal_relevance(query_embedding, embeddings, lambda_mult: float = 0.5, k: int = 4) -> list:
+    """Select `k` indices of `embeddings` balancing similarity to the query against redundancy.
+
+    Cosine similarities are computed once as matrix products, then each greedy step only
+    updates the running max similarity to the already selected candidates.
+    """
+    candidates = np.asarray(embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or len(candidates) == 0 or k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+
+    candidates = candidates / np.clip(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12, None)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    query_similarity = candidates @ query
+    pairwise_similarity = candidates @ candidates.T
+
+    first = int(np.argmax(query_similarity))
+    selected = [first]
+    redundancy = pairwise_similarity[first].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(redundancy, pairwise_similarity[idx], out=redundancy)
+
+    return selected
+
 
 @OpeaComponentRegistry.register("OPEA_RETRIEVER_QDRANT")
 class OpeaQDrantRetriever(OpeaComponent):
@@ -23,6 +110,19 @@ class OpeaQDrantRetriever(OpeaComponent):
     def __init__(self, name: str, description: str, config: dict = None):
         super().__init__(name, ServiceType.RETRIEVER.name.lower(), description, config)
 
+        # collection name -> (document store, retriever, creation time), in LRU order
+        self.cache_size = max(1, QDRANT_CLIENT_CACHE_SIZE)
+        self.cache_ttl = QDRANT_CLIENT_CACHE_TTL
+        self._client_cache = OrderedDict()
+
+        # (collection name, collection version, query hash) -> (results, creation time), in LRU order
+        self.result_cache_size = QDRANT_RESULT_CACHE_SIZE
+        self.result_cache_ttl = QDRANT_RESULT_CACHE_TTL
+        self._result_cache = OrderedDict()
+        # bumped whenever dataprep changes a collection, so results cached before are never served;
+        # shared with the other workers of the service, which keep their own result caches
+        self.collection_versions = SharedVersions()
+
         health_status = self.check_health()
         if not health_status:
             logger.error("OpeaQDrantRetriever health check failed.")
@@ -41,6 +141,88 @@ class OpeaQDrantRetriever(OpeaComponent):
 
         return qdrant_store, retriever
 
+    def _get_client(self, collection_name: str) -> tuple:
+        """Returns the cached document store and retriever of a collection, building them on a miss."""
+        entry = self._client_cache.get(collection_name)
+        if entry is not None:
+            qdrant_store, retriever, created_at = entry
+            if self.cache_ttl and time.monotonic() - created_at > self.cache_ttl:
+                self._evict(collection_name, "expired")
+            else:
+                self._client_cache.move_to_end(collection_name)
+                client_cache_hits.inc()
+                return qdrant_store, retriever
+
+        client_cache_misses.inc()
+        qdrant_store, retriever = self._initialize_client(collection_name)
+        self._client_cache[collection_name] = (qdrant_store, retriever, time.monotonic())
+        while len(self._client_cache) > self.cache_size:
+            oldest = next(iter(self._client_cache))
+            self._evict(oldest, "capacity")
+        client_cache_size.set(len(self._client_cache))
+        return qdrant_store, retriever
+
+    def _evict(self, collection_name: str, reason: str):
+        """Drops a collection from the cache and closes its client connection."""
+        entry = self._client_cache.pop(collection_name, None)
+        if entry is None:
+            return
+        client_cache_evictions.labels(reason=reason).inc()
+        client_cache_size.set(len(self._client_cache))
+        qdrant_store = entry[0]
+        client = getattr(qdrant_store, "_client", None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception as e:
+                logger.info(f"Failed to close Qdrant client of {collection_name}: {e}")
+
+    def bump_collection_version(self, collection_name: str) -> int:
+        """Marks the collection as changed, dropping its cached search results in every worker."""
+        version = self.collection_versions.bump(collection_name)
+        for key in [key for key in self._result_cache if key[0] == collection_name]:
+            del self._result_cache[key]
+        result_cache_size.set(len(self._result_cache))
+        return version
+
+    def _result_key(self, collection_name: str, input: EmbedDoc) -> tuple:
+        """Cache key of a search: the collection version plus a hash of the embedding and parameters."""
+        digest = hashlib.blake2b(np.asarray(input.embedding, dtype=np.float32).tobytes(), digest_size=16)
+        params = (
+            input.search_type,
+            input.k,
+            input.fetch_k,
+            input.lambda_mult,
+            input.score_threshold,
+            input.distance_threshold,
+        )
+        digest.update(repr(params).encode())
+        return collection_name, self.collection_versions.get(collection_name), digest.hexdigest()
+
+    def _get_cached_results(self, key: tuple):
+        if not self.result_cache_size:
+            return None
+        entry = self._result_cache.get(key)
+        if entry is not None and self.result_cache_ttl and time.monotonic() - entry[1] > self.result_cache_ttl:
+            del self._result_cache[key]
+            entry = None
+        if entry is None:
+            result_cache_misses.inc()
+            return None
+        self._result_cache.move_to_end(key)
+        result_cache_hits.inc()
+        return _copy_results(entry[0])
+
+    def _cache_results(self, key: tuple, results: list):
+        if not self.result_cache_size or key[1] != self.collection_versions.get(key[0]):
+            # the collection changed while the search ran
+            return
+        self._result_cache[key] = (_copy_results(results), time.monotonic())
+        self._result_cache.move_to_end(key)
+        while len(self._result_cache) > self.result_cache_size:
+            self._result_cache.popitem(last=False)
+        result_cache_size.set(len(self._result_cache))
+
     def check_health(self) -> bool:
         """Checks the health of the retriever service using the default collection.
 
@@ -51,14 +233,36 @@ class OpeaQDrantRetriever(OpeaComponent):
             logger.info("[ check health ] start to check health of QDrant")
         try:
             # Use default collection for health check
-            db_store, _ = self._initialize_client(QDRANT_INDEX_NAME)
+            db_store, _ = self._get_client(QDRANT_INDEX_NAME)
             _ = db_store.client
             logger.info("[ check health ] Successfully connected to QDrant!")
             return True
         except Exception as e:
             logger.info(f"[ check health ] Failed to connect to QDrant: {e}")
+            self._evict(QDRANT_INDEX_NAME, "error")
             return False
 
+    def _search_kwargs(self, input: EmbedDoc) -> dict:
+        """Translates the retriever parameters of the request into Qdrant search arguments.
+
+        Top-k and score thresholds are applied by Qdrant, so filtered-out points are never
+        transferred. For "mmr", `fetch_k` candidates are fetched with their vectors and
+        re-ranked locally.
+        """
+        if input.search_type == "similarity":
+            return {"top_k": input.k}
+        elif input.search_type == "similarity_score_threshold":
+            return {"top_k": input.k, "score_threshold": input.score_threshold}
+        elif input.search_type == "similarity_distance_threshold":
+            if input.distance_threshold is None:
+                raise ValueError("distance_threshold must be provided for similarity_distance_threshold retriever")
+            # collections are created with cosine distance, where distance = 1 - score
+            return {"top_k": input.k, "score_threshold": 1.0 - input.distance_threshold}
+        elif input.search_type == "mmr":
+            return {"top_k": max(input.fetch_k, input.k), "return_embedding": True}
+        else:
+            raise ValueError(f"Unsupported search_type: {input.search_type}")
+
     async def invoke(self, input: EmbedDoc) -> list:
         """Search the QDrant index for the most similar documents to the input query.
 
@@ -71,8 +275,101 @@ class OpeaQDrantRetriever(OpeaComponent):
             logger.info(f"[ similarity search ] input: {input}")
 
         collection_name = input.collection_name or QDRANT_INDEX_NAME
-        db_store, retriever = self._initialize_client(collection_name)
-        search_res = retriever.run(query_embedding=input.embedding)["documents"]
+        search_kwargs = self._search_kwargs(input)
+        cache_key = self._result_key(collection_name, input)
+        cached = self._get_cached_results(cache_key)
+        if cached is not None:
+            return cached
+
+        db_store, retriever = self._get_client(collection_name)
+        try:
+            search_res = retriever.run(query_embedding=input.embedding, **search_kwargs)["documents"]
+        except Exception as e:
+            if not _is_missing_collection_error(e):
+                raise
+            # the collection was dropped (and maybe recreated) since the store was cached
+            logger.info(f"[ similarity search ] refreshing cached client of {collection_name}: {e}")
+            self._evict(collection_name, "dropped")
+            db_store, retriever = self._get_client(collection_name)
+            search_res = retriever.run(query_embedding=input.embedding, **search_kwargs)["documents"]
+
+        final_res = self._format_results(input, search_res)
+        self._cache_results(cache_key, final_res)
+
+        if logflag:
+            logger.info(f"[ similarity search ] search result: {final_res}")
+
+        return final_res
+
+    async def invoke_batch(self, inputs: List[EmbedDoc]) -> List[list]:
+        """Search many queries with one Qdrant batch request per collection.
+
+        Args:
+            inputs (List[EmbedDoc]): The input queries, possibly targeting different collections.
+        Output:
+            List[list]: The retrieved documents of each query, in the order of `inputs`.
+        """
+        if logflag:
+            logger.info(f"[ batch search ] {len(inputs)} queries")
+
+        # collection name -> positions of its uncached queries in `inputs`
+        final_res = [None] * len(inputs)
+        cache_keys = [None] * len(inputs)
+        groups = OrderedDict()
+        for i, input in enumerate(inputs):
+            collection_name = input.collection_name or QDRANT_INDEX_NAME
+            cache_keys[i] = self._result_key(collection_name, input)
+            final_res[i] = self._get_cached_results(cache_keys[i])
+            if final_res[i] is None:
+                groups.setdefault(collection_name, []).append(i)
+
+        for collection_name, indexes in groups.items():
+            db_store, _ = self._get_client(collection_name)
+            try:
+                requests = [self._query_request(db_store, inputs[i]) for i in indexes]
+                batch_res = db_store.client.query_batch_points(collection_name=collection_name, requests=requests)
+            except Exception as e:
+                if not _is_missing_collection_error(e):
+                    raise
+                logger.info(f"[ batch search ] refreshing cached client of {collection_name}: {e}")
+                self._evict(collection_name, "dropped")
+                db_store, _ = self._get_client(collection_name)
+                requests = [self._query_request(db_store, inputs[i]) for i in indexes]
+                batch_res = db_store.client.query_batch_points(collection_name=collection_name, requests=requests)
+
+            for i, response in zip(indexes, batch_res):
+                search_res = [
+                    convert_qdrant_point_to_haystack_document(point, use_sparse_embeddings=db_store.use_sparse_embeddings)
+                    for point in response.points
+                ]
+                final_res[i] = self._format_results(inputs[i], search_res)
+                self._cache_results(cache_keys[i], final_res[i])
+
+        return final_res
+
+    def _query_request(self, db_store: QdrantDocumentStore, input: EmbedDoc) -> models.QueryRequest:
+        """Builds the Qdrant batch query of one request, with the same semantics as `_search_kwargs`.
+
+        The dense vector is named like in the single-query search of the document store: the
+        collection has named vectors only when it also stores sparse embeddings.
+        """
+        search_kwargs = self._search_kwargs(input)
+        return models.QueryRequest(
+            query=input.embedding,
+            using=DENSE_VECTORS_NAME if db_store.use_sparse_embeddings else None,
+            limit=search_kwargs["top_k"],
+            score_threshold=search_kwargs.get("score_threshold"),
+            with_vector=search_kwargs.get("return_embedding", False),
+            with_payload=True,
+        )
+
+    def _format_results(self, input: EmbedDoc, search_res: list) -> list:
+        """Applies MMR selection if requested and formats documents for opea_retrievers_microservice.py."""
+        if input.search_type == "mmr" and search_res:
+            selected = maximal_marginal_relevance(
+                input.embedding, [res.embedding for res in search_res], lambda_mult=input.lambda_mult, k=input.k
+            )
+            search_res = [search_res[i] for i in selected]
 
         # format result to align with the standard output in opea_retrievers_microservice.py
         final_res = []
@@ -80,8 +377,4 @@ class OpeaQDrantRetriever(OpeaComponent):
             dict_res = res.meta
             res_obj = SimpleNamespace(**dict_res)
             final_res.append(res_obj)
-
-        if logflag:
-            logger.info(f"[ similarity search ] search result: {final_res}")
-
         return final_res
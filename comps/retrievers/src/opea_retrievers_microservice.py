@@ -6,6 +6,7 @@ import os
 import time
 from typing import Union
 
+from fastapi import HTTPException, Request
 
 # import for retrievers component registration
 from integrations.qdrant import OpeaQDrantRetriever
@@ -13,10 +14,12 @@ from integrations.qdrant import OpeaQDrantRetriever
 from comps import (
     CustomLogger,
     EmbedDoc,
+    EmbedDocBatch,
     EmbedMultimodalDoc,
     OpeaComponentLoader,
     SearchedDoc,
     SearchedMultimodalDoc,
+    SearchedMultimodalDocBatch,
     ServiceType,
     TextDoc,
     opea_microservices,
@@ -36,6 +39,10 @@ logger = CustomLogger("opea_retrievers_microservice")
 logflag = os.getenv("LOGFLAG", False)
 
 retriever_component_name = os.getenv("RETRIEVER_COMPONENT_NAME", "OPEA_RETRIEVER_QDRANT")
+# Coalesce concurrent single-query requests into one batch search
+dynamic_batching = os.getenv("RETRIEVER_DYNAMIC_BATCHING", "false").lower() == "true"
+dynamic_batching_timeout = float(os.getenv("RETRIEVER_DYNAMIC_BATCHING_TIMEOUT", 0.005))
+dynamic_batching_max_batch_size = int(os.getenv("RETRIEVER_DYNAMIC_BATCHING_MAX_BATCH_SIZE", 32))
 # Initialize OpeaComponentLoader
 loader = OpeaComponentLoader(
     retriever_component_name,
@@ -43,12 +50,37 @@ loader = OpeaComponentLoader(
 )
 
 
+def format_searched_doc(input: EmbedDoc, response: list) -> SearchedMultimodalDoc:
+    retrieved_docs = []
+    metadata_list = []
+    for r in response:
+        # If the input had an image, pass that through in the metadata along with the search result image
+        if isinstance(input, EmbedMultimodalDoc) and input.base64_image:
+            if r.metadata["b64_img_str"]:
+                r.metadata["b64_img_str"] = [input.base64_image, r.metadata["b64_img_str"]]
+            else:
+                r.metadata["b64_img_str"] = input.base64_image
+        if r.metadata:
+            metadata_list.append(r.metadata)
+        retrieved_docs.append(TextDoc(text=r.page_content))
+    return SearchedMultimodalDoc(retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list)
+
+
+def supports_batch_search() -> bool:
+    return hasattr(loader.component, "invoke_batch")
+
+
 @register_microservice(
     name="opea_service@retrievers",
     service_type=ServiceType.RETRIEVER,
     endpoint="/v1/retrieval",
     host="0.0.0.0",
     port=7000,
+    # components without a batch search serve every request on its own
+    dynamic_batching=dynamic_batching and supports_batch_search(),
+    dynamic_batching_timeout=dynamic_batching_timeout,
+    dynamic_batching_max_batch_size=dynamic_batching_max_batch_size,
+    dynamic_batching_handler=loader.component.invoke_batch if supports_batch_search() else None,
 )
 @register_statistics(names=["opea_service@retrievers"])
 async def retrieve_docs(
@@ -60,26 +92,18 @@ async def retrieve_docs(
         logger.info(f"[ retrieval ] input:{input}")
 
     try:
-        # Use the loader to invoke the component
-        response = await loader.invoke(input)
+        service = opea_microservices["opea_service@retrievers"]
+        if service.dynamic_batching and type(input) is EmbedDoc:
+            # queued with concurrent requests and searched as one batch
+            response = await service.submit_dynamic_batch(ServiceType.RETRIEVER, input)
+        else:
+            # Use the loader to invoke the component
+            response = await loader.invoke(input)
 
         # return different response format
         retrieved_docs = []
         if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-            metadata_list = []
-            for r in response:
-                # If the input had an image, pass that through in the metadata along with the search result image
-                if isinstance(input, EmbedMultimodalDoc) and input.base64_image:
-                    if r.metadata["b64_img_str"]:
-                        r.metadata["b64_img_str"] = [input.base64_image, r.metadata["b64_img_str"]]
-                    else:
-                        r.metadata["b64_img_str"] = input.base64_image
-                if r.metadata:
-                    metadata_list.append(r.metadata)
-                retrieved_docs.append(TextDoc(text=r.page_content))
-            result = SearchedMultimodalDoc(
-                retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list
-            )
+            result = format_searched_doc(input, response)
         else:
             for r in response:
                 if isinstance(r, str):
@@ -106,6 +130,64 @@ async def retrieve_docs(
         raise
 
 
+@register_microservice(
+    name="opea_service@retrievers",
+    service_type=ServiceType.RETRIEVER,
+    endpoint="/v1/retrieval/batch",
+    host="0.0.0.0",
+    port=7000,
+)
+@register_statistics(names=["opea_service@retrievers_batch"])
+async def retrieve_docs_batch(input: EmbedDocBatch) -> SearchedMultimodalDocBatch:
+    start = time.time()
+
+    if logflag:
+        logger.info(f"[ retrieval batch ] {len(input.docs)} queries")
+
+    if not supports_batch_search():
+        raise HTTPException(status_code=400, detail=f"{retriever_component_name} does not support batch retrieval.")
+
+    try:
+        responses = await loader.component.invoke_batch(input.docs)
+        result = SearchedMultimodalDocBatch(
+            results=[format_searched_doc(doc, response) for doc, response in zip(input.docs, responses)]
+        )
+
+        # Record statistics
+        statistics_dict["opea_service@retrievers_batch"].append_latency(time.time() - start, None)
+
+        if logflag:
+            logger.info(f"[ retrieval batch ] Output generated: {result}")
+
+        return result
+
+    except Exception as e:
+        logger.error(f"[ retrieval batch ] Error during retrieval invocation: {e}")
+        raise
+
+
+@register_microservice(
+    name="opea_service@retrievers",
+    service_type=ServiceType.RETRIEVER,
+    endpoint="/v1/retrieval/invalidate",
+    host="0.0.0.0",
+    port=7000,
+)
+async def invalidate_retrieval_cache(request: Request):
+    """Drop cached search results of a collection; called by dataprep when its files change"""
+    data = await request.json()
+    collection_name = data.get("collection_name")
+    if not collection_name:
+        raise HTTPException(status_code=400, detail="collection_name is required.")
+
+    version = None
+    if hasattr(loader.component, "bump_collection_version"):
+        version = loader.component.bump_collection_version(collection_name)
+    if logflag:
+        logger.info(f"[ retrieval invalidate ] {collection_name} is now at version {version}")
+    return {"message": "Cache invalidated", "collection_name": collection_name, "version": version}
+
+
 if __name__ == "__main__":
     logger.info("OPEA Retriever Microservice is starting...")
     opea_microservices["opea_service@retrievers"].start()
@@ -0,0 +1,190 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from comps.cores.mega.shared_versions import SharedVersions
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("true", "1", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# JSON list of {"question", "answer", "collection_name", "sources"} loaded at startup
+SEMANTIC_CACHE_FAQ_FILE = os.getenv("SEMANTIC_CACHE_FAQ_FILE", "")
+
+DEFAULT_COLLECTION = "default"
+# version name bumped by invalidate() without a collection
+_ALL_COLLECTIONS = "*"
+
+semantic_cache_hits = Counter("semantic_cache_hits", "Semantic answer cache hits")
+semantic_cache_misses = Counter("semantic_cache_misses", "Semantic answer cache misses")
+semantic_cache_invalidations = Counter(
+    "semantic_cache_invalidations", "Semantic answer cache invalidations", ["collection"]
+)
+semantic_cache_entries = Gauge(
+    "semantic_cache_entries", "Number of cached answers", ["collection"], multiprocess_mode="livesum"
+)
+
+
+class CachedAnswer:
+    def __init__(self, question: str, answer: str, sources: List[Dict], pinned: bool = False):
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.pinned = pinned
+        self.created_at = time.monotonic()
+
+
+class _CollectionCache:
+    """Answers of one collection, with their normalized question embeddings stacked in one matrix."""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # entry id => (CachedAnswer, normalized embedding), in LRU order
+        self.next_id = 0
+        self._matrix = None
+        self._ids = []
+        # shared versions of the collection and of all collections the learned answers belong to
+        self.version = (0, 0)
+
+    def add(self, entry: CachedAnswer, embedding: np.ndarray):
+        self.entries[self.next_id] = (entry, embedding)
+        self.next_id += 1
+        self._matrix = None
+
+    def remove(self, entry_id: int):
+        del self.entries[entry_id]
+        self._matrix = None
+
+    def nearest(self, query: np.ndarray):
+        if not self.entries:
+            return None, 0.0
+        if self._matrix is None:
+            self._ids = list(self.entries.keys())
+            self._matrix = np.stack([embedding for _, embedding in self.entries.values()])
+        similarities = self._matrix @ query
+        best = int(np.argmax(similarities))
+        return self._ids[best], float(similarities[best])
+
+
+def _normalize(embedding) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    if vector.size == 0 or norm == 0.0:
+        return None
+    return vector / norm
+
+
+class SemanticCache:
+    """Answers of past questions, looked up by cosine similarity of the question embedding.
+
+    Entries are scoped per collection, expire after `ttl` seconds and the least recently used are
+    dropped beyond `max_entries` per collection. `invalidate` drops the learned answers of a
+    collection when its documents change; preloaded FAQ answers are pinned and survive it.
+    Invalidations are versioned in shared memory, so they reach every HTTPService worker.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._collections: Dict[str, _CollectionCache] = {}
+        self._versions = SharedVersions()
+
+    def _sync(self, collection_name: str, cache: _CollectionCache):
+        """Drop the learned answers of `cache` if another worker invalidated its collection."""
+        version = (self._versions.get(collection_name), self._versions.get(_ALL_COLLECTIONS))
+        if cache.version != version:
+            self._drop_learned(cache)
+            cache.version = version
+
+    def _drop_learned(self, cache: _CollectionCache):
+        for entry_id, (entry, _) in list(cache.entries.items()):
+            if not entry.pinned:
+                cache.remove(entry_id)
+
+    def lookup(self, collection_name: Optional[str], embedding) -> Optional[CachedAnswer]:
+        collection_name = collection_name or DEFAULT_COLLECTION
+        cache = self._collections.get(collection_name)
+        if cache is not None:
+            self._sync(collection_name, cache)
+        query = _normalize(embedding)
+        if cache is None or query is None:
+            semantic_cache_misses.inc()
+            return None
+
+        while True:
+            entry_id, similarity = cache.nearest(query)
+            if entry_id is None or similarity < self.threshold:
+                semantic_cache_misses.inc()
+                return None
+            entry, _ = cache.entries[entry_id]
+            if self._is_expired(entry):
+                cache.remove(entry_id)
+                self._update_gauge(collection_name)
+                continue
+            cache.entries.move_to_end(entry_id)
+            semantic_cache_hits.inc()
+            return entry
+
+    def store(
+        self,
+        collection_name: Optional[str],
+        question: str,
+        embedding,
+        answer: str,
+        sources: List[Dict],
+        pinned: bool = False,
+    ):
+        vector = _normalize(embedding)
+        if vector is None or not answer:
+            return
+        collection_name = collection_name or DEFAULT_COLLECTION
+        cache = self._collections.setdefault(collection_name, _CollectionCache())
+        self._sync(collection_name, cache)
+        cache.add(CachedAnswer(question, answer, sources, pinned=pinned), vector)
+
+        # drop expired answers first, then the least recently used ones
+        for entry_id, (entry, _) in list(cache.entries.items()):
+            if self._is_expired(entry):
+                cache.remove(entry_id)
+        for entry_id, (entry, _) in list(cache.entries.items()):
+            if len(cache.entries) <= self.max_entries:
+                break
+            if not entry.pinned:
+                cache.remove(entry_id)
+        self._update_gauge(collection_name)
+
+    def invalidate(self, collection_name: Optional[str] = None):
+        """Drop the learned answers of a collection, or of all collections when none is given."""
+        self._versions.bump(collection_name or _ALL_COLLECTIONS)
+        names = [collection_name] if collection_name else list(self._collections)
+        for name in names:
+            cache = self._collections.get(name)
+            if cache is None:
+                continue
+            self._sync(name, cache)
+            semantic_cache_invalidations.labels(collection=name).inc()
+            self._update_gauge(name)
+
+    def _is_expired(self, entry: CachedAnswer) -> bool:
+        return not entry.pinned and self.ttl > 0 and time.monotonic() - entry.created_at > self.ttl
+
+    def _update_gauge(self, collection_name: str):
+        semantic_cache_entries.labels(collection=collection_name).set(len(self._collections[collection_name].entries))
+
+
+def load_faq(path: str = SEMANTIC_CACHE_FAQ_FILE) -> List[Dict]:
+    if not path:
+        return []
+    with open(path) as f:
+        faq = json.load(f)
+    return [item for item in faq if item.get("question") and item.get("answer")]
@@ -0,0 +1,94 @@
+import os
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+# "tiktoken:<encoding>" or a Hugging Face tokenizer id; defaults to the tokenizer of the served model
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "")
+
+_tokenizer_factories: Dict[str, Callable[[], Callable[[str], int]]] = {}
+
+
+def register_tokenizer(model_id: str, factory: Callable[[], Callable[[str], int]]):
+    """Register how to build the token counting function of a model.
+
+    `factory` is called once, lazily, and must return a callable mapping a text to its token count.
+    """
+    _tokenizer_factories[model_id] = factory
+    get_tokenizer.cache_clear()
+
+
+def _tiktoken_counter(encoding_name: str) -> Callable[[str], int]:
+    import tiktoken
+
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _huggingface_counter(model_id: str) -> Callable[[str], int]:
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_id: str) -> Callable[[str], int]:
+    """Return the token counting function for `model_id`.
+
+    Registered factories win, then LLM_TOKENIZER, then the model's Hugging Face tokenizer. When that
+    cannot be loaded (offline, gated model), the count falls back to tiktoken cl100k_base.
+    """
+    if model_id in _tokenizer_factories:
+        return _tokenizer_factories[model_id]()
+
+    name = LLM_TOKENIZER or model_id
+    if name.startswith("tiktoken:"):
+        return _tiktoken_counter(name.split(":", 1)[1])
+    try:
+        return _huggingface_counter(name)
+    except Exception as e:
+        print(f"Tokenizer of {name} unavailable ({e}), counting tokens with tiktoken cl100k_base")
+        return _tiktoken_counter("cl100k_base")
+
+
+class TokenCounter:
+    """Counts generated tokens incrementally while a response streams.
+
+    Every delta is counted when it arrives, so the total is ready when the stream ends. If the
+    upstream server reports `usage`, its completion_tokens replace the local estimate.
+    """
+
+    def __init__(self, model_id: str, start_time: Optional[float] = None):
+        self.count_tokens = get_tokenizer(model_id)
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.first_token_time = None
+        self.counted_tokens = 0
+        self.usage_tokens = None
+
+    def add_delta(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        tokens = self.count_tokens(text)
+        self.counted_tokens += tokens
+        return tokens
+
+    def add_text(self, text: str) -> int:
+        """Count a complete, non-streamed answer"""
+        return self.add_delta(text)
+
+    def set_usage(self, usage: Optional[Dict]):
+        if usage and usage.get("completion_tokens") is not None:
+            self.usage_tokens = int(usage["completion_tokens"])
+
+    @property
+    def total(self) -> int:
+        return self.usage_tokens if self.usage_tokens is not None else self.counted_tokens
+
+    def tokens_per_second(self, now: Optional[float] = None) -> float:
+        """Decode throughput so far, measured from the first token"""
+        now = now if now is not None else time.perf_counter()
+        since = self.first_token_time if self.first_token_time is not None else self.start_time
+        return self.total / max(now - since, 0.001)
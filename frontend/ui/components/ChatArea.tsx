@@ -377,7 +377,6 @@ export default function ChatArea({
         const streamingMessageId = `streaming-${Date.now()}`;
         setStreamingMessageId(streamingMessageId);
         
-        let fullResponseText = '';
         let responseMetrics: Metrics | null = null;
         let sourcesFromResponse: Array<{ source: string; relevance_score: number; content: string; }> = [];
 
@@ -419,10 +418,13 @@ export default function ChatArea({
           }));
         }
 
+        // the token lets the backend queue the request with the priority of the user's department
+        const authToken = localStorage.getItem('authToken');
         const response = await fetch(`${CHAT_QNA_URL}/api/conversations/${targetConversationId}`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            ...(authToken ? { Authorization: `Bearer ${authToken}` } : {}),
           },
           body: JSON.stringify(requestBody),
         });
@@ -437,6 +439,76 @@ export default function ChatArea({
 
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let answerText = '';
+        let answerFrame: number | null = null;
+        let pending = '';
+
+        const updateStreamingMessage = (update: Partial<Message>) => {
+          setMessages(prev =>
+            prev.map(msg =>
+              msg.id === streamingMessageId ? { ...msg, ...update } : msg
+            )
+          );
+        };
+
+        const flushAnswer = () => {
+          answerFrame = null;
+          const formattedText = answerText
+            .replace(/\r\n/g, '\n')
+            .replace(/\n{3,}/g, '\n\n');
+          updateStreamingMessage(
+            formattedText.trim() !== ''
+              ? { content: formattedText, isThinking: false }
+              : { content: formattedText }
+          );
+        };
+
+        // The backend streams server-sent events: sources, token, metrics, error and done
+        const handleEvent = (rawEvent: string) => {
+          let eventType = 'message';
+          const dataLines: string[] = [];
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event:')) {
+              eventType = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+              dataLines.push(line.slice(5).trimStart());
+            }
+          }
+          if (dataLines.length === 0) {
+            return;
+          }
+
+          let payload: any;
+          try {
+            payload = JSON.parse(dataLines.join('\n'));
+          } catch (e) {
+            console.error('Failed to parse stream event:', e);
+            return;
+          }
+
+          switch (eventType) {
+            case 'sources':
+              sourcesFromResponse = payload || [];
+              updateStreamingMessage({ sources: sourcesFromResponse });
+              break;
+            case 'token':
+              answerText += payload.content || '';
+              // re-render once per frame, however many tokens arrived in it
+              if (answerFrame === null) {
+                answerFrame = requestAnimationFrame(flushAnswer);
+              }
+              break;
+            case 'metrics':
+              responseMetrics = payload;
+              updateStreamingMessage({ metrics: responseMetrics });
+              break;
+            case 'error':
+              console.error('Stream error:', payload.message);
+              break;
+            default:
+              break;
+          }
+        };
 
         while (true) {
           const { done, value } = await reader.read();
@@ -444,97 +516,28 @@ export default function ChatArea({
           if (done) {
             break;
           }
-          const chunk = decoder.decode(value, { stream: true });
-
-          const metricsMatch = chunk.match(/__METRICS__(.*?)__METRICS__/);
-          if (metricsMatch) {
-            try {
-              const metricsData = JSON.parse(metricsMatch[1]);
-              responseMetrics = metricsData.metrics;
-              setMessages(prev =>
-                prev.map(msg =>
-                  msg.id === streamingMessageId
-                    ? { 
-                        ...msg, 
-                        metrics: responseMetrics,
-                      }
-                    : msg
-                )
-              );
-              
-              fullResponseText += chunk.replace(/__METRICS__(.*?)__METRICS__/, '');
-            } catch (e) {
-              console.error('Failed to parse metrics:', e);
-              fullResponseText += chunk;
-            }
-          } else {
-            fullResponseText += chunk;
-          }
-
-          const formattedText = fullResponseText
-            .replace(/\r\n/g, '\n')
-            .replace(/\n{3,}/g, '\n\n');
+          pending += decoder.decode(value, { stream: true });
 
-          if (formattedText.trim() !== '') {
-            setMessages(prev =>
-              prev.map(msg =>
-                msg.id === streamingMessageId
-                  ? { 
-                      ...msg, 
-                      content: formattedText,
-                      isThinking: false
-                    }
-                  : msg
-              )
-            );
-          } else {
-            setMessages(prev =>
-              prev.map(msg =>
-                msg.id === streamingMessageId
-                  ? { ...msg, content: formattedText }
-                  : msg
-              )
-            );
+          let boundary = pending.indexOf('\n\n');
+          while (boundary !== -1) {
+            handleEvent(pending.slice(0, boundary));
+            pending = pending.slice(boundary + 2);
+            boundary = pending.indexOf('\n\n');
           }
         }
+        if (pending.trim() !== '') {
+          handleEvent(pending);
+        }
+        if (answerFrame !== null) {
+          cancelAnimationFrame(answerFrame);
+          flushAnswer();
+        }
 
-        setMessages(prev =>
-          prev.map(msg =>
-            msg.id === streamingMessageId
-              ? {
-                  ...msg,
-                  isStreaming: false,
-                  isThinking: false,
-                  metrics: responseMetrics
-                }
-              : msg
-          )
-        );
-
-        axios.get(`${CHAT_QNA_URL}/api/conversations/${targetConversationId}?db_name=lenovo-db`)
-          .then(response => {
-            if (response.data && response.data.history && response.data.history.length > 0) {
-              const latestTurn = response.data.history.filter((turn: { question: string; sources?: any[] }) => 
-                turn.question === messageContent
-              ).pop();
-              
-              if (latestTurn && latestTurn.sources) {
-                setMessages(prev =>
-                  prev.map(msg =>
-                    msg.id === streamingMessageId
-                      ? {
-                          ...msg,
-                          sources: latestTurn.sources
-                        }
-                      : msg
-                  )
-                );
-              }
-            }
-          })
-          .catch(error => {
-            console.error("Error fetching conversation with sources:", error);
-          });
+        updateStreamingMessage({
+          isStreaming: false,
+          isThinking: false,
+          metrics: responseMetrics
+        });
 
         setUploadedFiles([]);
         setIsLoading(false);
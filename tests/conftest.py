@@ -0,0 +1,12 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the backend runs from comps/ and imports both `comps` and its top-level modules (main, prompt_builder, ...)
+for path in (ROOT, os.path.join(ROOT, "comps")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,74 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+import pytest
+
+from comps.cores.mega import base_statistics
+from comps.cores.mega.base_statistics import BaseStatistics, remove_process_statistics
+
+
+@pytest.fixture
+def statistics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(base_statistics, "STATISTICS_DIR", str(tmp_path))
+    # the writer thread of the test process stays asleep, the tests flush explicitly
+    monkeypatch.setattr(base_statistics, "STATISTICS_FLUSH_INTERVAL", 3600)
+    return tmp_path
+
+
+def test_only_the_most_recent_latencies_are_kept(monkeypatch):
+    monkeypatch.setattr(base_statistics, "STATISTICS_MAX_SAMPLES", 3)
+    statistic = BaseStatistics("test")
+    for latency in (100, 1, 2, 3):
+        statistic.append_latency(latency, latency)
+
+    result = statistic.get_statistics()
+
+    assert result["p99_latency"] == pytest.approx(2.98)
+    assert result["average_latency_first_token"] == 2
+
+
+def test_requests_do_not_write_files(statistics_dir):
+    statistic = BaseStatistics("test")
+
+    statistic.append_latency(1.0)
+
+    assert os.listdir(statistics_dir) == []
+
+
+def test_flush_replaces_the_file_with_the_bounded_window(statistics_dir, monkeypatch):
+    monkeypatch.setattr(base_statistics, "STATISTICS_MAX_SAMPLES", 2)
+    statistic = BaseStatistics("test")
+    for latency in (1.0, 2.0, 3.0):
+        statistic.append_latency(latency)
+        statistic.flush()
+
+    (name,) = os.listdir(statistics_dir)
+    assert name == f"statistics_test_{os.getpid()}.stats"
+    with open(statistics_dir / name) as f:
+        assert json.load(f) == {"latency": [2.0, 3.0], "latency_first_token": []}
+
+
+def test_statistics_cover_the_other_workers(statistics_dir):
+    other_worker = statistics_dir / "statistics_test_999999.stats"
+    other_worker.write_text(json.dumps({"latency": [3.0, 5.0], "latency_first_token": [0.5]}))
+    # another statistic whose name starts the same
+    (statistics_dir / "statistics_test_batch_999999.stats").write_text(json.dumps({"latency": [100.0]}))
+    statistic = BaseStatistics("test")
+    statistic.append_latency(1.0, 0.1)
+
+    result = statistic.get_statistics()
+
+    assert result["average_latency"] == 3.0
+    assert result["average_latency_first_token"] == pytest.approx(0.3)
+
+
+def test_files_of_an_exited_worker_are_removed(statistics_dir):
+    (statistics_dir / "statistics_test_999999.stats").write_text("{}")
+    (statistics_dir / "statistics_test_1.stats").write_text("{}")
+
+    remove_process_statistics(999999)
+
+    assert os.listdir(statistics_dir) == ["statistics_test_1.stats"]
@@ -0,0 +1,177 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+
+import aiohttp
+import pytest
+
+from comps.cores.mega import resilience
+from comps.cores.mega.resilience import CircuitBreaker, CircuitOpenError, hedged, is_service_failure
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def open_breaker(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30, probe_timeout=60)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.before_call() is False
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_one_probe_after_the_reset_timeout(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+
+    assert breaker.before_call() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_success_closes_the_circuit(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before_call() is False
+
+
+def test_probe_failure_opens_the_circuit_again(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1
+    assert breaker.before_call() is True
+
+
+def test_released_probe_lets_the_next_call_probe(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.release_probe()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.before_call() is True
+
+
+def test_probe_that_never_reports_back_is_replaced(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    clock.now += 59
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 1
+
+    assert breaker.before_call() is True
+
+
+def test_release_probe_does_nothing_when_closed(clock):
+    breaker = CircuitBreaker("test")
+
+    breaker.release_probe()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+@pytest.mark.parametrize(
+    "error, failure",
+    [
+        (asyncio.TimeoutError(), True),
+        (aiohttp.ClientConnectionError(), True),
+        (response_error(503), True),
+        (response_error(400), False),
+        (ValueError(), False),
+    ],
+)
+def test_is_service_failure(error, failure):
+    assert is_service_failure(error) is failure
+
+
+def test_hedge_wins_over_a_slow_call():
+    calls = []
+
+    async def call():
+        name = "first" if not calls else "hedge"
+        calls.append(name)
+        await asyncio.sleep(1 if name == "first" else 0)
+        return name
+
+    assert asyncio.run(hedged(call, 0.01, "test")) == "hedge"
+    assert calls == ["first", "hedge"]
+
+
+def test_no_hedge_without_a_delay():
+    async def call():
+        return "first"
+
+    assert asyncio.run(hedged(call, None, "test")) == "first"
+
+
+def test_cancelling_during_the_hedge_delay_cancels_the_call():
+    started = []
+
+    async def call():
+        started.append(asyncio.current_task())
+        await asyncio.sleep(10)
+
+    async def cancel_caller():
+        caller = asyncio.ensure_future(hedged(call, 5, "test"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # checked before asyncio.run cancels what is left over
+        (first,) = started
+        return first.cancelled()
+
+    assert asyncio.run(cancel_caller())
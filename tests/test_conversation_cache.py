@@ -0,0 +1,120 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import conversation_cache
+from conversation_cache import ConversationCache, estimate_turn_size
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def turn(i, size=10):
+    return {"question": f"q{i}", "answer": "a" * size}
+
+
+def test_miss_then_hit():
+    cache = ConversationCache()
+    assert cache.get("c1") is None
+
+    cache.put("c1", [turn(0)])
+
+    assert cache.get("c1") == [turn(0)]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_append_extends_cached_history_only():
+    cache = ConversationCache()
+    cache.put("c1", [turn(0)])
+
+    cache.append("c1", turn(1))
+    cache.append("c2", turn(0))
+
+    assert cache.get("c1") == [turn(0), turn(1)]
+    assert "c2" not in cache
+
+
+def test_least_recently_used_is_evicted_beyond_max_entries():
+    cache = ConversationCache(max_entries=2)
+    cache.put("c1", [turn(0)])
+    cache.put("c2", [turn(0)])
+    cache.get("c1")
+
+    cache.put("c3", [turn(0)])
+
+    assert "c1" in cache and "c3" in cache
+    assert "c2" not in cache
+
+
+def test_byte_budget():
+    size = estimate_turn_size(turn(0, size=100))
+    cache = ConversationCache(max_bytes=2 * size)
+    cache.put("c1", [turn(0, size=100)])
+    cache.put("c2", [turn(0, size=100)])
+    assert len(cache) == 2
+
+    cache.append("c2", turn(1, size=100))
+
+    assert "c1" not in cache
+    assert cache.get("c2") is not None
+    assert cache.stats()["bytes"] == 2 * size
+
+
+def test_single_conversation_over_the_byte_budget_is_kept():
+    cache = ConversationCache(max_bytes=10)
+    cache.put("c1", [turn(0, size=100)])
+
+    assert cache.get("c1") is not None
+
+
+def test_idle_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(conversation_cache.time, "monotonic", clock)
+    cache = ConversationCache(idle_ttl=60)
+    cache.put("c1", [turn(0)])
+    cache.put("c2", [turn(0)])
+
+    clock.now += 30
+    assert cache.get("c2") is not None
+    clock.now += 45
+
+    assert cache.get("c1") is None
+    assert cache.get("c2") is not None
+
+
+def test_pop_removes_and_returns_history():
+    cache = ConversationCache()
+    cache.put("c1", [turn(0)])
+
+    assert cache.pop("c1") == [turn(0)]
+    assert cache.pop("c1", "gone") == "gone"
+    assert cache.stats()["bytes"] == 0
+
+
+def test_change_by_another_worker_makes_the_copy_stale():
+    # both caches share the versions the way forked workers do
+    cache = ConversationCache()
+    other = ConversationCache()
+    other._versions = cache._versions
+    cache.put("c1", [turn(0)])
+    other.put("c1", [turn(0)])
+
+    other.append("c1", turn(1))
+
+    assert cache.get("c1") is None
+    assert other.get("c1") == [turn(0), turn(1)]
+
+
+def test_history_loaded_before_a_concurrent_append_is_not_cached_as_current():
+    cache = ConversationCache()
+    version = cache.version("c1")
+    # another worker appends while this one reads the history from Mongo
+    cache._versions.bump("c1")
+
+    cache.put("c1", [turn(0)], version)
+
+    assert cache.get("c1") is None
@@ -0,0 +1,181 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import copy
+import json
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("motor", "pymongo", "passlib", "jwt", "langchain_core"):
+    pytest.importorskip(module)
+
+from fastapi import HTTPException  # noqa: E402
+
+import main  # noqa: E402
+
+
+def evaluate(expression, document):
+    """The aggregation expressions used by the history endpoint: $ifNull, $size and $slice."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if isinstance(expression, dict):
+        (operator, args), = expression.items()
+        if operator == "$ifNull":
+            value = evaluate(args[0], document)
+            return value if value is not None else args[1]
+        if operator == "$size":
+            return len(evaluate(args, document))
+        if operator == "$slice":
+            array, skip, limit = evaluate(args[0], document), args[1], args[2]
+            return array[skip : skip + limit]
+        raise NotImplementedError(operator)
+    return expression
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents[:length]
+
+
+class FakeCollection:
+    """In-memory collection applying the update operators and aggregation stages of main.py."""
+
+    full_name = "test-db.conversations"
+
+    def __init__(self):
+        self.documents = []
+        self.indexes = []
+
+    async def create_index(self, key):
+        self.indexes.append(key)
+
+    async def update_one(self, query, update, upsert=False):
+        document = next((d for d in self.documents if all(d.get(k) == v for k, v in query.items())), None)
+        if document is None:
+            assert upsert
+            document = dict(query)
+            self.documents.append(document)
+            document.update(update.get("$setOnInsert", {}))
+        document.update(update.get("$set", {}))
+        for field, value in update.get("$push", {}).items():
+            document.setdefault(field, []).append(value)
+
+    async def find_one(self, query):
+        for document in self.documents:
+            if all(document.get(k) == v for k, v in query.items()):
+                return copy.deepcopy(document)
+        return None
+
+    def aggregate(self, pipeline):
+        documents = copy.deepcopy(self.documents)
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                documents = [d for d in documents if all(d.get(k) == v for k, v in spec.items())]
+            elif name == "$limit":
+                documents = documents[:spec]
+            elif name == "$project":
+                documents = [
+                    {k: d.get(k) if v == 1 else evaluate(v, d) for k, v in spec.items() if v != 0}
+                    for d in documents
+                ]
+            else:
+                raise NotImplementedError(name)
+        return FakeCursor(documents)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(main, "get_async_mongo_client", lambda: {"test-db": {"conversations": collection}})
+    service = main.ConversationRAGService.__new__(main.ConversationRAGService)
+    service.active_conversations = main.ConversationCache()
+    service.indexed_collections = set()
+    return service, collection
+
+
+def history_request(conversation_id, **query_params):
+    return SimpleNamespace(
+        query_params={"db_name": "test-db", **{k: str(v) for k, v in query_params.items()}},
+        path_params={"conversation_id": conversation_id},
+    )
+
+
+def save_turns(service, collection, conversation_id, count):
+    for i in range(count):
+        asyncio.run(
+            service.save_conversation_turn(conversation_id, f"question {i}", collection, f"answer {i}", [])
+        )
+
+
+def test_turns_are_appended_to_a_single_document(service):
+    service, collection = service
+    save_turns(service, collection, "c1", 3)
+
+    assert len(collection.documents) == 1
+    document = collection.documents[0]
+    assert [turn["question"] for turn in document["history"]] == ["question 0", "question 1", "question 2"]
+    assert "created_at" in document and "last_updated" in document
+    assert collection.indexes == ["conversation_id"]
+
+
+def test_created_at_is_only_set_on_insert(service):
+    service, collection = service
+    save_turns(service, collection, "c1", 1)
+    created_at = collection.documents[0]["created_at"]
+    save_turns(service, collection, "c1", 1)
+
+    assert collection.documents[0]["created_at"] == created_at
+
+
+def test_history_page(service):
+    service, collection = service
+    save_turns(service, collection, "c1", 5)
+
+    response = asyncio.run(service.handle_get_history(history_request("c1", skip=1, limit=2)))
+    page = json.loads(response.body)
+
+    assert page["total_turns"] == 5
+    assert (page["skip"], page["limit"]) == (1, 2)
+    assert [turn["question"] for turn in page["history"]] == ["question 1", "question 2"]
+
+
+def test_history_without_pagination_returns_every_turn(service):
+    service, collection = service
+    save_turns(service, collection, "c1", 3)
+
+    response = asyncio.run(service.handle_get_history(history_request("c1")))
+
+    assert len(json.loads(response.body)["history"]) == 3
+
+
+def test_history_rejects_a_non_positive_limit(service):
+    service, collection = service
+    save_turns(service, collection, "c1", 1)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.handle_get_history(history_request("c1", limit=0)))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("query", [{"limit": "ten"}, {"skip": "1.5"}])
+def test_history_rejects_non_integer_pagination(service, query):
+    service, collection = service
+    save_turns(service, collection, "c1", 1)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.handle_get_history(history_request("c1", **query)))
+    assert error.value.status_code == 400
+
+
+def test_history_page_of_an_unknown_conversation(service):
+    service, _ = service
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.handle_get_history(history_request("missing", limit=5)))
+    assert error.value.status_code == 404
@@ -0,0 +1,35 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+
+import pytest
+
+from comps.cores.mega.constants import ServiceType
+from comps.cores.mega.micro_service import MicroService
+
+
+def remote_service(service_type, **kwargs):
+    return MicroService("test", service_type=service_type, use_remote_service=True, dynamic_batching=True, **kwargs)
+
+
+def test_service_type_without_batched_inference_is_rejected():
+    with pytest.raises(ValueError, match="dynamic_batching_handler"):
+        remote_service(ServiceType.LLM)
+
+
+@pytest.mark.parametrize("service_type", [ServiceType.EMBEDDING, ServiceType.RERANK])
+def test_built_in_batched_inference(service_type):
+    assert remote_service(service_type).dynamic_batching
+
+
+def test_handler_serves_its_service_type():
+    async def handler(requests):
+        return [request.upper() for request in requests]
+
+    service = remote_service(ServiceType.RETRIEVER, dynamic_batching_handler=handler)
+
+    batch = [{"request": "a"}, {"request": "b"}]
+    assert asyncio.run(service.dynamic_batching_infer(ServiceType.RETRIEVER, batch)) == ["A", "B"]
+    with pytest.raises(ValueError):
+        asyncio.run(service.submit_dynamic_batch(ServiceType.LLM, "a"))
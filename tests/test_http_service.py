@@ -0,0 +1,58 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import signal
+import socket
+import time
+import urllib.request
+
+import pytest
+
+from comps.cores.mega.http_service import HTTPService
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_served(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                return response.status
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"port {port} is not served")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-forked workers need os.fork")
+def test_stop_drains_the_workers_of_the_master():
+    port = free_port()
+    service = HTTPService(
+        runtime_args={"protocol": "http", "host": "127.0.0.1", "port": port, "title": "test", "description": "test"},
+        workers=2,
+    )
+    service._async_setup()
+    for _ in range(service.workers):
+        service._spawn_worker()
+    pids = list(service._worker_pids)
+    try:
+        assert wait_until_served(port) == 200
+
+        service.stop()
+    finally:
+        # do not leave workers behind when stop fails
+        for pid in service._worker_pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    assert service._worker_pids == {}
+    for pid in pids:
+        with pytest.raises(ChildProcessError):
+            os.waitpid(pid, os.WNOHANG)
+    with pytest.raises(OSError):
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
@@ -0,0 +1,101 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from comps.cores.mega import load_balancer
+from comps.cores.mega.load_balancer import EndpointPool, parse_endpoints
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(load_balancer.time, "monotonic", clock)
+    return clock
+
+
+def acquire(pool, replica):
+    """Acquire a specific replica, as acquire would when it is the least loaded one."""
+    others = [r for r in pool.replicas if r is not replica]
+    for other in others:
+        other.in_flight += 1
+    try:
+        acquired = pool.acquire()
+    finally:
+        for other in others:
+            other.in_flight -= 1
+    assert acquired is replica
+    return acquired
+
+
+def test_parse_endpoints():
+    assert parse_endpoints("tei-0:8080, tei-1,,tei-2:81", 80) == [("tei-0", 8080), ("tei-1", 80), ("tei-2", 81)]
+
+
+def test_invalid_pools():
+    with pytest.raises(ValueError):
+        EndpointPool("test", [])
+    with pytest.raises(ValueError):
+        EndpointPool("test", ["a:1"], policy="round_robin")
+
+
+@pytest.mark.parametrize("policy", EndpointPool.POLICIES)
+def test_least_loaded_replica_is_picked(policy):
+    pool = EndpointPool("test", ["a:1", "b:2"], policy=policy)
+
+    first = pool.acquire()
+    second = pool.acquire()
+
+    assert {first.address, second.address} == {"a:1", "b:2"}
+    pool.release(first)
+    assert pool.acquire() is first
+
+
+def test_release_balances_in_flight_counts():
+    pool = EndpointPool("test", ["a:1", "b:2", "c:3"])
+    replicas = [pool.acquire() for _ in range(6)]
+
+    assert [stat["in_flight"] for stat in pool.stats()] == [2, 2, 2]
+    for replica in replicas:
+        pool.release(replica)
+    assert [stat["in_flight"] for stat in pool.stats()] == [0, 0, 0]
+
+
+def test_failing_replica_is_ejected_for_a_while(clock):
+    pool = EndpointPool("test", ["a:1", "b:2"], ejection_failures=2, ejection_time=30)
+    a = pool.replicas[0]
+    for _ in range(2):
+        pool.release(acquire(pool, a), ok=False)
+
+    assert [replica.address for replica in pool.healthy()] == ["b:2"]
+    assert pool.acquire().address == "b:2"
+
+    clock.now += 30
+    assert len(pool.healthy()) == 2
+
+
+def test_success_resets_the_failure_count(clock):
+    pool = EndpointPool("test", ["a:1", "b:2"], ejection_failures=2)
+    a = pool.replicas[0]
+    pool.release(acquire(pool, a), ok=False)
+    pool.release(acquire(pool, a), ok=True)
+    pool.release(acquire(pool, a), ok=False)
+
+    assert len(pool.healthy()) == 2
+
+
+def test_every_replica_is_used_when_all_are_ejected(clock):
+    pool = EndpointPool("test", ["a:1", "b:2"], ejection_failures=1)
+    for replica in list(pool.replicas):
+        pool.release(acquire(pool, replica), ok=False)
+
+    assert all(stat["ejected"] for stat in pool.stats())
+    assert len(pool.healthy()) == 2
@@ -0,0 +1,131 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import prompt_builder  # noqa: E402
+from prompt_builder import assemble_prompt, truncate_to_sentences  # noqa: E402
+from token_counter import register_tokenizer  # noqa: E402
+
+MODEL = "test-model"
+QUESTION = "what?"
+MAX_TOKENS = 10
+# tokens of the template filled with the question only
+OVERHEAD = 3
+
+
+class Template:
+    def format(self, context, question):
+        return f"Context:\n{context}\nQuestion: {question}"
+
+
+def count_words(text):
+    return len(text.split())
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    register_tokenizer(MODEL, lambda: count_words)
+    monkeypatch.setattr(prompt_builder, "PROMPT_RESERVED_TOKENS", 0)
+    monkeypatch.setattr(prompt_builder, "PROMPT_MIN_CHUNK_TOKENS", 3)
+    monkeypatch.setattr(prompt_builder, "PROMPT_MIN_CONTEXT_TOKENS", 0)
+
+
+def with_budget(monkeypatch, budget):
+    monkeypatch.setitem(prompt_builder._context_windows, MODEL, budget + MAX_TOKENS + OVERHEAD)
+
+
+def assemble(docs, scores=None):
+    return assemble_prompt(Template(), QUESTION, docs, scores, model_id=MODEL, max_tokens=MAX_TOKENS)
+
+
+def test_every_doc_fits(monkeypatch):
+    with_budget(monkeypatch, 100)
+    docs = ["alpha beta gamma", "delta epsilon zeta", "eta theta iota"]
+
+    assembled = assemble(docs)
+
+    assert assembled.selected == [0, 1, 2]
+    assert assembled.prompt == Template().format(context="\n".join(docs), question=QUESTION)
+    assert assembled.context_tokens == 9
+    assert assembled.prompt_tokens == count_words(assembled.prompt)
+
+
+def test_docs_are_packed_by_score(monkeypatch):
+    with_budget(monkeypatch, 100)
+
+    assembled = assemble(["low score doc", "high score doc", "mid score doc"], scores=[0.1, 0.9, 0.5])
+
+    assert assembled.selected == [1, 2, 0]
+    assert assembled.prompt.index("high") < assembled.prompt.index("mid") < assembled.prompt.index("low")
+
+
+def test_near_duplicates_of_a_better_doc_are_dropped(monkeypatch):
+    with_budget(monkeypatch, 100)
+    doc = "the quick brown fox jumps over the lazy dog near the river bank today"
+    docs = [doc, doc.upper() + "!", "an entirely different chunk about something else"]
+
+    assert assemble(docs).selected == [0, 2]
+
+
+def test_budget_cuts_the_first_doc_that_does_not_fit_at_a_sentence(monkeypatch):
+    with_budget(monkeypatch, 20)
+    docs = [
+        "one two three four five six seven eight nine ten",
+        "First sentence of five words. Second sentence that no longer fits.",
+        "never reached",
+    ]
+
+    assembled = assemble(docs)
+
+    assert assembled.selected == [0, 1]
+    assert "First sentence of five words." in assembled.prompt
+    assert "Second" not in assembled.prompt and "never" not in assembled.prompt
+    assert assembled.context_tokens <= 20
+
+
+def test_doc_is_dropped_when_too_little_of_it_would_remain(monkeypatch):
+    with_budget(monkeypatch, 12)
+    docs = ["one two three four five six seven eight nine ten", "Two words. And more words here."]
+
+    assembled = assemble(docs)
+
+    assert assembled.selected == [0]
+    assert assembled.context_tokens == 10
+
+
+def test_large_max_tokens_leaves_a_minimum_context(monkeypatch):
+    with_budget(monkeypatch, 2)
+    monkeypatch.setattr(prompt_builder, "PROMPT_MIN_CONTEXT_TOKENS", 6)
+    warnings = []
+    monkeypatch.setattr(prompt_builder.logger, "warning", warnings.append)
+
+    assembled = assemble(["one two three", "four five six", "never reached"])
+
+    assert assembled.selected == [0, 1]
+    assert assembled.context_tokens == 6
+    # the 2 tokens max_tokens left for docs are raised to 6, taken from the answer
+    assert assembled.max_tokens == MAX_TOKENS + 2 - 6
+    assert len(warnings) == 1
+
+
+def test_max_tokens_is_kept_when_the_docs_fit(monkeypatch):
+    with_budget(monkeypatch, 100)
+    monkeypatch.setattr(prompt_builder, "PROMPT_MIN_CONTEXT_TOKENS", 50)
+
+    assert assemble(["content"]).max_tokens == MAX_TOKENS
+
+
+def test_empty_docs_are_skipped(monkeypatch):
+    with_budget(monkeypatch, 100)
+
+    assert assemble(["  ", "content"]).selected == [1]
+
+
+def test_truncate_to_sentences():
+    text = "One two. Three four five! Six seven eight nine?"
+
+    assert truncate_to_sentences(text, 5, count_words) == "One two. Three four five!"
+    assert truncate_to_sentences(text, 1, count_words) == ""
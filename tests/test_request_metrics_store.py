@@ -0,0 +1,102 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from comps.cores.mega import base_statistics
+from comps.cores.mega.base_statistics import RequestMetricsStore
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clocks(monkeypatch):
+    monotonic, wall = Clock(1000.0), Clock(1_700_000_000.0)
+    monkeypatch.setattr(base_statistics.time, "monotonic", monotonic)
+    monkeypatch.setattr(base_statistics.time, "time", wall)
+    return monotonic, wall
+
+
+def test_complete_merges_values_and_stops_tracking(clocks):
+    store = RequestMetricsStore()
+    metrics = store.start("r1")
+    metrics["ttft"] = 0.2
+
+    result = store.complete("r1", e2e_latency=1.5)
+
+    assert result["completed"] and result["ttft"] == 0.2 and result["e2e_latency"] == 1.5
+    assert store.get("r1") is None
+    assert store.get_statistics()["in_flight"] == 0
+
+
+def test_in_flight_requests_expire_after_ttl(clocks):
+    monotonic, _ = clocks
+    store = RequestMetricsStore(ttl=60)
+    store.start("old")
+    monotonic.now += 30
+    store.start("new")
+    monotonic.now += 45
+
+    statistics = store.get_statistics()
+
+    assert statistics["in_flight"] == 1
+    assert statistics["expired"] == 1
+    assert store.get("old") is None and store.get("new") is not None
+
+
+def test_oldest_requests_are_dropped_beyond_max_entries(clocks):
+    store = RequestMetricsStore(max_entries=2)
+    for request_id in ("r1", "r2", "r3"):
+        store.start(request_id)
+
+    assert store.get("r1") is None
+    assert store.expired == 1
+
+
+def test_completing_an_expired_request_still_counts(clocks):
+    monotonic, _ = clocks
+    store = RequestMetricsStore(ttl=1)
+    store.start("r1")
+    monotonic.now += 5
+    store.start("r2")
+
+    store.complete("r1", e2e_latency=2.0)
+
+    assert store.get_statistics()["per_minute"][0]["requests"] == 1
+
+
+def test_per_minute_percentiles(clocks):
+    store = RequestMetricsStore()
+    for i in range(1, 101):
+        store.start(str(i))
+        store.complete(str(i), e2e_latency=float(i), ttft=0.1)
+
+    (minute,) = store.get_statistics()["per_minute"]
+
+    assert minute["requests"] == 100
+    assert minute["p50_e2e_latency"] == pytest.approx(50.5)
+    assert minute["p95_e2e_latency"] == pytest.approx(95.05)
+    assert minute["p99_e2e_latency"] == pytest.approx(99.01)
+    assert minute["p50_ttft"] == pytest.approx(0.1)
+    assert minute["p50_prompt_tokens"] is None
+
+
+def test_buckets_roll_over_and_leave_the_window(clocks):
+    _, wall = clocks
+    store = RequestMetricsStore(window_minutes=2)
+    store.start("r1")
+    store.complete("r1", e2e_latency=1.0)
+    wall.now += 60
+    store.start("r2")
+    store.complete("r2", e2e_latency=3.0)
+
+    assert [m["p50_e2e_latency"] for m in store.get_statistics()["per_minute"]] == [1.0, 3.0]
+
+    wall.now += 60
+    assert [m["p50_e2e_latency"] for m in store.get_statistics()["per_minute"]] == [3.0]
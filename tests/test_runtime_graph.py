@@ -0,0 +1,93 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import OrderedDict
+
+import pytest
+
+from comps.cores.mega.dag import ExecutionPlan, RuntimeGraph
+
+
+@pytest.fixture
+def plan():
+    # the embedding -> retriever -> rerank -> llm chain of the megaservice
+    return ExecutionPlan(
+        OrderedDict(
+            [
+                ("embedding", ["retriever"]),
+                ("retriever", ["rerank"]),
+                ("rerank", ["llm"]),
+                ("llm", []),
+            ]
+        )
+    )
+
+
+def test_plan(plan):
+    assert plan.order == ("embedding", "retriever", "rerank", "llm")
+    assert plan.ind_nodes == ("embedding",)
+    assert plan.leaves == ("llm",)
+    assert plan.upstreams["llm"] == ("rerank",)
+    with pytest.raises(AttributeError):
+        plan.order = ()
+
+
+def test_skip_bridges_the_node_without_touching_the_plan(plan):
+    graph = RuntimeGraph(plan)
+
+    graph.skip("rerank")
+
+    assert graph.downstream("retriever") == ["llm"]
+    assert graph.predecessors("llm") == ["retriever"]
+    assert graph.nodes() == ["embedding", "retriever", "llm"]
+    assert graph.topological_sort() == ["embedding", "retriever", "llm"]
+    # other requests still see the full plan
+    assert RuntimeGraph(plan).downstream("retriever") == ["rerank"]
+
+
+def test_prune_deletes_nodes_unreachable_from_the_roots(plan):
+    graph = RuntimeGraph(plan)
+    graph.delete_edge("retriever", "rerank")
+
+    graph.prune(plan.ind_nodes)
+
+    assert graph.nodes() == ["embedding", "retriever"]
+    assert "rerank" not in graph and "llm" not in graph
+    assert graph.all_leaves() == ["retriever"]
+
+
+def test_prune_keeps_a_reachable_graph(plan):
+    graph = RuntimeGraph(plan)
+
+    graph.prune(plan.ind_nodes)
+
+    assert graph.nodes() == list(plan.nodes)
+
+
+def test_prune_with_a_deleted_root_deletes_everything(plan):
+    graph = RuntimeGraph(plan)
+    graph.delete_node("embedding")
+
+    graph.prune(plan.ind_nodes)
+
+    assert graph.size() == 0
+
+
+def test_added_edges_must_keep_the_graph_acyclic(plan):
+    graph = RuntimeGraph(plan)
+    graph.add_edge("embedding", "llm")
+
+    assert graph.downstream("embedding") == ["retriever", "llm"]
+    assert graph.all_downstreams("embedding") == ["retriever", "rerank", "llm"]
+    with pytest.raises(Exception, match="validation error"):
+        graph.add_edge("llm", "embedding")
+
+
+def test_missing_nodes_and_edges(plan):
+    graph = RuntimeGraph(plan)
+    graph.delete_node("rerank")
+
+    with pytest.raises(KeyError):
+        graph.downstream("rerank")
+    with pytest.raises(KeyError):
+        graph.delete_edge("embedding", "llm")
@@ -0,0 +1,83 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+for module in ("motor", "pymongo", "passlib", "jwt", "langchain_core"):
+    pytest.importorskip(module)
+
+import main  # noqa: E402
+from main import iter_stream_lines, sse_event  # noqa: E402
+from token_counter import register_tokenizer  # noqa: E402
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def lines(*parts):
+    async def collect():
+        return [line async for line in iter_stream_lines(chunks(*parts))]
+
+    return asyncio.run(collect())
+
+
+def parse_events(stream: str):
+    events = []
+    for block in stream.split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_event_framing():
+    assert sse_event("token", {"text": "Hi"}) == 'event: token\ndata: {"text": "Hi"}\n\n'
+
+
+def test_events_round_trip():
+    data = {"text": "two\nlines", "sources": [{"id": 1}]}
+    stream = sse_event("sources", data["sources"]) + sse_event("token", data["text"]) + sse_event("done", {})
+
+    assert parse_events(stream) == [("sources", [{"id": 1}]), ("token", "two\nlines"), ("done", {})]
+
+
+def test_lines_split_across_chunks():
+    assert lines(b"data: {\"a\"", b": 1}\n\ndata: [DO", b"NE]\n") == ['data: {"a": 1}', "", "data: [DONE]"]
+
+
+def test_multibyte_character_split_across_chunks():
+    encoded = "data: naïve 日本\n".encode()
+    split = encoded.index("日".encode()) + 1
+
+    assert lines(encoded[:split], encoded[split:]) == ["data: naïve 日本"]
+
+
+def test_last_line_without_newline():
+    assert lines(b"data: a\n", b"data: b") == ["data: a", "data: b"]
+
+
+def test_undecodable_bytes_are_replaced():
+    assert lines(b"data: \xff\n") == ["data: �"]
+
+
+@pytest.mark.parametrize("error", [aiohttp.ClientPayloadError("truncated"), aiohttp.ServerDisconnectedError()])
+def test_upstream_failure_mid_stream_still_ends_the_protocol(error):
+    register_tokenizer(main.LLM_MODEL, lambda: lambda text: len(text.split()))
+
+    async def upstream():
+        yield b'data: {"choices": [{"delta": {"content": "Hello"}, "finish_reason": null}]}\n\n'
+        raise error
+
+    async def collect():
+        return "".join([event async for event in main.align_generator(None, upstream(), request_id="r1")])
+
+    events = [event for event, _ in parse_events(asyncio.run(collect()))]
+
+    assert events == ["sources", "token", "error", "metrics", "done"]